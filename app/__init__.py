@@ -1,28 +1,46 @@
 import os
-import logging
-from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 from flask import Flask, render_template
+from jinja2 import FileSystemBytecodeCache
 from flask_wtf.csrf import CSRFProtect
 
 load_dotenv()
 
 from config import Config, DevelopmentConfig, ProductionConfig
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_caching import Cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from flask_migrate import Migrate
 from werkzeug.middleware.proxy_fix import ProxyFix
-db = SQLAlchemy()
+
+
+class ShardedSession(Session):
+    """
+    Session that sends every table except the shard directory to the shard
+    selected with app.sharding.use_shard (the default database when none is)
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = self.info.get('shard')
+        if bind is None and shard and not (mapper is not None and inspect(mapper).local_table.info.get('directory')):
+            return self._db.engines[f'shard{shard}']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 mail = Mail()
 csrf = CSRFProtect()
 cache = Cache()
 limiter = Limiter(key_func=get_remote_address, default_limits=["200 per day", "50 per hour"])
+migrate = Migrate()
 
 def create_app(config_class=None):
     app = Flask(__name__)
@@ -37,12 +55,17 @@ def create_app(config_class=None):
     # Initialize extensions
     app.jinja_env.add_extension('jinja2.ext.do')
     csrf.init_app(app)
+    # Shard binds have to be configured before the engines are created
+    from app import sharding
+    sharding.init_app(app)
     db.init_app(app)
     bcrypt.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
     cache.init_app(app)
     limiter.init_app(app)
+    # Schema migrations (flask db upgrade), run on every shard
+    migrate.init_app(app, db, directory=os.path.join(os.path.dirname(app.root_path), 'migrations'))
     
     login_manager.login_view = "users.login"
     login_manager.login_message_category = "info"
@@ -50,14 +73,60 @@ def create_app(config_class=None):
     # Create instance folder
     os.makedirs(app.instance_path, exist_ok=True)
     
+    # Compiled templates survive worker restarts
+    if app.config.get('JINJA_BYTECODE_CACHE'):
+        bytecode_dir = os.path.join(app.instance_path, 'jinja_cache')
+        os.makedirs(bytecode_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+    
     # Register blueprints
     from app.main.routes import main
     from app.transactions.routes import transactions
     from app.users.routes import users
+    from app.api.routes import api
+    from app.budgets.routes import budgets
+    from app.households.routes import households
     
     app.register_blueprint(main)
     app.register_blueprint(transactions)
     app.register_blueprint(users)
+    app.register_blueprint(api)
+    app.register_blueprint(budgets)
+    app.register_blueprint(households)
+    
+    # Compression and fingerprinted static files
+    from app import assets, compression
+    compression.init_app(app)
+    assets.init_app(app)
+    
+    # Transaction write hooks (data versions and derived state)
+    from app.events import register_listeners
+    register_listeners()
+    
+    # Live dashboard updates for open tabs
+    from app import live
+    live.init_app(app)
+    
+    # Derived ledger state (balance checkpoints) and its maintenance CLI
+    from app import commands
+    commands.init_app(app)
+    
+    # Compiled auto-categorization rules
+    from app import categorize
+    categorize.init_app(app)
+    
+    # Exchange rates held in memory for conversions on write
+    from app import fx
+    fx.init_app(app)
+    
+    # Password hashing pool and its calibrated cost
+    from app import passwords
+    passwords.init_app(app)
+    
+    # Optional in-memory analytics engine (imports numpy)
+    if app.config.get('ANALYTICS_ENGINE'):
+        from app import analytics
+        analytics.init_app(app)
         
     # Error handlers
     @app.errorhandler(404)
@@ -88,23 +157,10 @@ def create_app(config_class=None):
         return response
         
     
-    # Setup logging
+    # Queued logging with request context (file output outside debug/testing)
+    from app import logs
+    logs.init_app(app)
     if not app.debug and not app.testing:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        
-        file_handler = RotatingFileHandler(
-            'logs/finance_tracker.log',
-            maxBytes=10240000,
-            backupCount=10
-        )
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-        ))
-        file_handler.setLevel(logging.INFO)
-        
-        app.logger.addHandler(file_handler)
-        app.logger.setLevel(logging.INFO)
         app.logger.info('Finance Tracker startup')
     
     
@@ -118,6 +174,7 @@ def create_app(config_class=None):
     app.jinja_env.globals.update(
         get_category_color=get_category_color,
         get_category_icon=get_category_icon,
+        currency_symbol=fx.currency_symbol,
     )
     
     return app
\ No newline at end of file
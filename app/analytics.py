@@ -0,0 +1,326 @@
+"""
+In-memory columnar ledger cache for dashboard and filter analytics.
+
+Enabled with ANALYTICS_ENGINE = True. Each user's transactions are loaded
+once into compact NumPy arrays (date as ordinal days, amount in cents of the
+base currency, type and category codes); totals, category breakdowns and filter summaries are
+then answered with vectorized masks and ``bincount`` instead of a SQL scan
+per filter combination.
+
+Entries are tagged with the user's data_version. Writes made in this
+process are applied incrementally after commit; writes from any other
+process leave the entry behind the stored version, and it is reloaded on
+next use. Least recently used entries are evicted to stay within
+ANALYTICS_CACHE_BYTES.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy import BigInteger, cast, func
+from app import db
+from app.events import on_commit
+from app.fx import base_amount, base_currency, join_rates
+from app.models import Transaction, TransactionType, User
+
+EXPENSE, INCOME = 0, 1
+NO_DATE = np.iinfo(np.int32).min
+
+
+def to_cents(amount):
+    return int((Decimal(str(amount)) * 100).to_integral_value())
+
+
+def _type_code(tx_type):
+    return INCOME if TransactionType(tx_type) == TransactionType.INCOME else EXPENSE
+
+
+def _day(value):
+    return value.toordinal() if value is not None else NO_DATE
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_amount(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LedgerColumns:
+    """One user's transactions as parallel arrays, ordered by id"""
+
+    COLUMNS = ('ids', 'days', 'cents', 'types', 'categories', 'alive')
+
+    def __init__(self, version, ids, days, cents, types, categories, category_names):
+        self.version = version
+        self.size = len(ids)
+        self.ids = ids
+        self.days = days
+        self.cents = cents
+        self.types = types
+        self.categories = categories
+        self.alive = np.ones(self.size, dtype=bool)
+        self.dead = 0
+        self.category_names = list(category_names)
+        self.category_codes = {name: code for code, name in enumerate(self.category_names)}
+
+    @classmethod
+    def load(cls, user_id, version, chunk_size=50000):
+        base = base_currency(user_id)
+        query = db.session.query(
+            Transaction.id,
+            Transaction.date,
+            cast(func.round(base_amount(base) * 100), BigInteger),
+            Transaction.type,
+            Transaction.category
+        ).select_from(Transaction)
+        rows = join_rates(query, base)\
+            .filter(Transaction.user_id == user_id)\
+            .order_by(Transaction.id)\
+            .execution_options(yield_per=chunk_size)
+
+        ids, days, cents, types, categories = [], [], [], [], []
+        names = {}
+        for tx_id, tx_date, tx_cents, tx_type, category in rows:
+            ids.append(tx_id)
+            days.append(_day(tx_date))
+            cents.append(tx_cents or 0)
+            types.append(_type_code(tx_type))
+            categories.append(names.setdefault(category, len(names)))
+
+        return cls(
+            version,
+            np.array(ids, dtype=np.int64),
+            np.array(days, dtype=np.int32),
+            np.array(cents, dtype=np.int64),
+            np.array(types, dtype=np.int8),
+            np.array(categories, dtype=np.int16),
+            names
+        )
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+    # -- incremental maintenance --------------------------------------------
+
+    def _category_code(self, name):
+        code = self.category_codes.get(name)
+        if code is None:
+            code = self.category_codes[name] = len(self.category_names)
+            self.category_names.append(name)
+        return code
+
+    def _position(self, tx_id):
+        pos = int(np.searchsorted(self.ids[:self.size], tx_id))
+        if pos < self.size and self.ids[pos] == tx_id:
+            return pos
+        return None
+
+    def _grow(self):
+        capacity = max(16, len(self.ids) * 2)
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def _write(self, pos, state):
+        self.days[pos] = _day(state.date)
+        self.cents[pos] = to_cents(state.amount)
+        self.types[pos] = _type_code(state.type)
+        self.categories[pos] = self._category_code(state.category)
+        self.alive[pos] = True
+
+    def apply(self, change):
+        """
+        Apply one committed change
+
+        Returns:
+            False if the change cannot be applied in place and the entry
+            should be dropped
+        """
+        pos = self._position(change.transaction_id)
+        if change.new is None:
+            if pos is not None and self.alive[pos]:
+                self.alive[pos] = False
+                self.dead += 1
+        elif pos is not None:
+            if not self.alive[pos]:
+                self.dead -= 1
+            self._write(pos, change.new)
+        else:
+            # Ids are assigned in increasing order, so inserts append
+            if self.size and change.transaction_id < self.ids[self.size - 1]:
+                return False
+            if self.size == len(self.ids):
+                self._grow()
+            self.ids[self.size] = change.transaction_id
+            self._write(self.size, change.new)
+            self.size += 1
+        self.version = change.version
+        if self.dead > 1024 and self.dead * 4 > self.size:
+            self._compact()
+        return True
+
+    def _compact(self):
+        keep = self.alive[:self.size]
+        for name in self.COLUMNS:
+            setattr(self, name, getattr(self, name)[:self.size][keep].copy())
+        self.size = len(self.ids)
+        self.dead = 0
+
+    # -- queries -------------------------------------------------------------
+
+    def _view(self):
+        n = self.size
+        return self.days[:n], self.cents[:n], self.types[:n], self.categories[:n], self.alive[:n]
+
+    def mask(self, tx_type=None, category=None, start=None, end=None, min_cents=None, max_cents=None):
+        days, cents, types, categories, alive = self._view()
+        mask = alive.copy()
+        if tx_type is not None:
+            mask &= types == _type_code(tx_type)
+        if category is not None:
+            code = self.category_codes.get(category)
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= categories == code
+        if start is not None:
+            mask &= days >= start.toordinal()
+        if end is not None:
+            mask &= (days <= end.toordinal()) & (days != NO_DATE)
+        if min_cents is not None:
+            mask &= cents >= min_cents
+        if max_cents is not None:
+            mask &= cents <= max_cents
+        return mask
+
+    def totals_by_type(self, mask):
+        """Returns (count, income_cents, expense_cents) for the masked rows"""
+        _, cents, types, _, _ = self._view()
+        sums = np.bincount(types[mask], weights=cents[mask], minlength=2)
+        return int(mask.sum()), int(sums[INCOME]), int(sums[EXPENSE])
+
+    def totals_by_category(self, mask):
+        """Returns [(category, cents), ...] for the masked rows, largest first"""
+        _, cents, _, categories, _ = self._view()
+        sums = np.bincount(categories[mask], weights=cents[mask], minlength=len(self.category_names))
+        counts = np.bincount(categories[mask], minlength=len(self.category_names))
+        present = np.nonzero(counts)[0]
+        order = present[np.argsort(-sums[present], kind='stable')]
+        return [(self.category_names[code], int(sums[code])) for code in order]
+
+
+class LedgerCache:
+    """Per-process LRU of LedgerColumns bounded by total array memory"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, user_id, version=None):
+        """Return an up to date LedgerColumns for the user, loading it if needed"""
+        if version is None:
+            version = db.session.get(User, user_id).data_version
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry.version == version:
+                self.entries.move_to_end(user_id)
+                return entry
+
+        entry = LedgerColumns.load(user_id, version)
+        with self.lock:
+            self.entries[user_id] = entry
+            self.entries.move_to_end(user_id)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        total = sum(entry.nbytes for entry in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            total -= evicted.nbytes
+
+    def apply_changes(self, changes):
+        with self.lock:
+            for change in changes:
+                entry = self.entries.get(change.user_id)
+                if entry is None or entry.version >= change.version:
+                    continue
+                if entry.version != change.version - 1 or not entry.apply(change):
+                    del self.entries[change.user_id]
+            self._evict()
+
+    def clear(self, user_id=None):
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+    # -- query API mirroring the SQL helpers ----------------------------------
+
+    def spending_by_category(self, user_id, start_date=None, end_date=None, transaction_type='expense'):
+        ledger = self.get(user_id)
+        mask = ledger.mask(tx_type=transaction_type, start=start_date, end=end_date)
+        return [(category, cents / 100) for category, cents in ledger.totals_by_category(mask)]
+
+    def month_totals(self, user_id, month_start):
+        ledger = self.get(user_id)
+        _, month_income, month_expense = ledger.totals_by_type(ledger.mask(start=month_start))
+        return {
+            'month_income': month_income / 100,
+            'month_expense': month_expense / 100,
+        }
+
+    def filter_summary(self, user_id, filters):
+        """
+        Summary for the transaction list filters
+
+        Returns:
+            Dictionary with count/total_income/total_expense, or None when a
+            filter (free text search, tags) has to be answered by SQL
+        """
+        if filters.get('search') or filters.get('tags'):
+            return None
+        if filters.get('type') and filters['type'] not in {t.value for t in TransactionType}:
+            return None
+        min_amount = _parse_amount(filters.get('min_amount'))
+        max_amount = _parse_amount(filters.get('max_amount'))
+
+        ledger = self.get(user_id)
+        mask = ledger.mask(
+            tx_type=filters.get('type') or None,
+            category=filters.get('category') or None,
+            start=_parse_date(filters.get('date_from')),
+            end=_parse_date(filters.get('date_to')),
+            min_cents=None if min_amount is None else min_amount * 100,
+            max_cents=None if max_amount is None else max_amount * 100,
+        )
+        count, income, expense = ledger.totals_by_type(mask)
+        return {'count': count, 'total_income': income / 100, 'total_expense': expense / 100}
+
+
+@on_commit
+def apply_committed_changes(changes):
+    """Apply committed changes to the ledger cache of the app that wrote them"""
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('ledger_cache')
+    if cache is not None:
+        cache.apply_changes(changes)
+
+
+def init_app(app):
+    app.extensions['ledger_cache'] = LedgerCache(app.config['ANALYTICS_CACHE_BYTES'])
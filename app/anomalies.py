@@ -0,0 +1,336 @@
+"""
+Flags expenses that are unusually large for the user and category.
+
+For every (user, category) the amounts written so far are summarized by
+CategoryStats (count, mean and M2 for Welford's running variance) and by a
+log-scale histogram in CategoryStatsBucket rows, one per bucket of width
+BUCKET_GAMMA, so quantiles are known to within about 5%. Amounts are in
+the user's base currency. Both are updated inside the flush by atomic
+increments (see app/events.py), so judging a new expense reads one stats
+row and a few dozen bucket rows however long the history is.
+
+An expense is flagged when, compared with the amounts before it, it is more
+than ANOMALY_Z_SCORE standard deviations above the mean and in a higher
+bucket than the ANOMALY_QUANTILE. The flag is decided when a row is added or
+edited and is not revisited as later amounts arrive. ``flask anomalies
+backfill`` builds the statistics and flags for existing data in one pass.
+"""
+import math
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import bindparam, case
+from app import db
+from app.archive import archived_amounts
+from app.events import on_flush
+from app.fx import base_amount, base_currency, join_rates
+from app.models import CategoryStats, CategoryStatsBucket, Transaction, TransactionType, User
+from app.saved_views import invalidate_saved_views
+
+# Ratio between consecutive histogram bucket boundaries
+BUCKET_GAMMA = 1.1
+_LOG_GAMMA = math.log(BUCKET_GAMMA)
+
+# Only expenses are checked
+_TYPE = TransactionType.EXPENSE
+
+
+def amount_bucket(amount):
+    """Histogram bucket i holding amounts in [gamma**i, gamma**(i + 1))"""
+    return math.floor(math.log(max(float(amount), 0.01)) / _LOG_GAMMA)
+
+
+def quantile_bucket(buckets, q):
+    """Bucket containing the q-quantile of a {bucket: count} histogram"""
+    total = sum(buckets.values())
+    rank = q * (total - 1)
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen > rank:
+            return bucket
+    return None
+
+
+class RunningStats:
+    """In-memory mirror of one CategoryStats row and its buckets"""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, buckets=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.buckets = buckets if buckets is not None else defaultdict(int)
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.buckets[amount_bucket(x)] += 1
+
+    def remove(self, x):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+        else:
+            mean = (self.count * self.mean - x) / (self.count - 1)
+            self.m2 -= (x - mean) * (x - self.mean)
+            self.count -= 1
+            self.mean = mean
+        bucket = amount_bucket(x)
+        if self.buckets.get(bucket, 0) > 0:
+            self.buckets[bucket] -= 1
+
+    def is_anomaly(self, x, config):
+        """Whether x stands out against the amounts added so far"""
+        if self.count < config['ANOMALY_MIN_COUNT']:
+            return False
+        std = math.sqrt(max(self.m2, 0.0) / (self.count - 1))
+        if x <= self.mean + config['ANOMALY_Z_SCORE'] * std:
+            return False
+        threshold = quantile_bucket(self.buckets, config['ANOMALY_QUANTILE'])
+        return threshold is not None and amount_bucket(x) > threshold
+
+
+_stats = CategoryStats.__table__
+_buckets = CategoryStatsBucket.__table__
+
+_stats_key = (
+    (_stats.c.user_id == bindparam('b_user_id')) &
+    (_stats.c.type == bindparam('b_type')) &
+    (_stats.c.category == bindparam('b_category'))
+)
+_bucket_key = (
+    (_buckets.c.user_id == bindparam('b_user_id')) &
+    (_buckets.c.type == bindparam('b_type')) &
+    (_buckets.c.category == bindparam('b_category')) &
+    (_buckets.c.bucket == bindparam('b_bucket'))
+)
+
+_x = bindparam('b_amount', type_=db.Float)
+
+# Welford's update, evaluated by the database against the row's current
+# values so concurrent writers cannot lose each other's updates
+_add_value = _stats.update().where(_stats_key).values(
+    count=_stats.c.count + 1,
+    mean=_stats.c.mean + (_x - _stats.c.mean) / (_stats.c.count + 1),
+    m2=_stats.c.m2 + (_x - _stats.c.mean) * (_x - _stats.c.mean - (_x - _stats.c.mean) / (_stats.c.count + 1))
+)
+
+_mean_without = (_stats.c.count * _stats.c.mean - _x) / (_stats.c.count - 1)
+_remove_value = _stats.update().where(_stats_key).values(
+    count=case((_stats.c.count > 0, _stats.c.count - 1), else_=0),
+    mean=case((_stats.c.count > 1, _mean_without), else_=0),
+    m2=case((_stats.c.count > 1, _stats.c.m2 - (_x - _mean_without) * (_x - _stats.c.mean)), else_=0)
+)
+
+_add_to_bucket = _buckets.update().where(_bucket_key).values(count=_buckets.c.count + 1)
+_remove_from_bucket = _buckets.update().where(_bucket_key & (_buckets.c.count > 0))\
+    .values(count=_buckets.c.count - 1)
+
+
+def _load_stats(session, keys):
+    """RunningStats for each (user_id, category) key, empty where none exist"""
+    user_ids = {user_id for user_id, _ in keys}
+    categories = {category for _, category in keys}
+    loaded = {key: RunningStats() for key in keys}
+    rows = session.execute(
+        db.select(_stats.c.user_id, _stats.c.category, _stats.c.count, _stats.c.mean, _stats.c.m2)
+        .where(_stats.c.user_id.in_(user_ids), _stats.c.type == _TYPE, _stats.c.category.in_(categories))
+    )
+    existing = set()
+    for user_id, category, count, mean, m2 in rows:
+        if (user_id, category) in loaded:
+            stats = loaded[user_id, category]
+            stats.count, stats.mean, stats.m2 = count, mean, m2
+            existing.add((user_id, category))
+    rows = session.execute(
+        db.select(_buckets.c.user_id, _buckets.c.category, _buckets.c.bucket, _buckets.c.count)
+        .where(_buckets.c.user_id.in_(user_ids), _buckets.c.type == _TYPE, _buckets.c.category.in_(categories))
+    )
+    existing_buckets = set()
+    for user_id, category, bucket, count in rows:
+        if (user_id, category) in loaded:
+            loaded[user_id, category].buckets[bucket] = count
+            existing_buckets.add((user_id, category, bucket))
+    return loaded, existing, existing_buckets
+
+
+@on_flush
+def update_category_stats(session, changes):
+    removed, added = [], []
+    for change in changes:
+        old = change.old if change.old is not None and change.old.type == _TYPE else None
+        new = change.new if change.new is not None and change.new.type == _TYPE else None
+        # Edits that leave type, category, amount and date alone (e.g. a
+        # new description) keep their flag
+        if old is not None and new is not None and old == new:
+            continue
+        if old is not None:
+            removed.append((change.user_id, old.category, float(old.amount)))
+        if new is not None:
+            added.append((change, float(new.amount)))
+        elif change.new is not None:
+            # Now an income: nothing to compare it with
+            change.transaction.is_anomaly = False
+    if not removed and not added:
+        return
+
+    keys = {(user_id, category) for user_id, category, _ in removed}
+    keys |= {(change.user_id, change.new.category) for change, _ in added}
+    loaded, existing, existing_buckets = _load_stats(session, keys)
+
+    # Edited rows are taken out of their old category before the new amount
+    # is judged, and rows added in the same flush are judged in order
+    for user_id, category, amount in removed:
+        loaded[user_id, category].remove(amount)
+    config = current_app.config
+    for change, amount in added:
+        stats = loaded[change.user_id, change.new.category]
+        change.transaction.is_anomaly = stats.is_anomaly(amount, config)
+        stats.add(amount)
+
+    missing = {(change.user_id, change.new.category) for change, _ in added} - existing
+    if missing:
+        session.execute(_stats.insert(), [
+            {'user_id': user_id, 'type': _TYPE, 'category': category, 'count': 0, 'mean': 0.0, 'm2': 0.0}
+            for user_id, category in sorted(missing)
+        ])
+    missing_buckets = {
+        (change.user_id, change.new.category, amount_bucket(amount)) for change, amount in added
+    } - existing_buckets
+    if missing_buckets:
+        session.execute(_buckets.insert(), [
+            {'user_id': user_id, 'type': _TYPE, 'category': category, 'bucket': bucket, 'count': 0}
+            for user_id, category, bucket in sorted(missing_buckets)
+        ])
+
+    if removed:
+        params = [
+            {'b_user_id': user_id, 'b_type': _TYPE, 'b_category': category,
+             'b_amount': amount, 'b_bucket': amount_bucket(amount)}
+            for user_id, category, amount in removed
+        ]
+        session.execute(_remove_value, params)
+        session.execute(_remove_from_bucket, params)
+    if added:
+        params = [
+            {'b_user_id': change.user_id, 'b_type': _TYPE, 'b_category': change.new.category,
+             'b_amount': amount, 'b_bucket': amount_bucket(amount)}
+            for change, amount in added
+        ]
+        session.execute(_add_value, params)
+        session.execute(_add_to_bucket, params)
+
+
+def rebuild_category_stats(user_id, batch_size=5000):
+    """
+    Recompute a user's statistics and anomaly flags from their expenses
+
+    Expenses are streamed in (category, date, id) order, so only one
+    category's statistics are held in memory, and each is judged against
+    the ones before it as if they had been entered in date order. Archived
+    expenses (see app/archive.py) count towards the statistics first; their
+    flags are kept as archived.
+
+    Args:
+        user_id: User whose statistics are replaced
+        batch_size: Rows fetched from the cursor at a time
+
+    Returns:
+        Tuple (expenses read, expenses flagged)
+    """
+    db.session.execute(_stats.delete().where(_stats.c.user_id == user_id))
+    db.session.execute(_buckets.delete().where(_buckets.c.user_id == user_id))
+
+    config = current_app.config
+    stats_rows, bucket_rows, flag_changes = [], [], []
+    read = flagged = 0
+
+    def close(category, stats):
+        stats_rows.append({'user_id': user_id, 'type': _TYPE, 'category': category,
+                           'count': stats.count, 'mean': stats.mean, 'm2': stats.m2})
+        bucket_rows.extend(
+            {'user_id': user_id, 'type': _TYPE, 'category': category, 'bucket': bucket, 'count': count}
+            for bucket, count in stats.buckets.items()
+        )
+
+    base = base_currency(user_id)
+    query = db.select(Transaction.id, Transaction.category, base_amount(base), Transaction.is_anomaly)\
+        .select_from(Transaction)
+    rows = db.session.execute(
+        join_rates(query, base)
+        .where(Transaction.user_id == user_id, Transaction.type == _TYPE)
+        .order_by(Transaction.category, Transaction.date, Transaction.id)
+        .execution_options(yield_per=batch_size)
+    )
+    archived = archived_amounts(user_id, _TYPE)
+
+    def start(category):
+        stats = RunningStats()
+        for amount in archived.pop(category, ()):
+            stats.add(amount)
+        return stats
+
+    category, stats = None, None
+    for transaction_id, row_category, amount, was_anomaly in rows:
+        if row_category != category:
+            if stats is not None:
+                close(category, stats)
+            category, stats = row_category, start(row_category)
+        if amount is None:
+            continue  # no exchange rate for its date
+        amount = float(amount)
+        is_anomaly = stats.is_anomaly(amount, config)
+        stats.add(amount)
+        read += 1
+        flagged += is_anomaly
+        if is_anomaly != bool(was_anomaly):
+            flag_changes.append({'b_id': transaction_id, 'b_flag': is_anomaly})
+    if stats is not None:
+        close(category, stats)
+    # Categories with archived expenses only
+    for category in sorted(archived):
+        close(category, start(category))
+
+    if stats_rows:
+        db.session.execute(_stats.insert(), stats_rows)
+        db.session.execute(_buckets.insert(), bucket_rows)
+    if flag_changes:
+        table = Transaction.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(is_anomaly=bindparam('b_flag')),
+            flag_changes
+        )
+        # Flags are part of cached pages; a new version invalidates them
+        db.session.execute(
+            db.update(User).where(User.id == user_id).values(data_version=User.data_version + 1)
+        )
+        invalidate_saved_views(user_id)
+    return read, flagged
+
+
+def get_recent_anomalies(user_id, limit=5):
+    """
+    The user's most recent flagged expenses
+
+    Args:
+        user_id: Current user's ID
+        limit: Most rows to return
+
+    Returns:
+        List of dictionaries with the transaction and how many times its
+        category's mean amount it is
+    """
+    base = base_currency(user_id)
+    query = db.session.query(Transaction, base_amount(base), CategoryStats.mean).select_from(Transaction)
+    rows = join_rates(query, base)\
+        .outerjoin(CategoryStats, (CategoryStats.user_id == Transaction.user_id) &
+                   (CategoryStats.type == Transaction.type) &
+                   (CategoryStats.category == Transaction.category))\
+        .filter(Transaction.user_id == user_id, Transaction.is_anomaly.is_(True))\
+        .order_by(Transaction.date.desc(), Transaction.id.desc())\
+        .limit(limit)\
+        .all()
+    return [
+        {'transaction': transaction, 'ratio': round(float(amount) / mean, 1) if mean and amount else None}
+        for transaction, amount, mean in rows
+    ]
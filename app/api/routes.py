@@ -0,0 +1,126 @@
+from datetime import date, datetime, timedelta
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user, login_required
+from app.api.utilities import get_changes_since
+from app.main.utilities import TREND_INTERVALS, bucket_starts, get_balance_series, get_forecast, get_trend_series
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+def json_error(message, status=400):
+    return jsonify({'error': message}), status
+
+
+def date_arg(name, default):
+    """Read a YYYY-MM-DD query argument; raises ValueError when malformed"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+@api.route('/sync')
+@login_required
+def sync():
+    """
+    Incremental ledger sync
+    
+    Query args:
+        since: cursor from the previous response (omit or 0 for a full sync)
+        limit: page size, capped at SYNC_MAX_PAGE_SIZE
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', current_app.config['SYNC_PAGE_SIZE']))
+    except ValueError:
+        return json_error('since and limit must be integers')
+    if since < 0 or limit < 1:
+        return json_error('since must be >= 0 and limit >= 1')
+    limit = min(limit, current_app.config['SYNC_MAX_PAGE_SIZE'])
+    
+    version = current_user.data_version
+    if since > version or 0 < since < current_user.sync_horizon:
+        # Cursor from another database (restore, reset), or older than the
+        # pruned tombstones so deletions would be missed: start over
+        return jsonify({'reset': True, 'cursor': 0, 'version': version, 'changes': [], 'has_more': True})
+    
+    changes, has_more = get_changes_since(current_user.id, since, limit)
+    cursor = changes[-1]['seq'] if changes else since
+    
+    return jsonify({
+        'reset': False,
+        'cursor': cursor,
+        'version': version,
+        'changes': changes,
+        'has_more': has_more,
+    })
+
+
+def series_args():
+    """
+    Validated start, end and interval for the time-series endpoints
+    
+    Returns:
+        (start_date, end_date, interval, None) or (None, None, None, error response)
+    """
+    interval = request.args.get('interval', 'month')
+    if interval not in TREND_INTERVALS:
+        return None, None, None, json_error(f"interval must be one of {', '.join(TREND_INTERVALS)}")
+    
+    try:
+        end_date = date_arg('end', date.today())
+        start_date = date_arg('start', end_date - timedelta(days=365))
+    except ValueError:
+        return None, None, None, json_error('start and end must be YYYY-MM-DD dates')
+    if start_date > end_date:
+        return None, None, None, json_error('start must not be after end')
+    
+    max_buckets = current_app.config['TREND_MAX_BUCKETS']
+    if len(bucket_starts(start_date, end_date, interval)) > max_buckets:
+        return None, None, None, json_error(f'range too long for a {interval} interval (max {max_buckets} buckets)')
+    return start_date, end_date, interval, None
+
+
+@api.route('/trends')
+@login_required
+def trends():
+    """
+    Bucketed income/expense series with period-over-period and year-over-year values
+    
+    Query args:
+        start, end: YYYY-MM-DD (default: the last twelve months)
+        interval: day, week or month (default month)
+    """
+    start_date, end_date, interval, error = series_args()
+    if error:
+        return error
+    return jsonify(get_trend_series(current_user.id, current_user.data_version, start_date, end_date, interval))
+
+
+@api.route('/balance')
+@login_required
+def balance():
+    """
+    Running balance at the end of each bucket, for the balance chart
+    
+    Query args:
+        start, end: YYYY-MM-DD (default: the last twelve months)
+        interval: day, week or month (default month)
+    """
+    start_date, end_date, interval, error = series_args()
+    if error:
+        return error
+    return jsonify(get_balance_series(current_user.id, current_user.data_version, start_date, end_date, interval))
+
+
+@api.route('/forecast')
+@login_required
+def forecast():
+    """Projected income, expenses and balance for the coming months, as of the last forecast run"""
+    result = get_forecast(current_user.id)
+    if result is None:
+        return jsonify({'months': [], 'top_categories': [], 'generated_at': None})
+    for month in result['months']:
+        month['month'] = month['month'].isoformat()
+    result['generated_at'] = result['generated_at'].isoformat() if result['generated_at'] else None
+    return jsonify(result)
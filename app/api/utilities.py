@@ -0,0 +1,135 @@
+from sqlalchemy import bindparam, func
+from app import db
+from app.archive import archived_changes
+from app.events import on_flush
+from app.models import Transaction, TransactionTombstone, User
+
+
+@on_flush
+def record_tombstones(session, changes):
+    """Leave a tombstone for every deleted transaction, stamped with its change version"""
+    for change in changes:
+        if change.new is None:
+            session.add(TransactionTombstone(
+                user_id=change.user_id,
+                transaction_id=change.transaction.id,
+                change_seq=change.version
+            ))
+
+
+def serialize_transaction(transaction):
+    return {
+        'id': transaction.id,
+        'seq': transaction.change_seq,
+        'deleted': False,
+        'archived': False,
+        'type': transaction.type.value,
+        'category': transaction.category,
+        'amount': str(transaction.amount),
+        'currency': transaction.currency,
+        'description': transaction.description,
+        'date': transaction.date.isoformat() if transaction.date else None,
+        'created_at': transaction.created_at.isoformat() if transaction.created_at else None,
+        'updated_at': transaction.updated_at.isoformat() if transaction.updated_at else None,
+    }
+
+
+def serialize_archived(row):
+    """An archived transaction, a dict of archive columns; archived rows are read-only"""
+    return {
+        'id': row['id'],
+        'seq': row['change_seq'],
+        'deleted': False,
+        'archived': True,
+        'type': row['type'],
+        'category': row['category'],
+        'amount': str(row['amount']),
+        'currency': row['currency'],
+        'description': row['description'],
+        'date': row['date'].isoformat() if row['date'] else None,
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'updated_at': None,
+    }
+
+
+def serialize_tombstone(tombstone):
+    return {
+        'id': tombstone.transaction_id,
+        'seq': tombstone.change_seq,
+        'deleted': True,
+        'deleted_at': tombstone.deleted_at.isoformat() if tombstone.deleted_at else None,
+    }
+
+
+def get_changes_since(user_id, since, limit):
+    """
+    Get one page of a user's ledger changes after a sync cursor
+    
+    Each transaction appears at most once, with its latest state; deleted
+    transactions appear as tombstones. Both sources are read through their
+    (user_id, change_seq) index, so the cost depends on the number of
+    changes rather than the size of the ledger. Archived transactions
+    newer than the cursor, e.g. all of them on a full sync, come from the
+    archive files (see app.archive.archived_changes).
+    
+    Args:
+        user_id: Current user's ID
+        since: Cursor returned by the previous page (0 for a full sync)
+        limit: Maximum number of changes to return
+    
+    Returns:
+        Tuple (changes, has_more) with changes ordered by sequence
+    """
+    rows = Transaction.query\
+        .filter(Transaction.user_id == user_id, Transaction.change_seq > since)\
+        .order_by(Transaction.change_seq)\
+        .limit(limit + 1)\
+        .all()
+    
+    tombstones = TransactionTombstone.query\
+        .filter(TransactionTombstone.user_id == user_id, TransactionTombstone.change_seq > since)\
+        .order_by(TransactionTombstone.change_seq)\
+        .limit(limit + 1)\
+        .all()
+    
+    archived = archived_changes(user_id, since, limit + 1)
+    
+    merged = [serialize_transaction(t) for t in rows] + [serialize_tombstone(t) for t in tombstones]
+    merged += [serialize_archived(row) for row in archived]
+    merged.sort(key=lambda change: change['seq'])
+    return merged[:limit], len(merged) > limit
+
+
+def prune_tombstones(before):
+    """
+    Delete the tombstones of transactions deleted before a time, on
+    db.session's shard, without committing
+
+    Each affected user's sync_horizon is raised to the highest change_seq
+    pruned, so a client whose cursor is older is told to start over
+    instead of missing those deletions.
+
+    Args:
+        before: UTC datetime; older tombstones are deleted
+
+    Returns:
+        Number of tombstones deleted
+    """
+    horizons = db.session.query(TransactionTombstone.user_id, func.max(TransactionTombstone.change_seq))\
+        .filter(TransactionTombstone.deleted_at < before)\
+        .group_by(TransactionTombstone.user_id)\
+        .all()
+    if not horizons:
+        return 0
+
+    users = User.__table__
+    db.session.execute(
+        users.update()
+        .where(users.c.id == bindparam('b_id'), users.c.sync_horizon < bindparam('b_horizon'))
+        .values(sync_horizon=bindparam('b_horizon')),
+        [{'b_id': user_id, 'b_horizon': horizon} for user_id, horizon in horizons],
+        bind_arguments={'mapper': User}
+    )
+    return db.session.execute(
+        db.delete(TransactionTombstone).where(TransactionTombstone.deleted_at < before)
+    ).rowcount
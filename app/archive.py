@@ -0,0 +1,506 @@
+"""
+Cold storage for old transactions.
+
+``flask archive run`` moves each user's transactions dated before January 1
+ARCHIVE_HORIZON_YEARS years ago out of the transaction table, into one
+Parquet file per user and year under the instance folder
+(instance/archive/<user id>/<year>.parquet). Only whole years are moved, and
+User.archived_before records the first day still kept hot: every row in the
+transaction table is dated on or after it (the forms and CSV import refuse
+earlier dates), every archived row before it.
+
+The rows are deleted with a Core statement, so the derived state is left as
+it was: balance checkpoints and monthly category totals of archived months
+stay behind as the rollups all-time figures are read from, and the anomaly
+statistics keep counting the archived amounts (rebuilding them reads the
+archive, see ``archived_amounts``). Each archived
+row keeps its amount in the user's base currency at archival time
+(amount_base), which is why the base currency cannot be changed once a
+user has an archive. Archived rows are not deleted for sync clients: they
+keep their change_seq, and a sync whose cursor is older than a row still
+receives it from the files (``archived_changes``). Tags are not archived:
+archived rows carry none and tag filters only match hot rows.
+
+Readers call ``reaches_archive`` first and only open files when the
+requested date range starts before archived_before, and then only the
+files of the years it covers. pyarrow is imported on that path alone.
+"""
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from app.fx import base_amount, join_rates
+from app.models import ArchiveSegment, MonthlyCategoryTotal, Transaction, TransactionTag, TransactionType, User
+from app.saved_views import invalidate_saved_views
+
+# Low-cardinality string columns stored dictionary encoded
+DICTIONARY_COLUMNS = ['type', 'category', 'currency']
+
+_CENT = Decimal('0.01')
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.date32()),
+        ('type', pa.string()),
+        ('category', pa.string()),
+        ('currency', pa.string()),
+        ('amount', pa.decimal128(10, 2)),
+        ('amount_base', pa.decimal128(14, 2)),
+        ('description', pa.string()),
+        ('created_at', pa.timestamp('us')),
+        ('change_seq', pa.int64()),
+        ('recurring_rule_id', pa.int64()),
+        ('is_anomaly', pa.bool_()),
+    ])
+
+
+def archive_dir():
+    return os.path.join(current_app.instance_path, current_app.config['ARCHIVE_DIR'])
+
+
+def archived_before(user_id, session=None):
+    """First day of the user's hot transactions, or None when nothing is archived"""
+    return (session or db.session).get(User, user_id).archived_before
+
+
+def reaches_archive(user_id, start=None):
+    """Whether a date range starting at start (None: all time) covers archived rows"""
+    cutoff = archived_before(user_id)
+    return cutoff is not None and (start is None or start < cutoff)
+
+
+# -- writing -------------------------------------------------------------------
+
+def _year_table(rows):
+    import pyarrow as pa
+    return pa.Table.from_pylist([{
+        'id': row.id,
+        'date': row.date,
+        'type': TransactionType(row.type).value,
+        'category': row.category,
+        'currency': row.currency,
+        'amount': Decimal(str(row.amount)).quantize(_CENT),
+        'amount_base': Decimal(str(row.amount_base)).quantize(_CENT) if row.amount_base is not None else None,
+        'description': row.description,
+        'created_at': row.created_at,
+        'change_seq': row.change_seq,
+        'recurring_rule_id': row.recurring_rule_id,
+        'is_anomaly': bool(row.is_anomaly),
+    } for row in rows], schema=_schema())
+
+
+def _write_segment(user_id, year, table):
+    """Write (or merge into) a user's year file and record it; returns its row count"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    relative = os.path.join(str(user_id), f'{year}.parquet')
+    path = os.path.join(archive_dir(), relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    segment = ArchiveSegment.query.filter_by(user_id=user_id, year=year).first()
+    if segment is not None:
+        # Rows that reached the table before the cutoff without the form
+        # checks; a file without a segment row is left over from a run
+        # whose commit failed and is simply replaced
+        existing = pq.read_table(path)
+        existing = existing.filter(pc.invert(pc.is_in(existing['id'], value_set=table['id'])))
+        table = pa.concat_tables([existing.cast(table.schema), table])
+    else:
+        segment = ArchiveSegment(user_id=user_id, year=year)
+        db.session.add(segment)
+    table = table.sort_by([('date', 'ascending'), ('id', 'ascending')])
+
+    # Write beside the file and rename, so readers never see half a file
+    partial = path + '.tmp'
+    pq.write_table(table, partial, compression=current_app.config['ARCHIVE_COMPRESSION'],
+                   use_dictionary=DICTIONARY_COLUMNS)
+    os.replace(partial, path)
+
+    first_date, last_date = pc.min_max(table['date']).values()
+    segment.path = relative
+    segment.row_count = table.num_rows
+    segment.first_date = first_date.as_py()
+    segment.last_date = last_date.as_py()
+    segment.max_change_seq = pc.max(table['change_seq']).as_py()
+    segment.archived_at = datetime.utcnow()
+    return table.num_rows
+
+
+def archive_user(user_id, before):
+    """
+    Move a user's transactions dated before a January 1 into the archive
+
+    Args:
+        user_id: Owner of the transactions
+        before: First day kept in the transaction table (a January 1)
+
+    Returns:
+        Number of transactions archived
+    """
+    user = db.session.get(User, user_id)
+    if user.archived_before is not None and user.archived_before >= before:
+        return 0
+    # Claim the range before reading it: on SQLite this takes the write
+    # lock, so no row can be added before the cutoff until the commit
+    db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(archived_before=before, data_version=User.data_version + 1)
+    )
+
+    base = user.base_currency
+    query = db.select(
+        Transaction.id, Transaction.date, Transaction.type, Transaction.category, Transaction.currency,
+        Transaction.amount, base_amount(base).label('amount_base'), Transaction.description,
+        Transaction.created_at, Transaction.change_seq, Transaction.recurring_rule_id, Transaction.is_anomaly
+    ).select_from(Transaction)
+    rows = db.session.execute(
+        join_rates(query, base)
+        .where(Transaction.user_id == user_id, Transaction.date < before)
+        .order_by(Transaction.date, Transaction.id)
+    )
+
+    # One year in memory at a time
+    archived = 0
+    for year, year_rows in groupby(rows, key=lambda row: row.date.year):
+        table = _year_table(year_rows)
+        _write_segment(user_id, year, table)
+        archived += table.num_rows
+
+    table = Transaction.__table__
+    archived_ids = db.select(table.c.id).where(table.c.user_id == user_id, table.c.date < before)
+    # Archived rows keep no tags
+    db.session.execute(db.delete(TransactionTag).where(TransactionTag.transaction_id.in_(archived_ids)))
+    db.session.execute(table.delete().where(table.c.user_id == user_id, table.c.date < before))
+    # Listed rows of the archived years are now read-only
+    invalidate_saved_views(user_id)
+    return archived
+
+
+def run_archive(before=None, user_id=None):
+    """
+    Archive every user's transactions older than the horizon
+
+    Each user is committed on its own, after their files are written.
+
+    Args:
+        before: First day kept hot (default January 1, ARCHIVE_HORIZON_YEARS
+                years before this year)
+        user_id: Only archive this user
+
+    Returns:
+        Tuple (users archived, transactions archived)
+    """
+    if before is None:
+        before = date(date.today().year - current_app.config['ARCHIVE_HORIZON_YEARS'], 1, 1)
+    query = db.session.query(Transaction.user_id).filter(Transaction.date < before).distinct()
+    if user_id is not None:
+        query = query.filter(Transaction.user_id == user_id)
+    user_ids = [uid for uid, in query.order_by(Transaction.user_id)]
+
+    archived = 0
+    for uid in user_ids:
+        archived += archive_user(uid, before)
+        db.session.commit()
+    return len(user_ids), archived
+
+
+# -- reading -------------------------------------------------------------------
+
+def read_archive(user_id, start=None, end=None, columns=None, session=None):
+    """
+    A user's archived transactions dated in a range
+
+    Args:
+        user_id: Owner of the transactions
+        start: First day (optional)
+        end: Last day (optional)
+        columns: Columns to read (default all)
+        session: Session on the user's shard (default db.session)
+
+    Returns:
+        pyarrow Table in date order, or None when the range does not reach
+        the archive
+    """
+    cutoff = archived_before(user_id, session)
+    if cutoff is None or (start is not None and start >= cutoff):
+        return None
+    query = (session or db.session).query(ArchiveSegment).filter(ArchiveSegment.user_id == user_id)
+    if start is not None:
+        query = query.filter(ArchiveSegment.year >= start.year)
+    if end is not None:
+        query = query.filter(ArchiveSegment.year <= end.year)
+    segments = query.order_by(ArchiveSegment.year).all()
+    if not segments:
+        return None
+
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    if columns is not None and 'date' not in columns:
+        columns = ['date', *columns]
+    table = pa.concat_tables([
+        pq.read_table(os.path.join(archive_dir(), segment.path), columns=columns)
+        for segment in segments
+    ])
+    mask = pc.less(table['date'], cutoff)
+    if start is not None:
+        mask = pc.and_(mask, pc.greater_equal(table['date'], start))
+    if end is not None:
+        mask = pc.and_(mask, pc.less_equal(table['date'], end))
+    return table.filter(mask)
+
+
+def archived_changes(user_id, since, limit):
+    """
+    A user's archived transactions written after a sync cursor
+
+    Only the files that may hold such rows are read, so a delta sync
+    whose cursor is past every archived row opens none.
+
+    Args:
+        user_id: Owner of the transactions
+        since: Sync cursor (0 for a full sync)
+        limit: Most rows to return
+
+    Returns:
+        List of dicts of archive columns, ordered by change_seq
+    """
+    cutoff = archived_before(user_id)
+    if cutoff is None:
+        return []
+    segments = ArchiveSegment.query.filter(
+        ArchiveSegment.user_id == user_id,
+        db.or_(ArchiveSegment.max_change_seq.is_(None), ArchiveSegment.max_change_seq > since)
+    ).order_by(ArchiveSegment.year).all()
+    if not segments:
+        return []
+
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    columns = ['id', 'date', 'type', 'category', 'currency', 'amount', 'description', 'created_at', 'change_seq']
+    table = pa.concat_tables([
+        pq.read_table(os.path.join(archive_dir(), segment.path), columns=columns,
+                      filters=[('change_seq', '>', since)])
+        for segment in segments
+    ])
+    table = table.filter(pc.less(table['date'], cutoff))
+    return table.sort_by('change_seq').slice(0, limit).to_pylist()
+
+
+def _filter_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _filter_amount(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def archived_transactions(user_id, filters):
+    """
+    Archived transactions matching the transaction list filters
+
+    Mirrors app.transactions.utilities.apply_transaction_filters, with the
+    amount range compared to the amount in the base currency. Archived rows
+    have no tags, so a tag filter matches none of them.
+
+    Returns:
+        pyarrow Table, or None when the filtered range does not reach the
+        archive
+    """
+    import pyarrow.compute as pc
+
+    if filters.get('tags'):
+        return None
+
+    table = read_archive(user_id, _filter_date(filters.get('date_from')), _filter_date(filters.get('date_to')))
+    if table is None:
+        return None
+    conditions = []
+    if filters.get('search'):
+        description = pc.fill_null(table['description'], '')
+        conditions.append(pc.match_substring(description, filters['search'], ignore_case=True))
+    if filters.get('type'):
+        conditions.append(pc.equal(table['type'], filters['type']))
+    if filters.get('category'):
+        conditions.append(pc.equal(table['category'], filters['category']))
+    amount = pc.cast(table['amount_base'], 'float64')
+    min_amount, max_amount = _filter_amount(filters.get('min_amount')), _filter_amount(filters.get('max_amount'))
+    if min_amount is not None:
+        conditions.append(pc.greater_equal(amount, min_amount))
+    if max_amount is not None:
+        conditions.append(pc.less_equal(amount, max_amount))
+    mask = None
+    for condition in conditions:
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return table if mask is None else table.filter(mask)
+
+
+def archived_facet_counts(table, filters, column):
+    """
+    Archived rows per value of one column, for the transaction list facets
+
+    Args:
+        table: archived_transactions() of the filters other than type,
+               category and dates
+        filters: The facet's filters; their type, category and date
+                 filters are applied here
+        column: 'type', 'category' or 'date'
+
+    Returns:
+        List of (value, count)
+    """
+    import pyarrow.compute as pc
+
+    conditions = []
+    if filters.get('type'):
+        conditions.append(pc.equal(table['type'], filters['type']))
+    if filters.get('category'):
+        conditions.append(pc.equal(table['category'], filters['category']))
+    date_from, date_to = _filter_date(filters.get('date_from')), _filter_date(filters.get('date_to'))
+    if date_from is not None:
+        conditions.append(pc.greater_equal(table['date'], date_from))
+    if date_to is not None:
+        conditions.append(pc.less_equal(table['date'], date_to))
+    mask = None
+    for condition in conditions:
+        mask = condition if mask is None else pc.and_(mask, condition)
+    if mask is not None:
+        table = table.filter(mask)
+    return [(row[column], row['id_count']) for row in table.group_by(column).aggregate([('id', 'count')]).to_pylist()]
+
+
+def totals_by_type(table):
+    """Returns (count, income, expense) of an archive table, amounts in the base currency"""
+    totals = {TransactionType(row['type']): row for row in
+              table.group_by('type').aggregate([('amount_base', 'sum'), ('id', 'count')]).to_pylist()}
+    income, expense = totals.get(TransactionType.INCOME), totals.get(TransactionType.EXPENSE)
+    return (
+        table.num_rows,
+        float(income['amount_base_sum'] or 0) if income else 0.0,
+        float(expense['amount_base_sum'] or 0) if expense else 0.0,
+    )
+
+
+def daily_totals(user_id, start=None, end=None, session=None):
+    """
+    Archived amounts grouped by day, type and category
+
+    Returns:
+        List of (date, type, category, total in the base currency), empty
+        when the range does not reach the archive
+    """
+    table = read_archive(user_id, start, end, columns=['date', 'type', 'category', 'amount_base'], session=session)
+    if table is None:
+        return []
+    grouped = table.group_by(['date', 'type', 'category']).aggregate([('amount_base', 'sum')])
+    return [
+        (row['date'], row['type'], row['category'], row['amount_base_sum'] or Decimal(0))
+        for row in grouped.to_pylist()
+    ]
+
+
+def daily_nets(user_id, start=None, end=None):
+    """Archived income minus expenses per day, as a list of (date, net)"""
+    nets = defaultdict(Decimal)
+    for day, tx_type, _, total in daily_totals(user_id, start, end):
+        nets[day] += total if TransactionType(tx_type) == TransactionType.INCOME else -total
+    return sorted(nets.items())
+
+
+def _is_month_end(day):
+    return day.month != date.fromordinal(day.toordinal() + 1).month
+
+
+def category_totals(user_id, tx_type, start=None, end=None):
+    """
+    Archived totals per category of one type, in the base currency
+
+    Ranges made of whole archived months are read from the monthly
+    category totals left behind; others from the year files they cover.
+
+    Returns:
+        Dictionary {category: total}, empty when the range does not reach
+        the archive
+    """
+    cutoff = archived_before(user_id)
+    if cutoff is None or (start is not None and start >= cutoff):
+        return {}
+    if (start is None or start.day == 1) and (end is None or end >= cutoff or _is_month_end(end)):
+        query = db.session.query(MonthlyCategoryTotal.category, func.sum(MonthlyCategoryTotal.total))\
+            .filter(
+                MonthlyCategoryTotal.user_id == user_id,
+                MonthlyCategoryTotal.type == TransactionType(tx_type),
+                MonthlyCategoryTotal.month < cutoff
+            )
+        if start is not None:
+            query = query.filter(MonthlyCategoryTotal.month >= start)
+        if end is not None:
+            query = query.filter(MonthlyCategoryTotal.month <= end)
+        return {
+            category: Decimal(str(total)) for category, total in query.group_by(MonthlyCategoryTotal.category)
+            if total
+        }
+
+    totals = defaultdict(Decimal)
+    for _, row_type, category, total in daily_totals(user_id, start, end):
+        if row_type == TransactionType(tx_type).value:
+            totals[category] += total
+    return dict(totals)
+
+
+def rollup_totals(user_id):
+    """
+    All-time archived figures from the rollups left behind
+
+    Returns:
+        Tuple (count, income, expense), zeros when nothing is archived
+    """
+    cutoff = archived_before(user_id)
+    if cutoff is None:
+        return 0, 0.0, 0.0
+    totals = dict(
+        db.session.query(MonthlyCategoryTotal.type, func.sum(MonthlyCategoryTotal.total))
+        .filter(MonthlyCategoryTotal.user_id == user_id, MonthlyCategoryTotal.month < cutoff)
+        .group_by(MonthlyCategoryTotal.type)
+        .all()
+    )
+    count = db.session.query(func.sum(ArchiveSegment.row_count))\
+        .filter(ArchiveSegment.user_id == user_id)\
+        .scalar()
+    return (
+        count or 0,
+        float(totals.get(TransactionType.INCOME) or 0),
+        float(totals.get(TransactionType.EXPENSE) or 0),
+    )
+
+
+def archived_amounts(user_id, tx_type):
+    """Archived amounts of one type per category, in date order, for rebuilding statistics"""
+    table = read_archive(user_id, columns=['id', 'category', 'type', 'amount_base'])
+    if table is None:
+        return {}
+    import pyarrow.compute as pc
+    table = table.filter(pc.equal(table['type'], TransactionType(tx_type).value))\
+        .sort_by([('date', 'ascending'), ('id', 'ascending')])
+    amounts = defaultdict(list)
+    for category, amount in zip(table['category'].to_pylist(), table['amount_base'].to_pylist()):
+        if amount is not None:
+            amounts[category].append(float(amount))
+    return amounts
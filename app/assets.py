@@ -0,0 +1,158 @@
+"""
+Content-hashed static files with long-lived caching.
+
+``flask assets build`` copies every file in the static folder (except user
+uploads) to ``static/dist/<name>.<hash>.<ext>``, writes gzip/brotli siblings
+for text assets and records the mapping in ``static/dist/manifest.json``.
+At runtime ``url_for('static', filename='styles.css')`` resolves to the
+hashed copy, which is served with a one-year immutable cache policy and a
+precompressed body when the client accepts one.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import click
+from flask import current_app, send_from_directory
+from flask.cli import with_appcontext
+from app.compression import brotli, negotiate_encoding
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Uploads are stored under random names and never rewritten
+UPLOAD_DIR = 'profile_pics'
+UPLOADED_PIC = re.compile(r'^profile_pics/[0-9a-f]{16}\.(jpg|jpeg|png)$', re.IGNORECASE)
+
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _precompress(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+def build_assets(static_folder):
+    """
+    Write fingerprinted copies of the static files and their manifest
+
+    Returns:
+        Dictionary mapping original filenames to dist filenames
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder)
+        if rel_root == '.':
+            dirs[:] = [d for d in dirs if d not in (DIST_DIR, UPLOAD_DIR)]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/')
+            stem, ext = os.path.splitext(filename)
+            hashed = f"{DIST_DIR}/{stem}.{_file_hash(source)}{ext}"
+
+            target = os.path.join(static_folder, *hashed.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if ext.lower() in PRECOMPRESS_EXTENSIONS:
+                _precompress(target)
+            manifest[filename] = hashed
+
+    with open(os.path.join(dist, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def fingerprint_static_url(endpoint, values):
+    """url_defaults hook that swaps static filenames for their hashed copy"""
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    manifest = current_app.extensions['assets_manifest']
+    hashed = manifest.get(values['filename'])
+    if hashed:
+        values['filename'] = hashed
+
+
+def is_immutable(filename):
+    return filename.startswith(DIST_DIR + '/') or bool(UPLOADED_PIC.match(filename))
+
+
+def serve_static(filename):
+    """Static view: immutable files get a year-long cache and precompressed bodies"""
+    if not is_immutable(filename):
+        return current_app.send_static_file(filename)
+
+    static_folder = current_app.static_folder
+    available = [
+        encoding for encoding, suffix in ENCODING_SUFFIXES.items()
+        if os.path.isfile(os.path.join(static_folder, filename + suffix))
+    ]
+    encoding = negotiate_encoding(available) if available else None
+    path = filename + ENCODING_SUFFIXES[encoding] if encoding else filename
+
+    max_age = current_app.config['STATIC_IMMUTABLE_MAX_AGE']
+    response = send_from_directory(
+        static_folder, path,
+        mimetype=mimetypes.guess_type(filename)[0],
+        max_age=max_age
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if available:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@click.group('assets')
+def assets_cli():
+    """Static asset build commands"""
+
+
+@assets_cli.command('build')
+@with_appcontext
+def build_command():
+    """Fingerprint and precompress static files for deployment"""
+    manifest = build_assets(current_app.static_folder)
+    for original, hashed in sorted(manifest.items()):
+        click.echo(f"{original} -> {hashed}")
+    click.echo(f"Wrote {len(manifest)} assets")
+
+
+def init_app(app):
+    app.extensions['assets_manifest'] = load_manifest(app.static_folder)
+    app.url_defaults(fingerprint_static_url)
+    app.view_functions['static'] = serve_static
+    app.cli.add_command(assets_cli)
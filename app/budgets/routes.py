@@ -0,0 +1,40 @@
+from flask import Blueprint,render_template,flash,redirect,url_for,abort
+from flask_login import current_user,login_required
+from app import db
+from app.budgets.utilities import get_budget_status
+from app.forms import BudgetForm
+from app.models import Budget
+
+budgets=Blueprint('budgets',__name__)
+
+@budgets.route('/budgets',methods=['GET','POST'])
+@login_required
+def manage_budgets():
+    form=BudgetForm()
+    if form.validate_on_submit():
+        budget=Budget.query.filter_by(user_id=current_user.id,category=form.category.data).first()
+        if budget:
+            budget.monthly_limit=form.monthly_limit.data
+            flash('Budget updated successfully','success')
+        else:
+            budget=Budget(user_id=current_user.id,
+                          category=form.category.data,
+                          monthly_limit=form.monthly_limit.data)
+            db.session.add(budget)
+            flash('Budget added successfully','success')
+        current_user.touch_settings()
+        db.session.commit()
+        return redirect(url_for('budgets.manage_budgets'))
+    return render_template('budgets.html',form=form,budgets=get_budget_status(current_user.id))
+
+@budgets.route('/budgets/<int:budget_id>/delete',methods=['POST'])
+@login_required
+def delete_budget(budget_id):
+    budget=Budget.query.get_or_404(budget_id)
+    if budget.user_id != current_user.id:
+        abort(403)
+    db.session.delete(budget)
+    current_user.touch_settings()
+    db.session.commit()
+    flash('Budget removed','danger')
+    return redirect(url_for('budgets.manage_budgets'))
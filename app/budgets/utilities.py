@@ -0,0 +1,63 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_
+from app import db
+from app.models import Budget, MonthlyCategoryTotal, TransactionType
+
+
+def get_budget_status(user_id, day=None):
+    """
+    Spent versus limit for each of the user's budgets this month
+
+    Spending comes from the MonthlyCategoryTotal counters that are updated
+    with every transaction write, so this is one indexed row per budget
+    regardless of how many transactions the month holds.
+
+    Args:
+        user_id: Current user's ID
+        day: Any date in the month to report on (default today)
+
+    Returns:
+        List of dictionaries with category, limit, spent, remaining,
+        percentage and status ('ok', 'near' or 'over'), by category
+    """
+    day = day or datetime.now().date()
+    month = day.replace(day=1)
+
+    rows = db.session.query(
+        Budget.id,
+        Budget.category,
+        Budget.monthly_limit,
+        MonthlyCategoryTotal.total
+    ).outerjoin(MonthlyCategoryTotal, and_(
+        MonthlyCategoryTotal.user_id == Budget.user_id,
+        MonthlyCategoryTotal.month == month,
+        MonthlyCategoryTotal.type == TransactionType.EXPENSE,
+        MonthlyCategoryTotal.category == Budget.category
+    )).filter(Budget.user_id == user_id)\
+      .order_by(Budget.category)\
+      .all()
+
+    warning_ratio = current_app.config['BUDGET_WARNING_RATIO']
+    budgets = []
+    for budget_id, category, limit, spent in rows:
+        limit = float(limit)
+        spent = float(spent or 0)
+        ratio = spent / limit if limit > 0 else 0
+        if spent > limit:
+            status = 'over'
+        elif ratio >= warning_ratio:
+            status = 'near'
+        else:
+            status = 'ok'
+        budgets.append({
+            'id': budget_id,
+            'category': category,
+            'limit': limit,
+            'spent': spent,
+            'remaining': limit - spent,
+            'percentage': round(ratio * 100, 1),
+            'status': status
+        })
+    return budgets
+
@@ -0,0 +1,287 @@
+"""
+Rule-based auto-categorization of transaction descriptions.
+
+A CategoryRule maps a keyword, or for global rules a regex, to a type and a
+category. For each transaction type the keywords are compiled into a single
+regex shaped like a trie: "uber", "uber eats" and "upi" become
+``u(?:ber(?: eats)?|pi)``. The regex engine follows one branch per character,
+so a description is matched in one pass however many rules exist. Regex
+rules are combined into a second alternation with one named group per rule.
+
+A user's own rules are tried before the global ones. Compiled rule sets are
+cached per process. A user's rule set is keyed by their settings_version,
+which every rule change bumps. The global rule set is keyed by the count and
+highest id of the global rules, both of which change whenever
+``flask categorize load-rules`` replaces them; every shard has its own copy
+of the global rules (app/sharding.py), so their sets are cached per shard.
+"""
+import re
+import threading
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from app.models import CategoryRule, ExpenseCategory, IncomeCategory, Transaction, TransactionType, User
+from app.sharding import current_shard
+
+# Catch-all categories the recategorize job treats as uncategorized
+UNCATEGORIZED = (ExpenseCategory.OTHERS.value, IncomeCategory.OTHERS.value)
+
+# \1 .. \9 not preceded by an escaped backslash
+_BACKREFERENCE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+
+def normalize(text):
+    """Lowercase and collapse whitespace, as rules and descriptions are compared"""
+    return ' '.join(text.lower().split())
+
+
+def valid_category(tx_type, category):
+    categories = IncomeCategory if TransactionType(tx_type) == TransactionType.INCOME else ExpenseCategory
+    return category in {c.value for c in categories}
+
+
+def trie_pattern(words):
+    """Regex source matching any of words, factored into a trie"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _node_pattern(trie)
+
+
+def regex_alternation(patterns):
+    """One alternation of regex rules, with a group named r<i> around rule i"""
+    return '|'.join(f'(?P<r{i}>{pattern})' for i, pattern in enumerate(patterns))
+
+
+def regex_rule_error(pattern):
+    """
+    Why a regex rule cannot be combined with others, or None
+
+    A rule that compiles alone can still break the alternation: global
+    inline flags such as (?i) are an error once not at the start, and a
+    numbered backreference would refer to another rule's group. The rule
+    is compiled alone, then as the second one of an alternation to find
+    the first.
+    """
+    if '(?P' in pattern:
+        return 'named groups are not allowed in regex rules'
+    if _BACKREFERENCE.search(pattern):
+        return 'numbered backreferences are not allowed in regex rules'
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return f'invalid regex: {e}'
+    try:
+        re.compile(regex_alternation(['', pattern]), re.IGNORECASE)
+    except re.error as e:
+        return f'regex cannot be combined with other rules: {e}'
+    return None
+
+
+def _node_pattern(node):
+    optional = '' in node
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    if len(branches) == 1 and not optional:
+        return branches[0]
+    # Greedy '?' tries the longer keyword first
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if optional else pattern
+
+
+class CategoryMatcher:
+    """Compiled keyword and regex rules of one transaction type"""
+
+    def __init__(self, rules):
+        self.keywords = {}
+        regexes = []
+        for pattern, is_regex, category in rules:
+            if is_regex:
+                regexes.append((pattern, category))
+            elif normalize(pattern):
+                # Earlier rules win when two normalize to the same keyword
+                self.keywords.setdefault(normalize(pattern), category)
+
+        self.keyword_re = None
+        if self.keywords:
+            self.keyword_re = re.compile(r'(?<!\w)' + trie_pattern(self.keywords) + r'(?!\w)')
+
+        self.regex_categories = [category for _, category in regexes]
+        self.regex_re = None
+        self.regex_rules = None
+        if regexes:
+            try:
+                self.regex_re = re.compile(regex_alternation([pattern for pattern, _ in regexes]), re.IGNORECASE)
+            except re.error as e:
+                # Rules loaded before load-rules checked them together; try
+                # them one at a time rather than failing every lookup
+                current_app.logger.warning('Regex rules do not combine (%s), matching them one at a time', e)
+                self.regex_rules = []
+                for pattern, category in regexes:
+                    try:
+                        self.regex_rules.append((re.compile(pattern, re.IGNORECASE), category))
+                    except re.error:
+                        continue
+
+    def match(self, text):
+        """Category for a normalized description, or None"""
+        if self.keyword_re is not None:
+            found = self.keyword_re.search(text)
+            if found:
+                return self.keywords[found.group()]
+        if self.regex_re is not None:
+            found = self.regex_re.search(text)
+            if found:
+                return self.regex_categories[int(found.lastgroup[1:])]
+        for regex, category in self.regex_rules or ():
+            if regex.search(text):
+                return category
+        return None
+
+
+class RuleSet:
+    """One CategoryMatcher per transaction type"""
+
+    def __init__(self, rules):
+        by_type = {tx_type: [] for tx_type in TransactionType}
+        for pattern, is_regex, tx_type, category in rules:
+            by_type[TransactionType(tx_type)].append((pattern, is_regex, category))
+        self.matchers = {tx_type: CategoryMatcher(type_rules) for tx_type, type_rules in by_type.items()}
+
+    def match(self, text, tx_type=None):
+        """(type, category) for a normalized description, or None"""
+        for candidate in ([TransactionType(tx_type)] if tx_type else TransactionType):
+            category = self.matchers[candidate].match(text)
+            if category:
+                return candidate, category
+        return None
+
+
+def _load_rules(user_id):
+    return db.session.query(CategoryRule.pattern, CategoryRule.is_regex, CategoryRule.type, CategoryRule.category)\
+        .filter(CategoryRule.user_id == user_id if user_id is not None else CategoryRule.user_id.is_(None))\
+        .order_by(CategoryRule.id)\
+        .all()
+
+
+class RuleCache:
+    """Per-process cache of compiled rule sets"""
+
+    def __init__(self, max_users=1024):
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.global_entries = {}
+        self.user_entries = OrderedDict()
+
+    def global_rules(self):
+        key = tuple(
+            db.session.query(func.count(CategoryRule.id), func.max(CategoryRule.id))
+            .filter(CategoryRule.user_id.is_(None))
+            .one()
+        )
+        shard = current_shard()
+        with self.lock:
+            cached_key, rule_set = self.global_entries.get(shard, (None, None))
+        if cached_key != key:
+            rule_set = RuleSet(_load_rules(None))
+            with self.lock:
+                self.global_entries[shard] = (key, rule_set)
+        return rule_set
+
+    def user_rules(self, user_id, version):
+        with self.lock:
+            entry = self.user_entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self.user_entries.move_to_end(user_id)
+                return entry[1]
+        rule_set = RuleSet(_load_rules(user_id))
+        with self.lock:
+            self.user_entries[user_id] = (version, rule_set)
+            self.user_entries.move_to_end(user_id)
+            while len(self.user_entries) > self.max_users:
+                self.user_entries.popitem(last=False)
+        return rule_set
+
+
+class Categorizer:
+    """Suggests categories for one user's descriptions"""
+
+    def __init__(self, user_rules, global_rules):
+        self.user_rules = user_rules
+        self.global_rules = global_rules
+
+    def suggest(self, description, tx_type=None):
+        """
+        Best matching rule for a description
+
+        Args:
+            description: Transaction description
+            tx_type: Only consider rules of this type (optional)
+
+        Returns:
+            Tuple (TransactionType, category) or None when no rule matches
+        """
+        text = normalize(description or '')
+        if not text:
+            return None
+        return self.user_rules.match(text, tx_type) or self.global_rules.match(text, tx_type)
+
+
+def get_categorizer(user_id, settings_version=None):
+    if settings_version is None:
+        settings_version = db.session.get(User, user_id).settings_version
+    cache = current_app.extensions['category_rules']
+    return Categorizer(cache.user_rules(user_id, settings_version), cache.global_rules())
+
+
+def recategorize_uncategorized(user_id=None, batch_size=1000):
+    """
+    Re-run the rules over transactions left in a catch-all category
+
+    Only rules of the transaction's own type apply. Rows are read in id
+    order and committed per batch, so the job can be interrupted and rerun.
+
+    Args:
+        user_id: Limit to one user (default all users)
+        batch_size: Transactions per committed batch
+
+    Returns:
+        Tuple (transactions examined, transactions recategorized)
+    """
+    examined = changed = 0
+    last_id = 0
+    while True:
+        query = Transaction.query.filter(
+            Transaction.category.in_(UNCATEGORIZED),
+            Transaction.description.isnot(None),
+            Transaction.id > last_id
+        )
+        if user_id is not None:
+            query = query.filter(Transaction.user_id == user_id)
+        batch = query.order_by(Transaction.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        owners = User.query.filter(User.id.in_({t.user_id for t in batch})).all()
+        categorizers = {owner.id: get_categorizer(owner.id, owner.settings_version) for owner in owners}
+        for transaction in batch:
+            match = categorizers[transaction.user_id].suggest(transaction.description, transaction.type)
+            if match and match[1] != transaction.category:
+                transaction.category = match[1]
+                changed += 1
+        examined += len(batch)
+
+        db.session.commit()
+        del owners
+        db.session.expunge_all()
+    return examined, changed
+
+
+def init_app(app):
+    app.extensions['category_rules'] = RuleCache()
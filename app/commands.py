@@ -0,0 +1,404 @@
+"""
+Maintenance and batch commands.
+
+    flask --app wsgi ledger rebuild              # every user
+    flask --app wsgi ledger rebuild --user-id 3
+    flask --app wsgi recurring run               # e.g. daily from cron
+    flask --app wsgi categorize load-rules rules.csv
+    flask --app wsgi categorize recategorize
+    flask --app wsgi transactions import --user-id 3 statement.csv
+    flask --app wsgi anomalies backfill
+    flask --app wsgi sync backfill               # rows without a change_seq
+    flask --app wsgi sync prune                  # e.g. daily from cron
+    flask --app wsgi forecast run                # e.g. nightly from cron
+    flask --app wsgi fx load rates.csv
+    flask --app wsgi archive run                 # e.g. yearly from cron
+    flask --app wsgi shards init                 # after adding a shard
+    flask --app wsgi shards status
+    flask --app wsgi shards move --user-id 3 --to 1
+    flask --app wsgi shards rebalance --dry-run
+    flask --app wsgi passwords calibrate --target-ms 250
+
+Commands that work on every user run once per shard (app/sharding.py).
+"""
+import csv
+from datetime import date, datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_migrate import upgrade
+from sqlalchemy import func
+from app import db
+from app.anomalies import rebuild_category_stats
+from app.api.utilities import prune_tombstones
+from app.archive import run_archive
+from app.categorize import recategorize_uncategorized, regex_rule_error, valid_category
+from app.events import backfill_change_seq
+from app.fx import load_rates_csv
+from app.ledger import rebuild_balance_checkpoints, rebuild_category_totals, rebuild_derived_state
+from app.models import CategoryRule, Transaction, TransactionType, User
+from app.passwords import get_hasher
+from app.sharding import (copy_shared_tables, each_shard, move_user, plan_rebalance, shard_count,
+                          shard_loads, use_user_shard)
+from app.transactions.utilities import import_transactions_csv, run_recurring_rules
+
+
+def _user_ids(user_id=None):
+    """Yield every user id (or just user_id) with db.session routed to its shard"""
+    if user_id is not None:
+        use_user_shard(user_id)
+        if db.session.get(User, user_id) is not None:
+            yield user_id
+        return
+    for shard in each_shard():
+        yield from [uid for uid, in db.session.query(User.id).order_by(User.id)]
+
+
+@click.group('ledger')
+def ledger_cli():
+    """Derived ledger state commands"""
+
+
+@ledger_cli.command('rebuild')
+@click.option('--user-id', type=int, help='Only rebuild this user')
+@with_appcontext
+def rebuild_command(user_id):
+    """Recompute balance checkpoints and category totals from the transactions"""
+    rebuilt = 0
+    for uid in _user_ids(user_id):
+        checkpoints = rebuild_balance_checkpoints(uid)
+        totals = rebuild_category_totals(uid)
+        db.session.commit()
+        rebuilt += 1
+        click.echo(f"user {uid}: {checkpoints} checkpoints, {totals} category totals")
+    click.echo(f"Rebuilt {rebuilt} users")
+
+
+@click.group('recurring')
+def recurring_cli():
+    """Recurring transaction commands"""
+
+
+@recurring_cli.command('run')
+@click.option('--date', 'today', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Materialize occurrences up to this date (default today)')
+@click.option('--batch-size', type=int, help='Rules per committed batch')
+@with_appcontext
+def run_recurring_command(today, batch_size):
+    """Create every due occurrence of every active recurring rule"""
+    processed = created = 0
+    for shard in each_shard():
+        shard_processed, shard_created = run_recurring_rules(today.date() if today else None, batch_size)
+        processed += shard_processed
+        created += shard_created
+    click.echo(f"Processed {processed} rules, created {created} transactions")
+
+
+@click.group('categorize')
+def categorize_cli():
+    """Auto-categorization rule commands"""
+
+
+def _rule_error(row):
+    tx_type = (row.get('type') or '').strip().lower()
+    if tx_type not in {t.value for t in TransactionType}:
+        return f"unknown type {tx_type!r}"
+    if not valid_category(tx_type, (row.get('category') or '').strip().lower()):
+        return f"unknown {tx_type} category {row.get('category')!r}"
+    pattern = (row.get('pattern') or '').strip()
+    if not pattern or len(pattern) > 100:
+        return 'pattern must be 1-100 characters'
+    if (row.get('regex') or '').strip().lower() in ('1', 'true', 'yes'):
+        return regex_rule_error(pattern)
+    return None
+
+
+@categorize_cli.command('load-rules')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def load_rules_command(path):
+    """Replace the global rules with PATH (CSV: pattern,type,category[,regex])"""
+    rules = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            error = _rule_error(row)
+            if error:
+                click.echo(f"line {line}: {error}, skipped", err=True)
+                continue
+            rules.append({
+                'user_id': None,
+                'pattern': row['pattern'].strip(),
+                'is_regex': (row.get('regex') or '').strip().lower() in ('1', 'true', 'yes'),
+                'type': TransactionType(row['type'].strip().lower()),
+                'category': row['category'].strip().lower(),
+            })
+
+    # Every shard keeps its own copy of the global rules
+    for shard in each_shard():
+        db.session.execute(db.delete(CategoryRule).where(CategoryRule.user_id.is_(None)))
+        if rules:
+            db.session.execute(db.insert(CategoryRule), rules)
+        db.session.commit()
+    click.echo(f"Loaded {len(rules)} global rules")
+
+
+@categorize_cli.command('recategorize')
+@click.option('--user-id', type=int, help='Only this user')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+@with_appcontext
+def recategorize_command(user_id, batch_size):
+    """Apply the rules to transactions in the 'other' categories"""
+    if user_id is not None:
+        use_user_shard(user_id)
+        examined, changed = recategorize_uncategorized(user_id, batch_size)
+    else:
+        examined = changed = 0
+        for shard in each_shard():
+            shard_examined, shard_changed = recategorize_uncategorized(None, batch_size)
+            examined += shard_examined
+            changed += shard_changed
+    click.echo(f"Examined {examined} transactions, recategorized {changed}")
+
+
+@click.group('transactions')
+def transactions_cli():
+    """Transaction data commands"""
+
+
+@transactions_cli.command('import')
+@click.option('--user-id', type=int, required=True)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def import_command(user_id, path):
+    """Import PATH (CSV: date,amount,description[,type][,category])"""
+    use_user_shard(user_id)
+    if db.session.get(User, user_id) is None:
+        raise click.BadParameter(f"no user with id {user_id}", param_hint='--user-id')
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        result = import_transactions_csv(csv.DictReader(f), user_id)
+    for line, message in result['errors']:
+        click.echo(f"line {line}: {message}, skipped", err=True)
+    click.echo(f"Imported {result['imported']} transactions, {result['categorized']} categorized by rules")
+
+
+@click.group('anomalies')
+def anomalies_cli():
+    """Spending anomaly commands"""
+
+
+@anomalies_cli.command('backfill')
+@click.option('--user-id', type=int, help='Only this user')
+@with_appcontext
+def backfill_command(user_id):
+    """Rebuild category statistics and anomaly flags from existing expenses"""
+    backfilled = 0
+    for uid in _user_ids(user_id):
+        read, flagged = rebuild_category_stats(uid)
+        db.session.commit()
+        backfilled += 1
+        click.echo(f"user {uid}: {read} expenses, {flagged} flagged")
+    click.echo(f"Backfilled {backfilled} users")
+
+
+@click.group('sync')
+def sync_cli():
+    """Delta sync commands"""
+
+
+@sync_cli.command('backfill')
+@click.option('--user-id', type=int, help='Only this user')
+@with_appcontext
+def backfill_sync_command(user_id):
+    """Give transactions written before change tracking a change_seq, so a full sync returns them"""
+    numbered = 0
+    for uid in _user_ids(user_id):
+        rows = backfill_change_seq(db.session, uid)
+        db.session.commit()
+        numbered += rows
+        if rows:
+            click.echo(f"user {uid}: {rows} transactions numbered")
+    click.echo(f"Numbered {numbered} transactions")
+
+
+@sync_cli.command('prune')
+@click.option('--days', type=int, help='Keep tombstones this many days (default SYNC_TOMBSTONE_RETENTION_DAYS)')
+@with_appcontext
+def prune_sync_command(days):
+    """Delete old tombstones; clients that last synced before them start over"""
+    if days is None:
+        days = current_app.config['SYNC_TOMBSTONE_RETENTION_DAYS']
+    before = datetime.utcnow() - timedelta(days=days)
+    pruned = 0
+    for shard in each_shard():
+        pruned += prune_tombstones(before)
+        db.session.commit()
+    click.echo(f"Pruned {pruned} tombstones")
+
+
+@click.group('forecast')
+def forecast_cli():
+    """Cash-flow forecast commands"""
+
+
+@forecast_cli.command('run')
+@click.option('--date', 'today', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Forecast the months after this date (default today)')
+@click.option('--workers', type=int, help='Worker processes (1 runs in this process)')
+@click.option('--chunk-size', type=int, help='Users per task')
+@with_appcontext
+def run_forecast_command(today, workers, chunk_size):
+    """Recompute and store every user's forecast"""
+    # Imports NumPy, which the web app never needs to load
+    from app.forecast import run_forecasts
+    forecast, chunks = run_forecasts(today.date() if today else None, workers, chunk_size)
+    click.echo(f"Forecast {forecast} users in {chunks} chunks")
+
+
+@click.group('fx')
+def fx_cli():
+    """Exchange rate commands"""
+
+
+@fx_cli.command('load')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def load_rates_command(path):
+    """Replace the exchange rates with PATH (CSV: date,currency,rate in INR)"""
+    # Loaded on shard 0, back-filled to the oldest date of any shard, then copied
+    oldest = None
+    for shard in each_shard():
+        day = db.session.query(func.min(Transaction.date)).scalar()
+        if day is not None and (oldest is None or day < oldest):
+            oldest = day
+    quoted, stored, errors = load_rates_csv(path, oldest=oldest)
+    for line, message in errors:
+        click.echo(f"line {line}: {message}, skipped", err=True)
+    db.session.commit()
+    for shard in range(1, shard_count()):
+        copy_shared_tables(shard)
+    click.echo(f"Loaded {quoted} rates, {stored} daily rows")
+
+    # Users holding amounts in another currency than their base one have
+    # derived state computed with the old rates
+    rebuilt = 0
+    for shard in each_shard():
+        user_ids = [uid for uid, in db.session.query(Transaction.user_id).join(User)
+                    .filter(Transaction.currency != User.base_currency).distinct().order_by(Transaction.user_id)]
+        for uid in user_ids:
+            rebuild_derived_state(uid)
+            db.session.commit()
+        rebuilt += len(user_ids)
+    click.echo(f"Rebuilt {rebuilt} users with converted amounts")
+
+
+@click.group('archive')
+def archive_cli():
+    """Transaction archival commands"""
+
+
+@archive_cli.command('run')
+@click.option('--before-year', type=int,
+              help='Archive transactions dated before this year (default: ARCHIVE_HORIZON_YEARS ago)')
+@click.option('--user-id', type=int, help='Only archive this user')
+@with_appcontext
+def run_archive_command(before_year, user_id):
+    """Move old transactions to per-user, per-year Parquet files"""
+    before = date(before_year, 1, 1) if before_year else None
+    if user_id is not None:
+        use_user_shard(user_id)
+        users, archived = run_archive(before, user_id)
+    else:
+        users = archived = 0
+        for shard in each_shard():
+            shard_users, shard_archived = run_archive(before)
+            users += shard_users
+            archived += shard_archived
+    click.echo(f"Archived {archived} transactions of {users} users")
+
+
+@click.group('shards')
+def shards_cli():
+    """Database shard commands"""
+
+
+@shards_cli.command('init')
+@with_appcontext
+def init_shards_command():
+    """Create or upgrade the tables on every shard and copy the shared tables to new ones"""
+    upgrade()
+    for shard in range(1, shard_count()):
+        rates, rules = copy_shared_tables(shard)
+        click.echo(f"shard {shard}: {rates} exchange rates, {rules} global rules")
+    click.echo(f"Initialized {shard_count()} shards")
+
+
+@shards_cli.command('status')
+@with_appcontext
+def shards_status_command():
+    """Users and transactions on each shard"""
+    for shard, users in shard_loads().items():
+        click.echo(f"shard {shard}: {len(users)} users, {sum(users.values())} transactions")
+
+
+@shards_cli.command('move')
+@click.option('--user-id', type=int, required=True)
+@click.option('--to', 'target', type=int, required=True, help='Shard number to move the user to')
+@click.option('--grace', type=float, help='Seconds to wait for running requests (default SHARD_MOVE_GRACE_SECONDS)')
+@with_appcontext
+def move_user_command(user_id, target, grace):
+    """Move one user and all their rows to another shard"""
+    try:
+        copied = move_user(user_id, target, grace)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    click.echo(f"Moved user {user_id} to shard {target}, {copied} rows")
+
+
+@shards_cli.command('rebalance')
+@click.option('--tolerance', type=float, default=0.1, show_default=True,
+              help='Acceptable gap between shards, as a fraction of the mean load')
+@click.option('--max-moves', type=int, help='Move at most this many users')
+@click.option('--grace', type=float, help='Seconds to wait for running requests before each move')
+@click.option('--dry-run', is_flag=True, help='Only print the moves')
+@with_appcontext
+def rebalance_command(tolerance, max_moves, grace, dry_run):
+    """Move users until every shard holds about as many transactions"""
+    moves = plan_rebalance(shard_loads(), tolerance, max_moves)
+    for user_id, source, target in moves:
+        if dry_run:
+            click.echo(f"user {user_id}: shard {source} -> {target}")
+            continue
+        copied = move_user(user_id, target, grace)
+        click.echo(f"user {user_id}: shard {source} -> {target}, {copied} rows")
+    click.echo(f"{'Planned' if dry_run else 'Made'} {len(moves)} moves")
+
+
+@click.group('passwords')
+def passwords_cli():
+    """Password hashing commands"""
+
+
+@passwords_cli.command('calibrate')
+@click.option('--target-ms', type=int, help='Time one hash should take (default PASSWORD_HASH_TARGET_MS)')
+@with_appcontext
+def calibrate_command(target_ms):
+    """Print the bcrypt cost this host would calibrate to, e.g. to pin BCRYPT_LOG_ROUNDS"""
+    config = current_app.config
+    target_ms = target_ms or config['PASSWORD_HASH_TARGET_MS'] or 250
+    rounds, estimate = get_hasher().calibrate(target_ms, config['PASSWORD_HASH_MIN_ROUNDS'],
+                                             config['PASSWORD_HASH_MAX_ROUNDS'])
+    click.echo(f"{rounds} rounds, about {estimate:.0f} ms per hash (target {target_ms} ms)")
+
+
+def init_app(app):
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(recurring_cli)
+    app.cli.add_command(categorize_cli)
+    app.cli.add_command(transactions_cli)
+    app.cli.add_command(anomalies_cli)
+    app.cli.add_command(sync_cli)
+    app.cli.add_command(forecast_cli)
+    app.cli.add_command(fx_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(passwords_cli)
@@ -0,0 +1,68 @@
+"""
+Negotiated gzip/brotli compression for rendered pages and JSON.
+
+Brotli is used when the optional ``brotli`` package is installed and the
+client prefers it; otherwise responses fall back to gzip.
+"""
+import gzip
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json'}
+
+
+def supported_encodings():
+    """Content codings this process can produce, in server preference order"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(available):
+    """Pick the client's preferred coding out of available, or None"""
+    best = request.accept_encodings.best_match(available)
+    return best if best in available else None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BR_QUALITY'])
+    return gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL'], mtime=0)
+
+
+def compress_response(response):
+    if not current_app.config['COMPRESS_ENABLED']:
+        return response
+    if (response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    # The body differs by Accept-Encoding even when we end up not compressing
+    response.vary.add('Accept-Encoding')
+
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = negotiate_encoding(supported_encodings())
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+
+    # A strong validator must change with the representation
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
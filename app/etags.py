@@ -0,0 +1,72 @@
+import hashlib
+import os
+from datetime import date
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+_template_stamp = None
+
+
+def _get_template_stamp():
+    """Newest template mtime, so a deploy with changed markup gets new ETags"""
+    global _template_stamp
+    if _template_stamp is None:
+        template_dir = os.path.join(current_app.root_path, current_app.template_folder)
+        mtimes = [
+            os.path.getmtime(os.path.join(root, name))
+            for root, _, files in os.walk(template_dir)
+            for name in files
+        ]
+        _template_stamp = int(max(mtimes, default=0))
+    return _template_stamp
+
+
+def user_etag(user):
+    """
+    Build a weak ETag for the current page of a logged in user
+
+    The user's data_version changes on every transaction write and
+    settings_version on every settings change, so this only needs the
+    already-loaded user row. The date is included because period
+    filters such as 'this_month' are relative to today, and the CSRF seed
+    because rendered forms embed a token bound to the session.
+    """
+    parts = (
+        user.id,
+        user.data_version,
+        user.settings_version,
+        request.endpoint,
+        request.full_path,
+        date.today().isoformat(),
+        session.get('csrf_token', ''),
+        _get_template_stamp(),
+    )
+    return hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def etag_cached(view):
+    """
+    Answer revalidation requests with 304 before the view does any work
+
+    Only applies to logged in users. Pages that show flash messages are
+    rendered and sent without an ETag, so a later revalidation can neither
+    swallow a new message nor replay an old one.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated or '_flashes' in session:
+            return view(*args, **kwargs)
+
+        etag = user_etag(current_user)
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
@@ -0,0 +1,310 @@
+"""
+Transaction write hooks.
+
+Every flush that adds, changes or deletes a Transaction is turned into a list
+of TransactionChange records and each owning user's ``data_version`` is bumped
+once per changed row, atomically in the database. Each row's version is
+stamped on it as its ``change_seq``, unique and increasing per user. The
+amounts in a change are in the owner's base currency (converted with
+app/fx.py rates), so derived state is kept in one currency per user;
+``currency`` is the row's own. Features that keep derived state register a
+handler:
+
+    @on_flush      runs inside the flush, so rows it adds or updates are
+                   committed (or rolled back) together with the transaction
+    @on_commit     runs after a successful commit, for in-process side
+                   effects such as cache updates or notifications
+
+Bulk writers insert rows with ``insert_transactions`` instead, which runs
+the same handlers without building or flushing Transaction objects.
+"""
+from collections import Counter, defaultdict, namedtuple
+from datetime import date, datetime
+from sqlalchemy import bindparam, event, inspect, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from app.fx import QUOTE_CURRENCY, get_rates
+from app.models import Transaction, TransactionType, User
+
+# Columns that derived state depends on
+TransactionState = namedtuple('TransactionState', ['type', 'category', 'amount', 'date', 'currency'])
+
+# old is None for inserts, new is None for deletes. transaction_id is filled in
+# once the flush has assigned primary keys; commit handlers should use it rather
+# than the (by then expired) transaction object.
+TransactionChange = namedtuple(
+    'TransactionChange',
+    ['user_id', 'transaction', 'old', 'new', 'version', 'transaction_id']
+)
+
+_flush_handlers = []
+_commit_handlers = []
+
+_PENDING_KEY = 'transaction_changes'
+
+
+def on_flush(func):
+    """Register func(session, changes) to run inside the flush"""
+    _flush_handlers.append(func)
+    return func
+
+
+def on_commit(func):
+    """Register func(changes) to run after the changes are committed"""
+    _commit_handlers.append(func)
+    return func
+
+
+def _current_state(transaction):
+    return TransactionState(
+        type=TransactionType(transaction.type),
+        category=transaction.category,
+        amount=transaction.amount,
+        date=transaction.date,
+        currency=transaction.currency
+    )
+
+
+def _committed_state(transaction):
+    """Column values as last loaded from the database"""
+    attrs = inspect(transaction).attrs
+    values = {}
+    for field in TransactionState._fields:
+        history = attrs[field].history
+        if history.deleted:
+            values[field] = history.deleted[0]
+        elif history.unchanged:
+            values[field] = history.unchanged[0]
+        else:
+            values[field] = getattr(transaction, field)
+    values['type'] = TransactionType(values['type'])
+    return TransactionState(**values)
+
+
+def _in_base(state, base, rates):
+    if state is None or state.currency == base:
+        return state
+    # Undated rows convert at today's rate
+    return state._replace(amount=rates.convert(state.amount, state.currency, state.date or date.today(), base))
+
+
+def _collect_changes(session):
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            changes.append((obj, None, _current_state(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, Transaction) and session.is_modified(obj):
+            changes.append((obj, _committed_state(obj), _current_state(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Transaction):
+            changes.append((obj, _committed_state(obj), None))
+    return changes
+
+
+def _bump_data_version(session, user_id, count):
+    """
+    Add count to a user's data_version in the database and return the new
+    value
+
+    The increment is one UPDATE, so concurrent writes for the same user
+    queue on the row (or, on SQLite, the database) lock and each gets its
+    own versions, rather than both writing a value read before either
+    started.
+    """
+    users = User.__table__
+    return session.execute(
+        users.update().where(users.c.id == user_id)
+        .values(data_version=users.c.data_version + count)
+        .returning(users.c.data_version),
+        bind_arguments={'mapper': User}
+    ).scalar_one()
+
+
+def _bump_data_versions(session, counts):
+    """
+    _bump_data_version for several users, with one UPDATE per distinct count
+
+    Args:
+        counts: Dict of user id to the number to add
+
+    Returns:
+        Dict of user id to the new data_version
+    """
+    by_count = defaultdict(list)
+    for user_id, count in counts.items():
+        by_count[count].append(user_id)
+    users = User.__table__
+    versions = {}
+    for count, user_ids in by_count.items():
+        if len(user_ids) == 1:
+            versions[user_ids[0]] = _bump_data_version(session, user_ids[0], count)
+            continue
+        versions.update(session.execute(
+            users.update().where(users.c.id.in_(user_ids))
+            .values(data_version=users.c.data_version + count)
+            .returning(users.c.id, users.c.data_version),
+            bind_arguments={'mapper': User}
+        ).all())
+    return versions
+
+
+def backfill_change_seq(session, user_id, batch_size=10000):
+    """
+    Number a user's transactions that have no change_seq
+
+    Rows written before change tracking have none, so a full sync
+    (since=0) would never return them. They get versions reserved by one
+    bump of the user's data_version, in id order, as if just written.
+
+    Returns:
+        Number of rows numbered
+    """
+    table = Transaction.__table__
+    ids = [transaction_id for transaction_id, in session.execute(
+        select(table.c.id).where(table.c.user_id == user_id, table.c.change_seq.is_(None)).order_by(table.c.id),
+        bind_arguments={'mapper': Transaction}
+    )]
+    if not ids:
+        return 0
+    first = _bump_data_version(session, user_id, len(ids)) - len(ids) + 1
+    update = table.update().where(table.c.id == bindparam('b_id')).values(change_seq=bindparam('b_seq'))
+    for i in range(0, len(ids), batch_size):
+        session.execute(update, [{'b_id': transaction_id, 'b_seq': first + i + j}
+                                 for j, transaction_id in enumerate(ids[i:i + batch_size])],
+                        bind_arguments={'mapper': Transaction})
+    return len(ids)
+
+
+def _record_changes(session, collected):
+    """
+    Bump each owner's data_version once, stamp the rows and run the flush
+    handlers
+
+    Args:
+        collected: List of (transaction, old state, new state)
+
+    Returns:
+        List of TransactionChange, in the order of collected
+    """
+    users = {}
+    counts = Counter()
+    for transaction, old, new in collected:
+        if transaction.user_id not in users:
+            users[transaction.user_id] = session.get(User, transaction.user_id)
+        counts[transaction.user_id] += 1
+    # Each changed row gets the next of the versions its user's bump reserved
+    versions = _bump_data_versions(session, counts)
+    for user_id, version in versions.items():
+        # The loaded user takes the new value without being marked changed
+        set_committed_value(users[user_id], 'data_version', version)
+        versions[user_id] = version - counts[user_id]
+
+    changes = []
+    rates = None
+    for transaction, old, new in collected:
+        user = users[transaction.user_id]
+        versions[user.id] += 1
+        version = versions[user.id]
+        if new is not None:
+            transaction.change_seq = version
+            if new.currency is None:
+                transaction.currency = user.base_currency
+                new = new._replace(currency=transaction.currency)
+        base = user.base_currency or QUOTE_CURRENCY
+        if any(state is not None and state.currency != base for state in (old, new)):
+            rates = rates or get_rates()
+            old, new = _in_base(old, base, rates), _in_base(new, base, rates)
+        changes.append(TransactionChange(transaction.user_id, transaction, old, new, version, None))
+
+    for handler in _flush_handlers:
+        handler(session, changes)
+    return changes
+
+
+def _before_flush(session, flush_context, instances):
+    collected = _collect_changes(session)
+    if not collected:
+        return
+    changes = _record_changes(session, collected)
+    session.info.setdefault(_PENDING_KEY, []).extend(changes)
+
+
+class PendingTransaction:
+    """Column values of a row insert_transactions writes, in place of a Transaction"""
+
+    def __init__(self, values):
+        now = datetime.utcnow()
+        self.id = self.change_seq = self.recurring_rule_id = None
+        self.description = self.currency = None
+        self.created_at = self.updated_at = now
+        self.is_anomaly = False
+        self.__dict__.update(values)
+
+
+def insert_transactions(session, values):
+    """
+    Insert new transactions as one executemany, with the write hooks run as
+    for a flush of the same rows
+
+    Each owner's data_version is bumped once for all of their rows, and the
+    flush handlers keep derived state with their grouped statements. Nothing
+    is committed; the commit handlers run on the session's next commit.
+
+    Args:
+        session: Session to write with (the owners' shard)
+        values: List of dicts of Transaction column values
+
+    Returns:
+        List of the new rows' ids, in the order of values
+    """
+    if not values:
+        return []
+    pending = [PendingTransaction(row) for row in values]
+    changes = _record_changes(session, [(row, None, _current_state(row)) for row in pending])
+
+    table = Transaction.__table__
+    columns = [column.name for column in table.columns if column.name != 'id']
+    # Rows are matched to their ids by (user_id, change_seq), so the insert
+    # can run as multi-row statements in whatever order RETURNING gives
+    inserted = session.execute(
+        table.insert().returning(table.c.user_id, table.c.change_seq, table.c.id),
+        [{name: getattr(row, name) for name in columns} for row in pending],
+        bind_arguments={'mapper': Transaction}
+    )
+    ids = {(user_id, change_seq): transaction_id for user_id, change_seq, transaction_id in inserted}
+    changes = [change._replace(transaction_id=ids[change.user_id, change.version]) for change in changes]
+    session.info.setdefault(_PENDING_KEY, []).extend(changes)
+    return [change.transaction_id for change in changes]
+
+
+def _after_flush(session, flush_context):
+    changes = session.info.get(_PENDING_KEY)
+    if changes:
+        session.info[_PENDING_KEY] = [
+            change if change.transaction_id is not None
+            else change._replace(transaction_id=change.transaction.id)
+            for change in changes
+        ]
+
+
+def _after_commit(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    for handler in _commit_handlers:
+        handler(changes)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def register_listeners():
+    """Attach the session hooks once per process"""
+    if event.contains(Session, 'before_flush', _before_flush):
+        return
+    event.listen(Session, 'before_flush', _before_flush)
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,284 @@
+"""
+Cash-flow forecast, computed by a batch job (``flask forecast run``).
+
+History comes from the MonthlyCategoryTotal rollups rather than from
+transactions: one value per user, type, category and month over the last
+FORECAST_HISTORY_MONTHS complete months. Once a series has two full years
+of history it is divided by a seasonal index (the calendar month's mean
+relative to the series' mean); the adjusted series is projected with simple
+exponential smoothing (FORECAST_ALPHA) and multiplied back by the index of
+each future month. A chunk of users becomes one NumPy matrix of series
+by months, so the work is a loop over months, not over users or rows.
+
+Projected income, expenses and closing balances go to BalanceForecast and
+per-category spending to CategoryForecast, which the dashboard reads as
+they are. The closing balances start from the current month's checkpoint,
+i.e. the current month counts as recorded so far. Chunks of users (each
+within one shard, see app/sharding.py) are spread over a process pool; each
+worker writes and commits its own chunks.
+
+Importing this module imports NumPy, so the app only does so from the CLI.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from app.models import (BalanceCheckpoint, BalanceForecast, CategoryForecast, MonthlyCategoryTotal,
+                        TransactionType, User)
+from app.sharding import each_shard, use_shard
+
+# Months of history needed before the seasonal index is used
+SEASONAL_MIN_MONTHS = 24
+
+
+def month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def month_from_index(index):
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def smooth(values, start, alpha):
+    """
+    Exponentially smoothed level of every series
+
+    Args:
+        values: Array (series, months) of monthly totals
+        start: Month position at which each series starts; earlier months
+               are ignored
+        alpha: Weight of the newest month
+
+    Returns:
+        Array (series,) with the level after the last month; NaN months
+        leave it unchanged
+    """
+    level = np.zeros(values.shape[0])
+    seeded = np.zeros(values.shape[0], dtype=bool)
+    for t in range(values.shape[1]):
+        column = np.nan_to_num(values[:, t])
+        observed = ~np.isnan(values[:, t]) & (start <= t)
+        # The first observed month sets the level, later ones move it
+        level = np.where(observed, np.where(seeded, alpha * column + (1 - alpha) * level, column), level)
+        seeded |= observed
+    return level
+
+
+def seasonal_index(values, start, first_calendar_month):
+    """
+    Each calendar month's mean relative to the series' overall mean
+
+    Args:
+        values: Array (series, months) of monthly totals
+        start: Month position at which each series starts
+        first_calendar_month: Calendar month of column 0 (0 = January)
+
+    Returns:
+        Array (series, 12) indexed by calendar month; 1 for series with
+        fewer than SEASONAL_MIN_MONTHS months of history
+    """
+    months = values.shape[1]
+    active = np.arange(months)[None, :] >= start[:, None]
+    onehot = np.zeros((months, 12))
+    onehot[np.arange(months), (first_calendar_month + np.arange(months)) % 12] = 1
+
+    masked = np.where(active, values, 0.0)
+    active_months = active.sum(axis=1)
+    overall = masked.sum(axis=1) / np.maximum(active_months, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = (masked @ onehot) / (active @ onehot) / overall[:, None]
+    usable = (active_months >= SEASONAL_MIN_MONTHS) & (overall > 0)
+    return np.where(usable[:, None] & np.isfinite(index), index, 1.0)
+
+
+def _opening_balances(first_id, last_id, month):
+    """Closing balance of each user's latest checkpoint up to month"""
+    latest = db.session.query(BalanceCheckpoint.user_id, func.max(BalanceCheckpoint.month).label('month'))\
+        .filter(BalanceCheckpoint.user_id.between(first_id, last_id), BalanceCheckpoint.month <= month)\
+        .group_by(BalanceCheckpoint.user_id)\
+        .subquery()
+    rows = db.session.query(BalanceCheckpoint.user_id, BalanceCheckpoint.closing_balance)\
+        .join(latest, (BalanceCheckpoint.user_id == latest.c.user_id) & (BalanceCheckpoint.month == latest.c.month))
+    return {user_id: float(balance) for user_id, balance in rows}
+
+
+def forecast_users(first_id, last_id, today=None):
+    """
+    Replace the stored forecasts of users with ids in [first_id, last_id]
+
+    Args:
+        first_id, last_id: Inclusive user id range
+        today: Reference date (default today); its month is the last one
+               left out of the history
+
+    Returns:
+        Number of users with history that were forecast
+    """
+    config = current_app.config
+    horizon = config['FORECAST_MONTHS']
+    history = config['FORECAST_HISTORY_MONTHS']
+    current = month_index(today or date.today())
+    first = current - history
+
+    rows = db.session.query(
+        MonthlyCategoryTotal.user_id,
+        MonthlyCategoryTotal.type,
+        MonthlyCategoryTotal.category,
+        MonthlyCategoryTotal.month,
+        MonthlyCategoryTotal.total
+    ).filter(
+        MonthlyCategoryTotal.user_id.between(first_id, last_id),
+        MonthlyCategoryTotal.month >= month_from_index(first),
+        MonthlyCategoryTotal.month < month_from_index(current)
+    ).all()
+    if not rows:
+        _replace_forecasts(first_id, last_id, [], [], [])
+        return 0
+
+    series = {}
+    positions, columns, totals = [], [], []
+    for user_id, tx_type, category, month, total in rows:
+        positions.append(series.setdefault((user_id, TransactionType(tx_type), category), len(series)))
+        columns.append(month_index(month) - first)
+        totals.append(total)
+    values = np.zeros((len(series), history))
+    values[positions, columns] = np.array(totals, dtype=float)
+
+    keys = list(series)
+    user_ids = sorted({user_id for user_id, _, _ in keys})
+    user_position = {user_id: i for i, user_id in enumerate(user_ids)}
+    owner = np.array([user_position[user_id] for user_id, _, _ in keys])
+    is_income = np.array([tx_type == TransactionType.INCOME for _, tx_type, _ in keys])
+
+    # Every series of a user starts at that user's first active month, so a
+    # category left unused for a while counts as zero spending
+    nonzero = values != 0
+    series_start = np.where(nonzero.any(axis=1), nonzero.argmax(axis=1), history)
+    user_start = np.full(len(user_ids), history)
+    np.minimum.at(user_start, owner, series_start)
+    start = user_start[owner]
+
+    # Smooth the seasonally adjusted series, then put the season back in
+    index = seasonal_index(values, start, first % 12)
+    # (a calendar month that never has any amount carries no level information)
+    season = index[:, (first + np.arange(history)) % 12]
+    adjusted = np.divide(values, season, out=np.full_like(values, np.nan), where=season > 0)
+    level = smooth(adjusted, start, config['FORECAST_ALPHA'])
+    future = current + 1 + np.arange(horizon)
+    projected = np.maximum(level[:, None] * index[:, future % 12], 0)
+
+    income = np.zeros((len(user_ids), horizon))
+    expense = np.zeros((len(user_ids), horizon))
+    np.add.at(income, owner[is_income], projected[is_income])
+    np.add.at(expense, owner[~is_income], projected[~is_income])
+    opening = _opening_balances(first_id, last_id, month_from_index(current))
+    closing = np.array([opening.get(user_id, 0.0) for user_id in user_ids])[:, None] \
+        + np.cumsum(income - expense, axis=1)
+
+    months = [month_from_index(int(m)) for m in future]
+    generated_at = datetime.utcnow()
+    balance_rows = [
+        {'user_id': user_id, 'month': months[h], 'income': round(float(income[u, h]), 2),
+         'expense': round(float(expense[u, h]), 2), 'closing_balance': round(float(closing[u, h]), 2),
+         'generated_at': generated_at}
+        for u, user_id in enumerate(user_ids) for h in range(horizon)
+    ]
+    category_rows = [
+        {'user_id': user_id, 'month': months[h], 'category': category, 'amount': round(float(projected[s, h]), 2)}
+        for s, (user_id, tx_type, category) in enumerate(keys) if tx_type == TransactionType.EXPENSE
+        for h in range(horizon) if projected[s, h] >= 0.005
+    ]
+    _replace_forecasts(first_id, last_id, user_ids, balance_rows, category_rows)
+    return len(user_ids)
+
+
+def _replace_forecasts(first_id, last_id, user_ids, balance_rows, category_rows):
+    # Writes come last so concurrent workers hold the write lock briefly
+    balance_table = BalanceForecast.__table__
+    category_table = CategoryForecast.__table__
+    db.session.execute(balance_table.delete().where(balance_table.c.user_id.between(first_id, last_id)))
+    db.session.execute(category_table.delete().where(category_table.c.user_id.between(first_id, last_id)))
+    if balance_rows:
+        db.session.execute(balance_table.insert(), balance_rows)
+    if category_rows:
+        db.session.execute(category_table.insert(), category_rows)
+    if user_ids:
+        # Forecasts are part of cached pages; a new version invalidates them
+        db.session.execute(
+            db.update(User).where(User.id.in_(user_ids)).values(data_version=User.data_version + 1)
+        )
+
+
+def user_id_ranges(chunk_size):
+    """Consecutive (first_id, last_id) ranges of at most chunk_size users"""
+    last_id = 0
+    while True:
+        ids = [uid for uid, in db.session.query(User.id).filter(User.id > last_id).order_by(User.id).limit(chunk_size)]
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        last_id = ids[-1]
+
+
+_worker_app = None
+
+
+def _init_worker(settings):
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app(type('ForecastWorkerConfig', (), settings))
+
+
+def _forecast_chunk(chunk, today):
+    shard, first_id, last_id = chunk
+    db.session.remove()
+    use_shard(shard)
+    count = forecast_users(first_id, last_id, today=today)
+    db.session.commit()
+    return count
+
+
+def _run_chunk(chunk, today):
+    with _worker_app.app_context():
+        return _forecast_chunk(chunk, today)
+
+
+def run_forecasts(today=None, workers=None, chunk_size=None):
+    """
+    Forecast every user, chunk_size users per task
+
+    Args:
+        today: Reference date (default today)
+        workers: Worker processes (default FORECAST_WORKERS, or one per
+                 CPU); 1 runs in this process
+        chunk_size: Users per task (default FORECAST_CHUNK_SIZE)
+
+    Returns:
+        Tuple (users forecast, chunks)
+    """
+    config = current_app.config
+    chunk_size = chunk_size or config['FORECAST_CHUNK_SIZE']
+    workers = workers or config['FORECAST_WORKERS'] or os.cpu_count() or 1
+    ranges = [(shard, *bounds) for shard in each_shard() for bounds in user_id_ranges(chunk_size)]
+
+    if workers == 1 or len(ranges) <= 1:
+        forecast = sum(_forecast_chunk(chunk, today) for chunk in ranges)
+        db.session.remove()
+        return forecast, len(ranges)
+
+    # Workers build their own app from this one's settings; spawn rather
+    # than fork so they do not share this process's database connections
+    settings = {key: value for key, value in config.items() if key.isupper()}
+    db.session.remove()
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(ranges)),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(settings,)
+    ) as pool:
+        forecast = sum(pool.map(_run_chunk, ranges, [today] * len(ranges)))
+    return forecast, len(ranges)
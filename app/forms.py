@@ -1,9 +1,12 @@
+from flask import current_app
 from flask_wtf import FlaskForm
-from app.models import User,TransactionType
+from app.models import TransactionType,ExpenseCategory,RecurrenceInterval,Household,HouseholdMember,SavedView
+from app.fx import count_unconvertible, get_rates
+from app.sharding import identity_taken
 from flask_login import current_user
-from wtforms import StringField,SelectField,PasswordField,BooleanField,SubmitField,DecimalField,TextAreaField,DateField
+from wtforms import StringField,SelectField,PasswordField,BooleanField,SubmitField,DecimalField,TextAreaField,DateField,HiddenField
 from flask_wtf.file import FileField,FileAllowed
-from wtforms.validators import DataRequired,Length,Email,EqualTo,ValidationError,NumberRange
+from wtforms.validators import DataRequired,Length,Email,EqualTo,ValidationError,NumberRange,Optional
 
 
 class RegisterForm(FlaskForm):
@@ -15,13 +18,11 @@ class RegisterForm(FlaskForm):
     submit=SubmitField("Register")
     
     def validate_username(self,username):
-        user=User.query.filter_by(username=username.data).first()
-        if user:
+        if identity_taken(username=username.data):
             raise ValidationError("User name already exit. Proceed with another one.")
     
     def validate_email(self,email):
-        user=User.query.filter_by(email=email.data).first()
-        if user:
+        if identity_taken(email=email.data):
             raise ValidationError("Already registered with this email. Please login")
 
 class LoginForm(FlaskForm):
@@ -34,19 +35,31 @@ class UpdateAccount(FlaskForm):
     username=StringField("Username",validators=[DataRequired(),Length(min=2,max=20)])
     email=StringField("Email",validators=[DataRequired(),Email()])
     picture=FileField("Update Profile Pic",validators=[FileAllowed(["jpg","png"])])
+    base_currency=SelectField("Base Currency",validators=[DataRequired()])
     submit=SubmitField("Update")
     
     def validate_username(self,username):
         if current_user.username!=username.data:
-            user=User.query.filter_by(username=username.data).first()
-            if user:
+            if identity_taken(username=username.data):
                 raise ValidationError("User name already exit. Proceed with another one.")
     
     def validate_email(self,email):
         if current_user.email!=email.data:
-            user=User.query.filter_by(email=email.data).first()
-            if user:
+            if identity_taken(email=email.data):
                 raise ValidationError("Already registered with this email. Please login")
+    
+    def validate_base_currency(self,base_currency):
+        if current_user.base_currency!=base_currency.data:
+            if HouseholdMember.query.filter_by(user_id=current_user.id).first():
+                # Household figures add members' amounts without conversion
+                raise ValidationError("Leave your household before changing the base currency")
+            if current_user.archived_before:
+                # Archived amounts are stored converted to the current base
+                raise ValidationError("Archived transactions are kept in "
+                                      f"{current_user.base_currency}; the base currency cannot be changed")
+            missing=count_unconvertible(current_user.id,base_currency.data)
+            if missing:
+                raise ValidationError(f"{missing} transaction(s) have no exchange rate to {base_currency.data}")
 
 class TransactionForm(FlaskForm):
     type=SelectField('Type',choices=[(t.value,t.name.title()) for t in TransactionType],
@@ -55,17 +68,109 @@ class TransactionForm(FlaskForm):
         'Amount',
         validators=[DataRequired(), NumberRange(min=0.01, max=99999999.99)]
     )
+    currency = SelectField('Currency', validators=[DataRequired()])
     category = SelectField('Category', validators=[DataRequired()])
     description = TextAreaField(
         'Description',
         validators=[Length(min=0, max=500)]
     )
     date = DateField('Date', validators=[DataRequired()])
+    tags = StringField('Tags', validators=[Optional(), Length(max=300)])
     
     def validate_date(self, field):
         from datetime import date
         if field.data > date.today():
             raise ValidationError('Transaction date cannot be in the future')
+        if current_user.archived_before and field.data < current_user.archived_before:
+            raise ValidationError(f'Transactions before {current_user.archived_before:%b %d, %Y} are archived')
+    
+    def validate_currency(self, field):
+        if self.date.data and not get_rates().can_convert(field.data, self.date.data, current_user.base_currency):
+            raise ValidationError(f'No {field.data} exchange rate for this date')
+    
+    def validate_tags(self, field):
+        from app.transactions.utilities import parse_tags
+        names = parse_tags(field.data)
+        if len(names) > 10:
+            raise ValidationError('At most 10 tags per transaction')
+        if any(len(name) > 30 for name in names):
+            raise ValidationError('Tags can be at most 30 characters long')
+
+class RecurringRuleForm(FlaskForm):
+    type=SelectField('Type',choices=[(t.value,t.name.title()) for t in TransactionType],
+                      validators=[DataRequired()])
+    amount = DecimalField(
+        'Amount',
+        validators=[DataRequired(), NumberRange(min=0.01, max=99999999.99)]
+    )
+    currency = SelectField('Currency', validators=[DataRequired()])
+    category = SelectField('Category', validators=[DataRequired()])
+    description = TextAreaField(
+        'Description',
+        validators=[Length(min=0, max=500)]
+    )
+    interval=SelectField('Repeats',choices=[(i.value,i.name.title()) for i in RecurrenceInterval],
+                          validators=[DataRequired()])
+    start_date = DateField('Start Date', validators=[DataRequired()])
+    end_date = DateField('End Date (Optional)', validators=[Optional()])
+    submit=SubmitField("Save")
+    
+    def validate_start_date(self, field):
+        if current_user.archived_before and field.data < current_user.archived_before:
+            raise ValidationError(f'Transactions before {current_user.archived_before:%b %d, %Y} are archived')
+    
+    def validate_end_date(self, field):
+        if field.data and self.start_date.data and field.data < self.start_date.data:
+            raise ValidationError('End date cannot be before the start date')
+    
+    def validate_currency(self, field):
+        if self.start_date.data and not get_rates().can_convert(field.data, self.start_date.data,
+                                                                 current_user.base_currency):
+            raise ValidationError(f'No {field.data} exchange rate for the start date')
+
+class CategoryRuleForm(FlaskForm):
+    pattern=StringField('Keyword',validators=[DataRequired(),Length(min=2,max=100)])
+    type=SelectField('Type',choices=[(t.value,t.name.title()) for t in TransactionType],
+                      validators=[DataRequired()])
+    category = SelectField('Category', validators=[DataRequired()])
+    submit=SubmitField("Add Rule")
+
+class BudgetForm(FlaskForm):
+    category=SelectField('Category',choices=[(c.value, c.name.replace('_',' ').title()) for c in ExpenseCategory],
+                         validators=[DataRequired()])
+    monthly_limit=DecimalField(
+        'Monthly Limit',
+        validators=[DataRequired(), NumberRange(min=0.01, max=99999999.99)]
+    )
+    submit=SubmitField("Save Budget")
+
+class HouseholdForm(FlaskForm):
+    name=StringField('Household Name',validators=[DataRequired(),Length(min=2,max=50)])
+    submit=SubmitField("Create Household")
+
+class JoinHouseholdForm(FlaskForm):
+    invite_code=StringField('Invite Code',validators=[DataRequired(),Length(max=16)])
+    submit=SubmitField("Join")
+    
+    def validate_invite_code(self,invite_code):
+        household=Household.query.filter_by(invite_code=invite_code.data.strip()).first()
+        if household is None:
+            raise ValidationError("No household with this invite code")
+        if household.base_currency!=current_user.base_currency:
+            raise ValidationError(f"Members of this household use {household.base_currency} as their base "
+                                  "currency; change yours on the account page first")
+
+class SavedViewForm(FlaskForm):
+    name=StringField('View Name',validators=[DataRequired(),Length(max=50)])
+    query=HiddenField('Query')  # the list's query string: filters and sort
+    submit=SubmitField("Save View")
+    
+    def validate_name(self,name):
+        views=SavedView.query.filter_by(user_id=current_user.id)
+        # Saving under an existing name replaces that view
+        if views.filter_by(name=name.data.strip()).first() is None \
+                and views.count()>=current_app.config['SAVED_VIEWS_PER_USER']:
+            raise ValidationError(f"You can keep at most {current_app.config['SAVED_VIEWS_PER_USER']} saved views")
 
 class UpdatePassword(FlaskForm):
     old_password=PasswordField('Old Password', validators=[DataRequired(),Length(min=6)])
@@ -79,8 +184,7 @@ class ResetRequestForm(FlaskForm):
     submit=SubmitField("Request Password Reset")
     
     def validate_email(self,email):
-        user=User.query.filter_by(email=email.data).first()
-        if user is None:
+        if not identity_taken(email=email.data):
             raise ValidationError("There is no account with that email. Please register first.")
 
 class ResetPasswordForm(FlaskForm):
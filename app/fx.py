@@ -0,0 +1,215 @@
+"""
+Exchange rates and conversion to each user's base currency.
+
+Rates are loaded from a local CSV file (``flask fx load``), never fetched.
+FxRate holds one row per currency and calendar day, the value of one unit in
+QUOTE_CURRENCY: days missing from the file are forward-filled at load time
+(and back-filled before the first quoted day), so converting a transaction
+is an equality join on (currency, date) rather than a "latest rate before"
+lookup.
+
+Aggregate queries convert inside SQL: ``join_rates`` outer-joins the rates
+of the transaction's currency and, for users whose base currency is not
+QUOTE_CURRENCY, of the base currency, and ``base_amount`` is the converted
+amount rounded to the cent. Derived state kept in step with writes (balance
+checkpoints, category totals, anomaly statistics) is fed amounts already
+converted in Python (see app/events.py), using an in-process RateTable: per
+currency, the first day's ordinal and an array('d') of daily rates.
+"""
+import csv
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from flask import current_app
+from flask_login import current_user
+from sqlalchemy import case, func
+from app import db
+from app.models import FxRate, Transaction, User
+
+# Currency the rates are quoted in, and the default base currency
+QUOTE_CURRENCY = 'INR'
+
+CURRENCY_SYMBOLS = {'INR': '₹', 'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥'}
+
+_CENT = Decimal('0.01')
+
+
+class MissingRateError(ValueError):
+    """No rate is loaded for a currency on a date"""
+
+
+class RateTable:
+    """Daily rates of every loaded currency in compact arrays"""
+
+    def __init__(self, rows):
+        self.series = {}
+        for currency, first_day, rates in rows:
+            self.series[currency] = (first_day.toordinal(), array('d', rates))
+
+    def currencies(self):
+        return [QUOTE_CURRENCY] + sorted(c for c in self.series if c != QUOTE_CURRENCY)
+
+    def rate(self, currency, day):
+        """Value of one unit of currency in QUOTE_CURRENCY on day, or None"""
+        if currency == QUOTE_CURRENCY:
+            return 1.0
+        entry = self.series.get(currency)
+        if entry is None or day is None:
+            return None
+        first, rates = entry
+        offset = day.toordinal() - first
+        return rates[offset] if 0 <= offset < len(rates) else None
+
+    def can_convert(self, currency, day, base_currency):
+        return currency == base_currency or (
+            self.rate(currency, day) is not None and self.rate(base_currency, day) is not None
+        )
+
+    def convert(self, amount, currency, day, base_currency):
+        """
+        Amount in base_currency, rounded to the cent
+
+        Raises:
+            MissingRateError: when either currency has no rate on day
+        """
+        amount = Decimal(str(amount))
+        if currency == base_currency:
+            return amount
+        rate, base_rate = self.rate(currency, day), self.rate(base_currency, day)
+        if rate is None or base_rate is None:
+            missing = currency if rate is None else base_currency
+            raise MissingRateError(f"No {missing} exchange rate for {day}")
+        return (amount * Decimal(repr(rate)) / Decimal(repr(base_rate))).quantize(_CENT, ROUND_HALF_UP)
+
+
+class RateCache:
+    """Per-process RateTable, reloaded whenever the FxRate rows are replaced"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entry = (None, None)
+
+    def table(self):
+        key = tuple(db.session.query(func.count(FxRate.id), func.max(FxRate.id)).one())
+        with self.lock:
+            cached_key, table = self.entry
+        if cached_key != key:
+            series = {}
+            rows = db.session.query(FxRate.currency, FxRate.date, FxRate.rate)\
+                .order_by(FxRate.currency, FxRate.date)
+            for currency, day, rate in rows:
+                series.setdefault(currency, (day, []))[1].append(float(rate))
+            table = RateTable((currency, first, rates) for currency, (first, rates) in series.items())
+            with self.lock:
+                self.entry = (key, table)
+        return table
+
+
+def get_rates():
+    return current_app.extensions['fx_rates'].table()
+
+
+def base_currency(user_id):
+    """The user's base currency (the loaded user object when there is one)"""
+    return db.session.get(User, user_id).base_currency or QUOTE_CURRENCY
+
+
+_rate = FxRate.__table__.alias('tx_rate')
+_base_rate = FxRate.__table__.alias('base_rate')
+
+
+def join_rates(query, base):
+    """Outer-join the rates base_amount(base) reads onto a Transaction query"""
+    query = query.outerjoin(_rate, (_rate.c.currency == Transaction.currency) & (_rate.c.date == Transaction.date))
+    if base != QUOTE_CURRENCY:
+        query = query.outerjoin(_base_rate, (_base_rate.c.currency == base) & (_base_rate.c.date == Transaction.date))
+    return query
+
+
+def base_amount(base):
+    """SQL expression for Transaction.amount in base; needs join_rates(query, base)"""
+    rate = case((Transaction.currency == QUOTE_CURRENCY, 1), else_=_rate.c.rate)
+    converted = Transaction.amount * rate
+    if base != QUOTE_CURRENCY:
+        converted = converted / _base_rate.c.rate
+    return case((Transaction.currency == base, Transaction.amount), else_=func.round(converted, 2))
+
+
+def count_unconvertible(user_id, base):
+    """How many of a user's transactions have no rate to base on their date"""
+    query = db.session.query(func.count(Transaction.id)).select_from(Transaction)
+    return join_rates(query, base)\
+        .filter(Transaction.user_id == user_id, base_amount(base).is_(None))\
+        .scalar()
+
+
+def currency_choices():
+    """Select choices for every currency with loaded rates"""
+    return [(code, code) for code in get_rates().currencies()]
+
+
+def currency_symbol(code=None):
+    """Symbol for code (default the current user's base currency), for templates"""
+    if code is None:
+        code = current_user.base_currency if current_user.is_authenticated else QUOTE_CURRENCY
+    return CURRENCY_SYMBOLS.get(code, f'{code} ')
+
+
+def load_rates_csv(path, fill_until=None, oldest=None):
+    """
+    Replace all rates with the ones in a CSV file
+
+    Args:
+        path: CSV with date (YYYY-MM-DD), currency and rate columns; rate is
+              the value of one unit of currency in QUOTE_CURRENCY
+        fill_until: Last day to forward-fill to (default today plus
+                    FX_FILL_AHEAD_DAYS)
+        oldest: First day to back-fill from (default the oldest
+                transaction in the database)
+
+    Returns:
+        Tuple (quoted rates read, daily rows stored, list of
+        (line number, message) for rows that were skipped)
+    """
+    quotes, errors = {}, []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            currency = (row.get('currency') or '').strip().upper()
+            try:
+                day = datetime.strptime((row.get('date') or '').strip(), '%Y-%m-%d').date()
+                rate = Decimal((row.get('rate') or '').strip())
+            except (ValueError, ArithmeticError):
+                errors.append((line, 'date must be YYYY-MM-DD and rate a number'))
+                continue
+            if len(currency) != 3 or not currency.isalpha() or currency == QUOTE_CURRENCY:
+                errors.append((line, f'invalid currency {currency!r}'))
+            elif rate <= 0:
+                errors.append((line, 'rate must be positive'))
+            else:
+                quotes.setdefault(currency, {})[day] = rate
+
+    if fill_until is None:
+        fill_until = date.today() + timedelta(days=current_app.config['FX_FILL_AHEAD_DAYS'])
+    # Back-fill to the oldest transaction so every stored date converts
+    if oldest is None:
+        oldest = db.session.query(func.min(Transaction.date)).scalar()
+
+    db.session.execute(db.delete(FxRate))
+    stored = 0
+    for currency, by_day in sorted(quotes.items()):
+        days = sorted(by_day)
+        day = min(days[0], oldest) if oldest else days[0]
+        last = max(days[-1], fill_until)
+        rate, batch = by_day[days[0]], []
+        while day <= last:
+            rate = by_day.get(day, rate)
+            batch.append({'currency': currency, 'date': day, 'rate': rate})
+            day += timedelta(days=1)
+        db.session.execute(db.insert(FxRate), batch)
+        stored += len(batch)
+    return sum(len(by_day) for by_day in quotes.values()), stored, errors
+
+
+def init_app(app):
+    app.extensions['fx_rates'] = RateCache()
@@ -0,0 +1,72 @@
+from flask import Blueprint,render_template,flash,redirect,url_for,request
+from flask_login import current_user,login_required
+from app import db
+from app.forms import HouseholdForm,JoinHouseholdForm
+from app.households.utilities import get_household,get_household_stats,new_invite_code
+from app.models import Household,HouseholdMember
+
+households=Blueprint('households',__name__)
+
+HOUSEHOLD_PERIODS = ('this_month', 'last_month', 'last_3_months', 'this_year', 'all_time')
+
+@households.route('/household')
+@login_required
+def household():
+    household=get_household(current_user.id)
+    if household is None:
+        return render_template('household.html',household=None,
+                               create_form=HouseholdForm(),join_form=JoinHouseholdForm())
+    period=request.args.get('period','this_month')
+    if period not in HOUSEHOLD_PERIODS:
+        period='this_month'
+    return render_template('household.html',household=household,stats=get_household_stats(household,period))
+
+@households.route('/household/create',methods=['POST'])
+@login_required
+def create_household():
+    form=HouseholdForm()
+    if get_household(current_user.id) is not None:
+        flash('You already belong to a household','warning')
+    elif form.validate_on_submit():
+        household=Household(name=form.name.data.strip(),
+                            base_currency=current_user.base_currency,
+                            invite_code=new_invite_code(),
+                            created_by=current_user.id)
+        household.members.append(HouseholdMember(user_id=current_user.id))
+        db.session.add(household)
+        db.session.commit()
+        flash('Household created. Share the invite code with the people you want to join','success')
+    else:
+        flash('Please give the household a name of 2 to 50 characters','danger')
+    return redirect(url_for('households.household'))
+
+@households.route('/household/join',methods=['POST'])
+@login_required
+def join_household():
+    form=JoinHouseholdForm()
+    if get_household(current_user.id) is not None:
+        flash('You already belong to a household','warning')
+    elif form.validate_on_submit():
+        household=Household.query.filter_by(invite_code=form.invite_code.data.strip()).first()
+        db.session.add(HouseholdMember(user_id=current_user.id,household_id=household.id))
+        db.session.commit()
+        flash(f'You joined {household.name}','success')
+    else:
+        for error in form.invite_code.errors:
+            flash(error,'danger')
+    return redirect(url_for('households.household'))
+
+@households.route('/household/leave',methods=['POST'])
+@login_required
+def leave_household():
+    member=db.session.get(HouseholdMember,current_user.id)
+    if member is not None:
+        household=member.household
+        if len(household.members)==1:
+            # Last member out; the membership goes with it
+            db.session.delete(household)
+        else:
+            db.session.delete(member)
+        db.session.commit()
+        flash('You left the household','danger')
+    return redirect(url_for('households.household'))
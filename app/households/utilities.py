@@ -0,0 +1,264 @@
+import secrets
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import case, func, select, union_all
+from app import cache, db
+from app.archive import daily_totals
+from app.fx import base_amount, join_rates
+from app.main.utilities import build_breakdown, period_range
+from app.models import HouseholdMember, MonthlyCategoryTotal, Transaction, TransactionType, User
+from app.sharding import group_by_shard, shard_session
+
+RECENT_MEMBERS_PER_QUERY = 200
+
+
+def new_invite_code():
+    return secrets.token_urlsafe(9)
+
+
+def get_household(user_id):
+    """The household a user belongs to, or None"""
+    member = db.session.get(HouseholdMember, user_id)
+    return member.household if member is not None else None
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def split_range(start_date, end_date):
+    """
+    Split a date range into whole months and partial months
+
+    Whole months are answered by the monthly category totals; the days of
+    partial months are summed from the transactions.
+
+    Returns:
+        Tuple (months, partials): months is (first month, last month), with
+        None for an open end, or None when the range holds no whole month;
+        partials is a list of (first day, last day) ranges
+    """
+    if start_date is None:
+        return (None, None), []
+    partials = []
+    first = start_date.replace(day=1)
+    if start_date.day != 1:
+        partials.append((start_date, min(_next_month(first) - timedelta(days=1), end_date)))
+        first = _next_month(first)
+    last = end_date.replace(day=1)
+    if _next_month(last) - timedelta(days=1) != end_date:
+        if last >= first:
+            partials.append((last, end_date))
+        last = (last - timedelta(days=1)).replace(day=1)
+    return ((first, last) if first <= last else None), partials
+
+
+def _rollup_figures(session, user_ids, first_day):
+    """Per member and type: all-time total and count, this month's total and the total before it"""
+    totals = MonthlyCategoryTotal.total
+    return session.query(
+        MonthlyCategoryTotal.user_id,
+        MonthlyCategoryTotal.type,
+        func.sum(totals),
+        func.sum(MonthlyCategoryTotal.count),
+        func.sum(case((MonthlyCategoryTotal.month == first_day, totals), else_=0)),
+        func.sum(case((MonthlyCategoryTotal.month < first_day, totals), else_=0))
+    ).filter(MonthlyCategoryTotal.user_id.in_(user_ids))\
+     .group_by(MonthlyCategoryTotal.user_id, MonthlyCategoryTotal.type)\
+     .all()
+
+
+def _rollup_categories(session, user_ids, months):
+    """Totals per type and category over a span of whole months"""
+    first, last = months
+    query = session.query(
+        MonthlyCategoryTotal.type,
+        MonthlyCategoryTotal.category,
+        func.sum(MonthlyCategoryTotal.total)
+    ).filter(MonthlyCategoryTotal.user_id.in_(user_ids))
+    if first is not None:
+        query = query.filter(MonthlyCategoryTotal.month >= first)
+    if last is not None:
+        query = query.filter(MonthlyCategoryTotal.month <= last)
+    return query.group_by(MonthlyCategoryTotal.type, MonthlyCategoryTotal.category).all()
+
+
+def _partial_totals(session, members, base, start, end):
+    """
+    Totals per member, type and category of the days start..end
+
+    Members whose archive reaches into the range add their archived days.
+    """
+    amount = base_amount(base)
+    rows = join_rates(session.query(
+        Transaction.user_id,
+        Transaction.type,
+        Transaction.category,
+        func.sum(amount)
+    ).select_from(Transaction), base).filter(
+        Transaction.user_id.in_([member[0] for member in members]),
+        Transaction.date >= start,
+        Transaction.date <= end
+    ).group_by(Transaction.user_id, Transaction.type, Transaction.category).all()
+    rows = [(user_id, TransactionType(tx_type), category, Decimal(str(total or 0)))
+            for user_id, tx_type, category, total in rows]
+    for user_id, _, _, _, cutoff in members:
+        if cutoff is not None and start < cutoff:
+            rows += [(user_id, TransactionType(tx_type), category, total)
+                     for _, tx_type, category, total in daily_totals(user_id, start, end, session=session)]
+    return rows
+
+
+def _recent_transactions(session, user_ids, limit):
+    """
+    The latest transactions of a group of members
+
+    One IN query ordered by date would sort every row of every member;
+    instead each member's newest rows come off the (user_id, date) index
+    and only those are merged.
+    """
+    columns = (Transaction.user_id, Transaction.date, Transaction.created_at, Transaction.description,
+               Transaction.category, Transaction.type, Transaction.amount, Transaction.currency)
+    rows = []
+    # SQLite caps the number of SELECTs in one compound statement
+    for i in range(0, len(user_ids), RECENT_MEMBERS_PER_QUERY):
+        latest = [
+            select(select(*columns).where(Transaction.user_id == user_id)
+                   .order_by(Transaction.date.desc(), Transaction.created_at.desc())
+                   .limit(limit).subquery())
+            for user_id in user_ids[i:i + RECENT_MEMBERS_PER_QUERY]
+        ]
+        merged = union_all(*latest).subquery()
+        rows += session.execute(select(merged).order_by(merged.c.date.desc(), merged.c.created_at.desc())
+                                .limit(limit)).all()
+    return rows
+
+
+@cache.memoize(timeout=3600)
+def _household_stats(household_id, base, members, period, today, recent):
+    first_day = today.replace(day=1)
+    start_date, end_date = period_range(period, today)
+    months, partials = split_range(start_date, end_date)
+    # This month up to today gives the balances; reused when a period ends today
+    month_to_date = (first_day, today)
+
+    usernames = {member[0]: member[3] for member in members}
+    figures = {user_id: defaultdict(Decimal) for user_id in usernames}
+    categories = {tx_type: defaultdict(Decimal) for tx_type in TransactionType}
+    recent_rows = []
+
+    shards = defaultdict(list)
+    for member in members:
+        shards[member[1]].append(member)
+    for shard, shard_members in shards.items():
+        user_ids = [member[0] for member in shard_members]
+        with shard_session(shard) as session:
+            # One grouped IN query over the rollups for every member's totals
+            for user_id, tx_type, total, count, month, before in _rollup_figures(session, user_ids, first_day):
+                tx_type = TransactionType(tx_type).value
+                member = figures[user_id]
+                member[f'total_{tx_type}'] += Decimal(str(total or 0))
+                member[f'month_{tx_type}'] += Decimal(str(month or 0))
+                member[f'before_{tx_type}'] += Decimal(str(before or 0))
+                member['transactions'] += count or 0
+
+            ranges = {month_to_date: _partial_totals(session, shard_members, base, *month_to_date)}
+            for span in partials:
+                if span not in ranges:
+                    ranges[span] = _partial_totals(session, shard_members, base, *span)
+            for user_id, tx_type, _, total in ranges[month_to_date]:
+                figures[user_id][f'to_date_{tx_type.value}'] += total
+            for span in partials:
+                for _, tx_type, category, total in ranges[span]:
+                    categories[tx_type][category] += total
+            if months is not None:
+                for tx_type, category, total in _rollup_categories(session, user_ids, months):
+                    categories[TransactionType(tx_type)][category] += Decimal(str(total or 0))
+
+            recent_rows += _recent_transactions(session, user_ids, recent)
+
+    member_stats = []
+    for user_id, member in figures.items():
+        balance = (member['before_income'] - member['before_expense']
+                   + member['to_date_income'] - member['to_date_expense'])
+        member_stats.append({
+            'user_id': user_id,
+            'username': usernames[user_id],
+            'balance': float(balance),
+            'total_income': float(member['total_income']),
+            'total_expense': float(member['total_expense']),
+            'month_income': float(member['month_income']),
+            'month_expense': float(member['month_expense']),
+            'total_transactions': int(member['transactions']),
+        })
+    member_stats.sort(key=lambda member: member['username'].lower())
+
+    def breakdown(tx_type):
+        totals = sorted(((category, float(total)) for category, total in categories[tx_type].items() if total),
+                        key=lambda item: item[1], reverse=True)
+        return build_breakdown(totals, period, start_date, end_date)
+
+    recent_rows.sort(key=lambda row: (row.date, row.created_at or datetime.min), reverse=True)
+    month_income = sum(member['month_income'] for member in member_stats)
+    month_expense = sum(member['month_expense'] for member in member_stats)
+    return {
+        'balance': sum(member['balance'] for member in member_stats),
+        'total_income': sum(member['total_income'] for member in member_stats),
+        'total_expense': sum(member['total_expense'] for member in member_stats),
+        'month_income': month_income,
+        'month_expense': month_expense,
+        'total_transactions': sum(member['total_transactions'] for member in member_stats),
+        'savings_rate': round((month_income - month_expense) / month_income * 100, 1) if month_income > 0 else 0,
+        'expense_breakdown': breakdown(TransactionType.EXPENSE),
+        'income_breakdown': breakdown(TransactionType.INCOME),
+        'selected_period': period,
+        'members': member_stats,
+        'recent_transactions': [{
+            'username': usernames[row.user_id],
+            'date': row.date,
+            'description': row.description or '',
+            'category': row.category,
+            'type': TransactionType(row.type).value,
+            'amount': float(row.amount),
+            'currency': row.currency,
+        } for row in recent_rows[:recent]],
+    }
+
+
+def get_household_stats(household, period='this_month', recent=10):
+    """
+    Combined dashboard figures of every member of a household
+
+    Nothing is computed per member. Each shard holding members gets
+    grouped IN queries over the monthly category totals (all-time and this
+    month's figures, balances up to last month, and the whole months of the
+    period's breakdowns), over the transactions of partial months (this
+    month up to today, and a partial first month of the period) and one
+    statement merging each member's latest transactions. Members share the
+    household's base currency, so the sums need no conversion. Results are
+    cached under every member's data_version, so any member's write
+    invalidates them.
+
+    Args:
+        household: The Household
+        period: Period for the category breakdowns (see get_category_breakdown)
+        recent: Number of recent transactions to include
+
+    Returns:
+        Dictionary shaped like get_dashboard_stats, plus per member figures
+        under 'members'; recent transactions are dictionaries that carry the
+        member's username
+    """
+    today = datetime.now().date()
+    user_ids = [member.user_id for member in household.members]
+    members = []
+    for shard, ids in group_by_shard(user_ids).items():
+        with shard_session(shard) as session:
+            members += [
+                (user_id, shard, data_version, username, cutoff)
+                for user_id, username, data_version, cutoff in session.query(
+                    User.id, User.username, User.data_version, User.archived_before
+                ).filter(User.id.in_(ids))
+            ]
+    return _household_stats(household.id, household.base_currency, tuple(sorted(members)), period, today, recent)
@@ -0,0 +1,384 @@
+"""
+Derived per-user ledger state kept in step with transaction writes.
+
+Balance checkpoints: one BalanceCheckpoint row per user and month holding the
+month's net and the closing balance at its end. Every write adds its signed
+amount to its month's net and to the closing balance of that month and all
+later ones, so back-dated inserts, edits that move a row between months and
+deletes are all handled the same way. The balance on any date is then the
+closing balance of the previous checkpoint plus a sum over at most one month
+of rows.
+
+Category totals: one MonthlyCategoryTotal row per user, month, type and
+category with the running sum and count, so per-month category figures
+(budgets, for one) are single-row reads instead of scans of the month.
+
+Amounts are in the user's base currency (see app/fx.py). Rows are
+maintained inside the flush (see app/events.py). ``flask ledger rebuild``
+recomputes them from the transactions, e.g. after upgrading a database that
+predates this table; ``rebuild_derived_state`` does so for everything kept
+per user after a change of base currency or of the exchange rates. Rows of
+archived months (see app/archive.py) are the only record of those months'
+totals and are kept by the rebuilds.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from decimal import Decimal
+from datetime import timedelta
+from itertools import accumulate
+from sqlalchemy import bindparam, case, func, literal
+from app import db
+from app.anomalies import rebuild_category_stats
+from app.archive import archived_before, daily_nets
+from app.events import on_flush
+from app.fx import base_amount, base_currency, join_rates
+from app.models import BalanceCheckpoint, MonthlyCategoryTotal, Transaction, TransactionType, User
+from app.saved_views import invalidate_saved_views
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def signed_amount(tx_type, amount):
+    amount = Decimal(str(amount))
+    return amount if TransactionType(tx_type) == TransactionType.INCOME else -amount
+
+
+def signed_base_amount(base):
+    """SQL expression for income minus expense in base; needs fx.join_rates"""
+    amount = base_amount(base)
+    return case((Transaction.type == TransactionType.INCOME, amount), else_=-amount)
+
+
+def _checkpoint_filter(user_id):
+    return BalanceCheckpoint.user_id == user_id
+
+
+_checkpoints = BalanceCheckpoint.__table__
+
+# New checkpoint opening at the closing balance of the one before it
+_insert_checkpoint = _checkpoints.insert().from_select(
+    ['user_id', 'month', 'net', 'closing_balance'],
+    db.select(
+        bindparam('b_user_id', type_=db.Integer),
+        bindparam('b_month', type_=db.Date),
+        literal(0),
+        func.coalesce(
+            db.select(_checkpoints.c.closing_balance)
+            .where(
+                _checkpoints.c.user_id == bindparam('b_user_id'),
+                _checkpoints.c.month < bindparam('b_month')
+            )
+            .order_by(_checkpoints.c.month.desc())
+            .limit(1)
+            .scalar_subquery(),
+            0
+        )
+    )
+)
+
+_add_to_net = _checkpoints.update()\
+    .where(_checkpoints.c.user_id == bindparam('b_user_id'), _checkpoints.c.month == bindparam('b_month'))\
+    .values(net=_checkpoints.c.net + bindparam('b_delta'))
+
+_add_to_closing = _checkpoints.update()\
+    .where(_checkpoints.c.user_id == bindparam('b_user_id'), _checkpoints.c.month >= bindparam('b_month'))\
+    .values(closing_balance=_checkpoints.c.closing_balance + bindparam('b_delta'))
+
+
+def _existing_keys(session, table, user_ids, months, *columns):
+    """Which (user_id, month, *columns) rows already exist for these users and months"""
+    rows = session.execute(
+        db.select(table.c.user_id, table.c.month, *(table.c[name] for name in columns))
+        .where(table.c.user_id.in_(user_ids), table.c.month.in_(months))
+    )
+    return {tuple(row) for row in rows}
+
+
+@on_flush
+def update_balance_checkpoints(session, changes):
+    deltas = defaultdict(Decimal)
+    for change in changes:
+        # Undated rows have no place on the timeline and are left out
+        if change.old is not None and change.old.date is not None:
+            deltas[change.user_id, month_start(change.old.date)] -= signed_amount(change.old.type, change.old.amount)
+        if change.new is not None and change.new.date is not None:
+            deltas[change.user_id, month_start(change.new.date)] += signed_amount(change.new.type, change.new.amount)
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # A handful of executemany statements per flush, however many users and
+    # months it touches. Missing months are created first, opening at the
+    # unchanged balance before them, and then every delta is applied.
+    existing = _existing_keys(session, _checkpoints, {u for u, _ in deltas}, {m for _, m in deltas})
+    missing = [
+        {'b_user_id': user_id, 'b_month': month}
+        for user_id, month in sorted(deltas) if (user_id, month) not in existing
+    ]
+    if missing:
+        session.execute(_insert_checkpoint, missing)
+
+    params = [
+        {'b_user_id': user_id, 'b_month': month, 'b_delta': delta}
+        for (user_id, month), delta in deltas.items()
+    ]
+    session.execute(_add_to_net, params)
+    session.execute(_add_to_closing, params)
+
+
+def rebuild_balance_checkpoints(user_id):
+    """
+    Recompute a user's checkpoints from their transactions
+
+    Args:
+        user_id: User whose checkpoints are replaced
+
+    Returns:
+        Number of checkpoint rows written
+    """
+    base = base_currency(user_id)
+    query = db.session.query(Transaction.date, func.sum(signed_base_amount(base))).select_from(Transaction)
+    rows = join_rates(query, base)\
+        .filter(Transaction.user_id == user_id, Transaction.date.isnot(None))\
+        .group_by(Transaction.date)\
+        .order_by(Transaction.date)\
+        .all()
+
+    nets = defaultdict(Decimal)
+    for tx_date, net in rows:
+        nets[month_start(tx_date)] += Decimal(str(net or 0))
+
+    stale = [_checkpoint_filter(user_id)]
+    closing = Decimal(0)
+    cutoff = archived_before(user_id)
+    if cutoff is not None:
+        # Archived months keep their checkpoints; later ones continue from them
+        stale.append(BalanceCheckpoint.month >= cutoff)
+        closing = _closing_before(user_id, cutoff)
+    db.session.execute(db.delete(BalanceCheckpoint).where(*stale))
+    checkpoints = []
+    for month in sorted(nets):
+        closing += nets[month]
+        checkpoints.append({'user_id': user_id, 'month': month, 'net': nets[month], 'closing_balance': closing})
+    if checkpoints:
+        db.session.execute(db.insert(BalanceCheckpoint), checkpoints)
+    return len(checkpoints)
+
+
+_category_totals = MonthlyCategoryTotal.__table__
+
+_add_to_category_total = _category_totals.update()\
+    .where(
+        _category_totals.c.user_id == bindparam('b_user_id'),
+        _category_totals.c.month == bindparam('b_month'),
+        _category_totals.c.type == bindparam('b_type'),
+        _category_totals.c.category == bindparam('b_category')
+    ).values(
+        total=_category_totals.c.total + bindparam('b_total'),
+        count=_category_totals.c.count + bindparam('b_count')
+    )
+
+
+@on_flush
+def update_category_totals(session, changes):
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for change in changes:
+        if change.old is not None and change.old.date is not None:
+            delta = deltas[change.user_id, month_start(change.old.date), change.old.type, change.old.category]
+            delta[0] -= Decimal(str(change.old.amount))
+            delta[1] -= 1
+        if change.new is not None and change.new.date is not None:
+            delta = deltas[change.user_id, month_start(change.new.date), change.new.type, change.new.category]
+            delta[0] += Decimal(str(change.new.amount))
+            delta[1] += 1
+    deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+
+    existing = _existing_keys(
+        session, _category_totals, {key[0] for key in deltas}, {key[1] for key in deltas}, 'type', 'category'
+    )
+    missing = [
+        {'user_id': user_id, 'month': month, 'type': tx_type, 'category': category, 'total': 0, 'count': 0}
+        for user_id, month, tx_type, category in deltas
+        if (user_id, month, TransactionType(tx_type), category) not in existing
+    ]
+    if missing:
+        session.execute(_category_totals.insert(), missing)
+
+    session.execute(_add_to_category_total, [
+        {'b_user_id': user_id, 'b_month': month, 'b_type': tx_type, 'b_category': category,
+         'b_total': total, 'b_count': count}
+        for (user_id, month, tx_type, category), (total, count) in deltas.items()
+    ])
+
+
+def rebuild_category_totals(user_id):
+    """
+    Recompute a user's monthly category totals from their transactions
+
+    Args:
+        user_id: User whose totals are replaced
+
+    Returns:
+        Number of rows written
+    """
+    base = base_currency(user_id)
+    query = db.session.query(
+        Transaction.date,
+        Transaction.type,
+        Transaction.category,
+        func.sum(base_amount(base)),
+        func.count(Transaction.id)
+    ).select_from(Transaction)
+    rows = join_rates(query, base)\
+        .filter(Transaction.user_id == user_id, Transaction.date.isnot(None))\
+        .group_by(Transaction.date, Transaction.type, Transaction.category)\
+        .all()
+
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    for tx_date, tx_type, category, total, count in rows:
+        entry = totals[month_start(tx_date), TransactionType(tx_type), category]
+        entry[0] += Decimal(str(total or 0))
+        entry[1] += count
+
+    stale = [MonthlyCategoryTotal.user_id == user_id]
+    cutoff = archived_before(user_id)
+    if cutoff is not None:
+        stale.append(MonthlyCategoryTotal.month >= cutoff)
+    db.session.execute(db.delete(MonthlyCategoryTotal).where(*stale))
+    values = [
+        {'user_id': user_id, 'month': month, 'type': tx_type, 'category': category, 'total': total, 'count': count}
+        for (month, tx_type, category), (total, count) in sorted(totals.items())
+    ]
+    if values:
+        db.session.execute(db.insert(MonthlyCategoryTotal), values)
+    return len(values)
+
+
+def rebuild_derived_state(user_id):
+    """
+    Recompute everything kept per user in their base currency
+
+    Args:
+        user_id: User whose checkpoints, category totals and anomaly
+                 statistics are replaced
+
+    Returns:
+        Number of checkpoint rows written
+    """
+    checkpoints = rebuild_balance_checkpoints(user_id)
+    rebuild_category_totals(user_id)
+    rebuild_category_stats(user_id)
+    # Cached pages, saved views and analytics columns hold converted amounts too
+    db.session.execute(db.update(User).where(User.id == user_id).values(data_version=User.data_version + 1))
+    invalidate_saved_views(user_id)
+    return checkpoints
+
+
+def _closing_before(user_id, month):
+    """Closing balance of the last checkpoint before month, or 0"""
+    closing = db.session.query(BalanceCheckpoint.closing_balance)\
+        .filter(_checkpoint_filter(user_id), BalanceCheckpoint.month < month)\
+        .order_by(BalanceCheckpoint.month.desc())\
+        .limit(1)\
+        .scalar()
+    return Decimal(str(closing)) if closing is not None else Decimal(0)
+
+
+def get_balance_at(user_id, day):
+    """
+    Balance at the end of a given day
+
+    Args:
+        user_id: Current user's ID
+        day: Date to compute the balance for
+
+    Returns:
+        Income minus expenses dated on or before day, as a float
+    """
+    first = month_start(day)
+    cutoff = archived_before(user_id)
+    if cutoff is not None and first < cutoff:
+        # Archival moves whole years, so the month is entirely archived
+        in_month = sum((net for _, net in daily_nets(user_id, first, day)), Decimal(0))
+        return float(_closing_before(user_id, first) + in_month)
+    base = base_currency(user_id)
+    query = db.session.query(func.sum(signed_base_amount(base))).select_from(Transaction)
+    in_month = join_rates(query, base)\
+        .filter(
+            Transaction.user_id == user_id,
+            Transaction.date >= first,
+            Transaction.date <= day
+        ).scalar() or 0
+    return float(_closing_before(user_id, first) + Decimal(str(in_month)))
+
+
+def _is_month_end(day):
+    return (day + timedelta(days=1)).day == 1
+
+
+def get_balances_at(user_id, points):
+    """
+    Balance at the end of each of several days
+
+    Month-end points are read straight from the checkpoints; the rest add
+    a sum of daily nets over their month, fetched in one grouped query.
+
+    Args:
+        user_id: Current user's ID
+        points: Ascending list of dates
+
+    Returns:
+        List of balances (floats), one per point
+    """
+    if not points:
+        return []
+    first_month = month_start(points[0])
+
+    opening = _closing_before(user_id, first_month)
+    checkpoints = db.session.query(BalanceCheckpoint.month, BalanceCheckpoint.closing_balance)\
+        .filter(
+            _checkpoint_filter(user_id),
+            BalanceCheckpoint.month >= first_month,
+            BalanceCheckpoint.month <= points[-1]
+        ).order_by(BalanceCheckpoint.month)\
+        .all()
+    months = [month for month, _ in checkpoints]
+    closings = [Decimal(str(closing)) for _, closing in checkpoints]
+
+    def closing_before(month):
+        index = bisect_left(months, month)
+        return closings[index - 1] if index else opening
+
+    partial = [point for point in points if not _is_month_end(point)]
+    days, prefix = [], [Decimal(0)]
+    if partial:
+        base = base_currency(user_id)
+        query = db.session.query(Transaction.date, func.sum(signed_base_amount(base))).select_from(Transaction)
+        rows = join_rates(query, base)\
+            .filter(
+                Transaction.user_id == user_id,
+                Transaction.date >= month_start(partial[0]),
+                Transaction.date <= partial[-1]
+            ).group_by(Transaction.date)\
+            .order_by(Transaction.date)\
+            .all()
+        rows = [(tx_date, Decimal(str(net or 0))) for tx_date, net in rows]
+        # Archived days all come before the hot ones
+        rows = daily_nets(user_id, month_start(partial[0]), partial[-1]) + rows
+        days = [tx_date for tx_date, _ in rows]
+        prefix += accumulate(net for _, net in rows)
+
+    balances = []
+    for point in points:
+        if _is_month_end(point):
+            balance = closing_before(point + timedelta(days=1))
+        else:
+            first = month_start(point)
+            in_month = prefix[bisect_right(days, point)] - prefix[bisect_left(days, first)]
+            balance = closing_before(first) + in_month
+        balances.append(round(float(balance), 2))
+    return balances
@@ -0,0 +1,364 @@
+"""
+Live dashboard updates over server-sent events.
+
+An open dashboard keeps one EventSource stream to /home/live. Each flush
+that writes transactions of a user with open tabs stores one LiveEvent
+row, in the same database transaction, holding what the dashboard needs
+to apply the change itself: the base-currency amount added or removed per
+(type, category, date), and the new and removed recent rows. Nothing is
+aggregated again; the page adds the amounts to its totals, its balance
+and the category breakdown of its period.
+
+Writers and open streams are usually in different worker processes, so
+events travel through the table. Each process starts one dispatcher
+thread with its first stream; while there are streams, it reads new
+events of every shard once per LIVE_POLL_SECONDS and hands them to the
+streams of their users. An idle
+stream costs a queue and a waiting greenlet, and never a query. The dispatcher also marks its users live (User.live_until), so
+users without open tabs get no events, and prunes old events.
+
+Every event carries the user's data_version before and after it. A tab
+that sees a gap reloads the page. Gaps come from missed events, and from
+jobs that rewrite rows without the write hooks (rebuilds, archiving, shard
+moves). A reconnecting stream first gets the events since the version it
+last saw (Last-Event-ID).
+
+A stream holds its worker for as long as the tab is open, so streams are
+served by gevent workers, where waiting is cheap (see stream_limit).
+Threaded workers would spend a thread per tab and serve only
+LIVE_THREADED_STREAMS; sync workers serve none. A refused stream gets 204
+No Content, which tells the browser not to reconnect.
+"""
+import json
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, inspect, select
+from app import db
+from app.events import on_flush
+from app.fx import currency_symbol
+from app.main.utilities import get_category_color
+from app.models import LiveEvent, TransactionType, User
+from app.sharding import shard_count, shard_engine
+
+# Users per IN list when marking users live
+_MARK_BATCH = 500
+
+
+class LiveBusy(Exception):
+    """This process already serves as many streams as it may"""
+
+
+def _evented():
+    """Whether gevent has patched this process, making blocking calls yield"""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def _amount(value):
+    return round(float(value), 2)
+
+
+def _recent_row(transaction, seq):
+    """What the dashboard's recent transactions table shows of a row"""
+    return {
+        'seq': seq,
+        'date': transaction.date.isoformat() if transaction.date else None,
+        'created': (transaction.created_at or datetime.utcnow()).isoformat(),
+        'label': transaction.date.strftime('%b %d, %Y') if transaction.date else '',
+        'description': transaction.description or '',
+        'category': transaction.category,
+        'color': get_category_color(transaction.category),
+        'type': TransactionType(transaction.type).value,
+        'amount': _amount(transaction.amount),
+        'symbol': currency_symbol(transaction.currency),
+    }
+
+
+def _old_seq(transaction):
+    """change_seq of a row as committed (the flush restamps updated rows first)"""
+    history = inspect(transaction).attrs.change_seq.history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else transaction.change_seq
+
+
+def live_payload(changes, since, version):
+    """
+    The dashboard delta of one user's changes in a flush, taking them from
+    data_version since to version
+
+    Rows are identified by change_seq, which shard moves keep unique. A
+    changed or deleted row that has none (written before change tracking)
+    cannot be found in the table, so the page reloads that table instead.
+
+    Returns:
+        Dict with since, version, entries [type, category, date, amount],
+        rows, removed and resync
+    """
+    entries = defaultdict(float)
+    rows, removed, resync = [], [], False
+    for change in changes:
+        for state, sign in ((change.old, -1), (change.new, 1)):
+            if state is not None:
+                key = (state.type.value, state.category, state.date.isoformat() if state.date else None)
+                entries[key] += sign * float(state.amount)
+        if change.old is not None:
+            seq = _old_seq(change.transaction)
+            if seq is None:
+                resync = True
+            else:
+                removed.append(seq)
+        if change.new is not None:
+            rows.append(_recent_row(change.transaction, change.transaction.change_seq))
+    return {
+        'since': since,
+        'version': version,
+        'entries': [[*key, _amount(amount)] for key, amount in entries.items() if _amount(amount)],
+        'rows': rows,
+        'removed': removed,
+        'resync': resync,
+    }
+
+
+@on_flush
+def queue_live_events(session, changes):
+    if not current_app.config['LIVE_UPDATES']:
+        return
+    now = datetime.utcnow()
+    by_user = defaultdict(list)
+    for change in changes:
+        by_user[change.user_id].append(change)
+    for user_id, user_changes in by_user.items():
+        # Loaded by the write hooks already
+        user = session.get(User, user_id)
+        if user.live_until is None or user.live_until < now:
+            continue
+        since = min(change.version for change in user_changes) - 1
+        payload = live_payload(user_changes, since, user.data_version)
+        session.add(LiveEvent(user_id=user_id, since=since, version=user.data_version,
+                              payload=json.dumps(payload, separators=(',', ':'))))
+
+
+def events_since(user_id, version):
+    """
+    Stored events taking a user from version to their current data_version
+
+    Returns:
+        List of (version, payload), or None when some are missing (the page
+        has to reload)
+    """
+    user = db.session.get(User, user_id)
+    if user.data_version == version:
+        return []
+    events = db.session.query(LiveEvent.since, LiveEvent.version, LiveEvent.payload)\
+        .filter(LiveEvent.user_id == user_id, LiveEvent.version > version)\
+        .order_by(LiveEvent.version)
+    replay = []
+    for since, to, payload in events:
+        if since != version:
+            return None
+        replay.append((to, payload))
+        version = to
+    return replay if version >= user.data_version else None
+
+
+class Subscriber:
+    """One open stream"""
+
+    __slots__ = ('user_id', 'queue', 'overflowed')
+
+    def __init__(self, user_id, size):
+        self.user_id = user_id
+        self.queue = queue.Queue(size)
+        self.overflowed = False
+
+
+class LiveHub:
+    """The streams of one process and the dispatcher thread feeding them"""
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.count = 0
+        self.last_ids = {}
+        self.thread = None
+        self.marked_at = self.pruned_at = 0.0
+        self.warned = False
+
+    def stream_limit(self, environ):
+        """
+        How many streams the worker serving environ may hold
+
+        LIVE_MAX_STREAMS under gevent, LIVE_THREADED_STREAMS in a threaded
+        worker, and none in a sync worker, where one stream would block
+        every other request.
+        """
+        config = self.app.config
+        if _evented():
+            return config['LIVE_MAX_STREAMS']
+        limit = config['LIVE_THREADED_STREAMS'] if environ.get('wsgi.multithread') else 0
+        if not limit and not self.warned:
+            self.warned = True
+            self.app.logger.warning('Live updates are on, but this worker does not serve streams; '
+                                    'serve /home/live from gevent workers')
+        return limit
+
+    def subscribe(self, user_id, limit):
+        """
+        Register a stream for a user, unless limit streams are open
+
+        Call before reading what the stream starts from, so no event in
+        between is missed.
+        """
+        config = self.app.config
+        with self.lock:
+            if self.count >= limit:
+                raise LiveBusy()
+            if not self.last_ids:
+                # Start after the events already stored
+                self.last_ids = {shard: self._max_id(shard) for shard in range(shard_count())}
+            subscriber = Subscriber(user_id, config['LIVE_QUEUE_SIZE'])
+            self.subscribers[user_id].add(subscriber)
+            self.count += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='live-dispatcher', daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.user_id)
+            if subscribers is not None and subscriber in subscribers:
+                subscribers.discard(subscriber)
+                self.count -= 1
+                if not subscribers:
+                    del self.subscribers[subscriber.user_id]
+
+    def _max_id(self, shard):
+        with shard_engine(shard).connect() as connection:
+            return connection.execute(select(func.max(LiveEvent.id))).scalar() or 0
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                time.sleep(self.app.config['LIVE_POLL_SECONDS'])
+                try:
+                    self.dispatch()
+                except Exception:
+                    self.app.logger.exception('Live update dispatch failed')
+
+    def dispatch(self):
+        """Hand new events to the streams of their users; mark and prune now and then"""
+        with self.lock:
+            user_ids = list(self.subscribers)
+        if not user_ids:
+            return
+        config = self.app.config
+        events = LiveEvent.__table__
+        now = time.monotonic()
+        mark = now - self.marked_at >= config['LIVE_MARK_SECONDS']
+        prune = now - self.pruned_at >= config['LIVE_EVENT_RETENTION_SECONDS'] / 2
+        for shard in range(shard_count()):
+            with shard_engine(shard).connect() as connection:
+                rows = connection.execute(
+                    select(events.c.id, events.c.user_id, events.c.version, events.c.payload)
+                    .where(events.c.id > self.last_ids.get(shard, 0)).order_by(events.c.id)
+                ).all()
+            if rows:
+                self.last_ids[shard] = rows[-1].id
+                self._deliver(rows)
+            if mark:
+                self._mark(shard, user_ids)
+            if prune:
+                cutoff = datetime.utcnow() - timedelta(seconds=config['LIVE_EVENT_RETENTION_SECONDS'])
+                with shard_engine(shard).begin() as connection:
+                    connection.execute(events.delete().where(events.c.created_at < cutoff))
+        if mark:
+            self.marked_at = now
+        if prune:
+            self.pruned_at = now
+
+    def _deliver(self, rows):
+        with self.lock:
+            for row in rows:
+                for subscriber in self.subscribers.get(row.user_id, ()):
+                    try:
+                        subscriber.queue.put_nowait((row.version, row.payload))
+                    except queue.Full:
+                        subscriber.overflowed = True
+
+    def _mark(self, shard, user_ids):
+        """Keep users with streams live until the next marking has had time to run"""
+        users = User.__table__
+        live_until = datetime.utcnow() + timedelta(seconds=2 * self.app.config['LIVE_MARK_SECONDS'])
+        with shard_engine(shard).begin() as connection:
+            for i in range(0, len(user_ids), _MARK_BATCH):
+                connection.execute(users.update().where(users.c.id.in_(user_ids[i:i + _MARK_BATCH]))
+                                   .values(live_until=live_until))
+
+
+def get_hub():
+    return current_app.extensions['live_hub']
+
+
+def mark_live(user):
+    """Make writes queue events for user now, unless already marked long enough"""
+    seconds = current_app.config['LIVE_MARK_SECONDS']
+    if user.live_until is None or user.live_until < datetime.utcnow() + timedelta(seconds=seconds):
+        user.live_until = datetime.utcnow() + timedelta(seconds=2 * seconds)
+        db.session.commit()
+
+
+def _message(data, event=None, event_id=None):
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(hub, subscriber, replay, today):
+    """
+    The event stream of one open dashboard
+
+    Sends the day the server is in (the page reloads when it changed), the
+    replayed events, then queued ones until LIVE_STREAM_SECONDS have passed,
+    with a comment line every LIVE_HEARTBEAT_SECONDS. The browser then
+    reconnects on its own. Runs outside the request context; the caller
+    unsubscribes when the response is closed.
+    """
+    config = hub.app.config
+    yield f"retry: {config['LIVE_RETRY_MS']}\n\n"
+    if replay is None:
+        yield _message('{}', event='reload')
+        return
+    yield _message(json.dumps({'today': today.isoformat()}), event='hello')
+    for version, payload in replay:
+        yield _message(payload, event_id=version)
+    deadline = time.monotonic() + config['LIVE_STREAM_SECONDS']
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            version, payload = subscriber.queue.get(timeout=min(config['LIVE_HEARTBEAT_SECONDS'], remaining))
+        except queue.Empty:
+            # Keeps proxies from closing the connection, and finds closed ones
+            yield ': keepalive\n\n'
+            continue
+        if subscriber.overflowed:
+            yield _message('{}', event='reload')
+            return
+        yield _message(payload, event_id=version)
+
+
+def init_app(app):
+    app.extensions['live_hub'] = LiveHub(app)
@@ -0,0 +1,166 @@
+"""
+Queued application logging with optional JSON output.
+
+Request threads only put records on a bounded queue; a QueueListener thread
+formats them and does the file writes and rotation. When LOG_QUEUE_SIZE
+records are already waiting, LOG_QUEUE_FULL decides: 'drop' discards the
+new record and counts it (the count is logged as a warning once the queue
+has room again), 'block' makes the caller wait for room.
+
+Every record logged during a request carries its request id (the incoming
+X-Request-ID header, or a new one, echoed on the response), endpoint and
+user id. With LOG_REQUESTS each request also logs one line with its status
+and latency. LOG_JSON writes one JSON object per line instead of text.
+
+The listener thread is started by create_app, so with gunicorn the app must
+be created in each worker (the default), not preloaded in the master.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request, request_finished
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+# Record attributes added by RequestContextFilter and the request log line
+CONTEXT_FIELDS = ('request_id', 'endpoint', 'user_id', 'latency_ms')
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request; runs on the logging thread's caller"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.endpoint = request.endpoint
+            # Only a user already loaded by the request; never query for one here
+            user = g.get('_login_user')
+            record.user_id = user.get_id() if user is not None and user.is_authenticated else None
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that drops or blocks when the queue is full"""
+
+    def __init__(self, log_queue, policy='drop'):
+        super().__init__(log_queue)
+        self.block = policy == 'block'
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback here, as text, but leave the
+        # record's other attributes for the formatter on the listener thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Handler.handle holds self.lock, so the counter needs no other lock
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record())
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _dropped_record(self):
+        return logging.makeLogRecord({
+            'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': f'Log queue full: dropped {self.dropped} records', 'pathname': __file__,
+        })
+
+
+class BlockingStopListener(QueueListener):
+    """QueueListener whose stop() waits for room instead of failing on a full queue"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request context fields when set"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.levelno >= logging.WARNING:
+            entry['source'] = f'{record.pathname}:{record.lineno}'
+        return json.dumps(entry, default=str)
+
+
+def _start_request():
+    g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+
+
+def _add_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+
+def _log_request(app, response, **extra):
+    # Sent after every after_request function, so compression is included
+    started = g.get('request_started')
+    if started is None:
+        return
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    app.logger.info('%s %s %s', request.method, request.path, response.status_code,
+                    extra={'latency_ms': latency_ms})
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_add_request_id)
+    if app.debug or app.testing:
+        return
+
+    config = app.config
+    log_file = config['LOG_FILE']
+    os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+    file_handler = RotatingFileHandler(log_file, maxBytes=10240000, backupCount=10)
+    file_handler.setFormatter(JsonFormatter() if config['LOG_JSON'] else logging.Formatter(TEXT_FORMAT))
+    file_handler.setLevel(logging.INFO)
+
+    queue_handler = BoundedQueueHandler(queue.Queue(config['LOG_QUEUE_SIZE']), config['LOG_QUEUE_FULL'])
+    queue_handler.addFilter(RequestContextFilter())
+    listener = BlockingStopListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # Write out what is still queued when the process exits
+    atexit.register(listener.stop)
+    app.extensions['log_listener'] = listener
+
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(logging.INFO)
+    if config['LOG_REQUESTS']:
+        request_finished.connect(_log_request, app)
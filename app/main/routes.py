@@ -1,26 +1,81 @@
-from flask import render_template,Blueprint,request,current_app
-from flask_login import current_user
-from app.main.utilities import get_dashboard_stats,get_category_breakdown
-from app import cache
+from datetime import date
+from flask import render_template,Blueprint,request,current_app,abort,Response
+from flask_login import current_user,login_required
+from app.main.utilities import get_dashboard_stats,get_category_breakdown,get_recent_transactions
+from app import cache,limiter
+from app.etags import etag_cached
+from app.live import LiveBusy,events_since,get_hub,mark_live,stream
 
 main=Blueprint('main',__name__)
 
+# Dashboard widgets that can be re-rendered on their own
+DASHBOARD_FRAGMENTS = {
+    'breakdown': '_category_breakdown.html',
+    'top_categories': '_top_categories.html',
+    'recent': '_recent_transactions.html',
+}
+
 @main.route('/')
 @main.route('/home')
+@etag_cached
 def home():
     if current_user.is_authenticated:
         
         period = request.args.get('period', 'this_month')
-        stats = get_dashboard_stats(current_user.id)
-        
-        expense_breakdown = get_category_breakdown(current_user.id, 'expense', period)
-        income_breakdown = get_category_breakdown(current_user.id, 'income', period)
-        
-        stats['expense_breakdown'] = expense_breakdown
-        stats['income_breakdown'] = income_breakdown
-        stats['selected_period'] = period
+        stats = get_dashboard_stats(current_user.id, period)
         
         return render_template('home.html',stats=stats)
     else:
         return render_template('home.html')
-        
+
+@main.route('/home/fragment/<widget>')
+@login_required
+@limiter.exempt
+@etag_cached
+def dashboard_fragment(widget):
+    template = DASHBOARD_FRAGMENTS.get(widget)
+    if template is None:
+        abort(404)
+    
+    if widget == 'recent':
+        return render_template(template, recent_transactions=get_recent_transactions(current_user.id))
+    
+    period = request.args.get('period', 'this_month')
+    breakdown = get_category_breakdown(current_user.id, 'expense', period)
+    return render_template(template, breakdown=breakdown)
+
+@main.route('/home/live')
+@login_required
+@limiter.exempt
+def live_updates():
+    """Server-sent dashboard updates for the current user, see app/live.py"""
+    if not current_app.config['LIVE_UPDATES']:
+        abort(404)
+    # The version the page was rendered at, or the last event's on reconnects
+    version = request.headers.get('Last-Event-ID') or request.args.get('version')
+    try:
+        version = int(version)
+    except (TypeError, ValueError):
+        abort(400)
+    
+    hub = get_hub()
+    limit = hub.stream_limit(request.environ)
+    if not limit:
+        # No Content makes EventSource give up instead of reconnecting
+        return Response(status=204)
+    try:
+        subscriber = hub.subscribe(current_user.id, limit)
+    except LiveBusy:
+        return Response(status=503, headers={'Retry-After': '30'})
+    try:
+        mark_live(current_user)
+        replay = events_since(current_user.id, version)
+    except Exception:
+        hub.unsubscribe(subscriber)
+        raise
+    
+    response = Response(stream(hub, subscriber, replay, date.today()), mimetype='text/event-stream')
+    response.call_on_close(lambda: hub.unsubscribe(subscriber))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx would hold events back
+    return response
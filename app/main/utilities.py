@@ -1,8 +1,17 @@
-from app.models import Transaction
-from app import db
+from flask import current_app
+from app.models import BalanceForecast, CategoryForecast, Transaction, TransactionType
+from app import cache, db
+from app.anomalies import get_recent_anomalies
+from app.archive import category_totals, daily_totals, reaches_archive
+from app.budgets.utilities import get_budget_status
+from app.fx import base_amount, base_currency, join_rates
+from app.ledger import get_balance_at, get_balances_at
+from app.read_models import recent_rows
 from sqlalchemy import func
 from datetime import datetime, timedelta
 
+TREND_INTERVALS = ('day', 'week', 'month')
+
 def get_spending_by_category(user_id, start_date=None, end_date=None, transaction_type='expense'):
     """
     Get spending/income grouped by category
@@ -16,63 +25,73 @@ def get_spending_by_category(user_id, start_date=None, end_date=None, transactio
     Returns:
         List of tuples: [(category, total_amount), ...]
     """
-    query = db.session.query(
-        Transaction.category,
-        func.sum(Transaction.amount).label('total')
-    ).filter(
-        Transaction.user_id == user_id,
-        Transaction.type == transaction_type
-    )
-    
-    # Apply date filters if provided
-    if start_date:
-        query = query.filter(Transaction.date >= start_date)
-    if end_date:
-        query = query.filter(Transaction.date <= end_date)
+    ledger_cache = current_app.extensions.get('ledger_cache')
+    if ledger_cache is not None:
+        results = ledger_cache.spending_by_category(user_id, start_date, end_date, transaction_type)
+    else:
+        # Converted to the user's base currency inside the query
+        base = base_currency(user_id)
+        amount = base_amount(base)
+        query = join_rates(db.session.query(
+            Transaction.category,
+            func.sum(amount).label('total')
+        ).select_from(Transaction), base).filter(
+            Transaction.user_id == user_id,
+            Transaction.type == transaction_type
+        )
+        
+        # Apply date filters if provided
+        if start_date:
+            query = query.filter(Transaction.date >= start_date)
+        if end_date:
+            query = query.filter(Transaction.date <= end_date)
+        
+        # Group by category and order by total descending
+        results = query.group_by(Transaction.category)\
+                      .order_by(func.sum(amount).desc())\
+                      .all()
+        results = [(cat, float(total or 0)) for cat, total in results]
     
-    # Group by category and order by total descending
-    results = query.group_by(Transaction.category)\
-                  .order_by(func.sum(Transaction.amount).desc())\
-                  .all()
+    # Archived years are only read when the range reaches back into them
+    if reaches_archive(user_id, start_date):
+        totals = dict(results)
+        for category, total in category_totals(user_id, transaction_type, start_date, end_date).items():
+            totals[category] = totals.get(category, 0) + float(total)
+        results = sorted(totals.items(), key=lambda item: item[1], reverse=True)
     
-    return [(cat, float(total)) for cat, total in results]
+    return results
 
 
-def get_category_breakdown(user_id, transaction_type='expense', period='this_month'):
+def period_range(period, today):
     """
-    Get detailed category breakdown with percentages
-    
+    First and last day of a dashboard period
+
     Args:
-        user_id: Current user's ID
-        transaction_type: 'expense' or 'income'
         period: 'this_month', 'last_month', 'last_3_months', 'this_year', 'all_time'
-    
+        today: Date the period is relative to
+
     Returns:
-        Dictionary with category data
+        Tuple (start_date, end_date), both None for all_time
     """
-    # Calculate date range based on period
-    today = datetime.now().date()
-    
     if period == 'this_month':
-        start_date = today.replace(day=1)
-        end_date = today
-    elif period == 'last_month':
+        return today.replace(day=1), today
+    if period == 'last_month':
         last_month = today.replace(day=1) - timedelta(days=1)
-        start_date = last_month.replace(day=1)
-        end_date = last_month
-    elif period == 'last_3_months':
-        start_date = today - timedelta(days=90)
-        end_date = today
-    elif period == 'this_year':
-        start_date = today.replace(month=1, day=1)
-        end_date = today
-    else:  # all_time
-        start_date = None
-        end_date = None
-    
-    # Get category totals
-    categories = get_spending_by_category(user_id, start_date, end_date, transaction_type)
-    
+        return last_month.replace(day=1), last_month
+    if period == 'last_3_months':
+        return today - timedelta(days=90), today
+    if period == 'this_year':
+        return today.replace(month=1, day=1), today
+    return None, None  # all_time
+
+
+def build_breakdown(categories, period, start_date, end_date):
+    """
+    Category breakdown with percentages from (category, amount) pairs
+
+    Returns:
+        Dictionary with category data
+    """
     # Calculate total and percentages
     total_amount = sum(amount for _, amount in categories)
     
@@ -94,10 +113,67 @@ def get_category_breakdown(user_id, transaction_type='expense', period='this_mon
     }
 
 
-def get_dashboard_stats(user_id):
+def get_category_breakdown(user_id, transaction_type='expense', period='this_month'):
+    """
+    Get detailed category breakdown with percentages
+    
+    Args:
+        user_id: Current user's ID
+        transaction_type: 'expense' or 'income'
+        period: 'this_month', 'last_month', 'last_3_months', 'this_year', 'all_time'
+    
+    Returns:
+        Dictionary with category data
+    """
+    # Calculate date range based on period
+    start_date, end_date = period_range(period, datetime.now().date())
+    
+    # Get category totals
+    categories = get_spending_by_category(user_id, start_date, end_date, transaction_type)
+    
+    return build_breakdown(categories, period, start_date, end_date)
+
+
+def get_month_totals(user_id, month_start):
+    """
+    This month's income and expense totals, from one grouped query
+    
+    Args:
+        user_id: Current user's ID
+        month_start: First day of the current month
+    
+    Returns:
+        Dictionary with month_income and month_expense
+    """
+    base = base_currency(user_id)
+    totals = dict(join_rates(db.session.query(Transaction.type, func.sum(base_amount(base)))
+                             .select_from(Transaction), base)
+                  .filter(Transaction.user_id == user_id, Transaction.date >= month_start)
+                  .group_by(Transaction.type)
+                  .all())
+    return {
+        'month_income': float(totals.get(TransactionType.INCOME) or 0),
+        'month_expense': float(totals.get(TransactionType.EXPENSE) or 0),
+    }
+
+
+def get_recent_transactions(user_id, limit=5):
+    """The newest transactions for the dashboard, as app.read_models.RecentRow"""
+    return recent_rows(
+        Transaction.query.filter_by(user_id=user_id)
+        .order_by(Transaction.date.desc(), Transaction.created_at.desc())
+        .limit(limit)
+    )
+
+
+def get_dashboard_stats(user_id, period='this_month'):
     """
     Get comprehensive dashboard statistics
     
+    Args:
+        user_id: Current user's ID
+        period: Period for the category breakdowns (see get_category_breakdown)
+    
     Returns:
         Dictionary with all dashboard data
     """
@@ -105,57 +181,255 @@ def get_dashboard_stats(user_id):
     today = datetime.now().date()
     first_day = today.replace(day=1)
     
-    # Total balance (all time)
-    total_income = db.session.query(func.sum(Transaction.amount))\
-        .filter(Transaction.user_id == user_id, Transaction.type == 'income')\
-        .scalar() or 0
+    ledger_cache = current_app.extensions.get('ledger_cache')
+    if ledger_cache is not None:
+        totals = ledger_cache.month_totals(user_id, first_day)
+    else:
+        totals = get_month_totals(user_id, first_day)
     
-    total_expense = db.session.query(func.sum(Transaction.amount))\
-        .filter(Transaction.user_id == user_id, Transaction.type == 'expense')\
-        .scalar() or 0
+    # Checkpoint lookup plus this month's rows instead of an all-time sum
+    balance = get_balance_at(user_id, today)
     
-    # This month's data
-    month_income = db.session.query(func.sum(Transaction.amount))\
-        .filter(
-            Transaction.user_id == user_id,
-            Transaction.type == 'income',
-            Transaction.date >= first_day
-        ).scalar() or 0
-    
-    month_expense = db.session.query(func.sum(Transaction.amount))\
-        .filter(
-            Transaction.user_id == user_id,
-            Transaction.type == 'expense',
-            Transaction.date >= first_day
-        ).scalar() or 0
+    month_income = totals['month_income']
+    month_expense = totals['month_expense']
     
     # Get category breakdown
-    expense_breakdown = get_category_breakdown(user_id, 'expense', 'this_month')
-    income_breakdown = get_category_breakdown(user_id, 'income', 'this_month')
-    
-    # Recent transactions
-    recent_transactions = Transaction.query.filter_by(user_id=user_id)\
-        .order_by(Transaction.date.desc(), Transaction.created_at.desc())\
-        .limit(5)\
-        .all()
+    expense_breakdown = get_category_breakdown(user_id, 'expense', period)
+    income_breakdown = get_category_breakdown(user_id, 'income', period)
     
-    # Transaction count
-    total_transactions = Transaction.query.filter_by(user_id=user_id).count()
+    recent_transactions = get_recent_transactions(user_id)
     
     return {
-        'balance': float(total_income - total_expense),
-        'total_income': float(total_income),
-        'total_expense': float(total_expense),
-        'month_income': float(month_income),
-        'month_expense': float(month_expense),
+        'today': today,
+        'balance': balance,
+        'month_income': month_income,
+        'month_expense': month_expense,
         'expense_breakdown': expense_breakdown,
         'income_breakdown': income_breakdown,
+        'selected_period': period,
         'recent_transactions': recent_transactions,
-        'total_transactions': total_transactions,
+        'budgets': get_budget_status(user_id, today),
+        'anomalies': get_recent_anomalies(user_id),
+        'forecast': get_forecast(user_id),
         'savings_rate': round((month_income - month_expense) / month_income * 100, 1) if month_income > 0 else 0
     }
 
 
+def get_forecast(user_id, top=3):
+    """
+    The user's stored cash-flow forecast (see app/forecast.py)
+    
+    Args:
+        user_id: Current user's ID
+        top: Number of expense categories to include
+    
+    Returns:
+        Dictionary with per-month income, expense and closing balance, the
+        categories with the highest projected monthly spending and when the
+        forecast was made, or None if the user has no forecast yet
+    """
+    months = BalanceForecast.query.filter_by(user_id=user_id)\
+        .order_by(BalanceForecast.month)\
+        .all()
+    if not months:
+        return None
+    
+    categories = db.session.query(CategoryForecast.category, func.avg(CategoryForecast.amount))\
+        .filter(CategoryForecast.user_id == user_id)\
+        .group_by(CategoryForecast.category)\
+        .order_by(func.avg(CategoryForecast.amount).desc())\
+        .limit(top)\
+        .all()
+    
+    return {
+        'months': [{
+            'month': row.month,
+            'income': float(row.income),
+            'expense': float(row.expense),
+            'closing_balance': float(row.closing_balance)
+        } for row in months],
+        'top_categories': [{'category': category, 'monthly': float(amount)} for category, amount in categories],
+        'generated_at': months[0].generated_at
+    }
+
+
+def align_to_bucket(day, interval):
+    """Start of the day/week (Monday)/month bucket containing day"""
+    if interval == 'month':
+        return day.replace(day=1)
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def next_bucket(day, interval):
+    if interval == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if interval == 'week':
+        return day + timedelta(days=7)
+    return day + timedelta(days=1)
+
+
+def bucket_starts(start_date, end_date, interval):
+    """Every bucket start from the one containing start_date through end_date"""
+    starts = []
+    current = align_to_bucket(start_date, interval)
+    while current <= end_date:
+        starts.append(current)
+        current = next_bucket(current, interval)
+    return starts
+
+
+def one_year_earlier(day):
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:  # 29 February
+        return day.replace(year=day.year - 1, day=28)
+
+
+def _change_pct(current, previous):
+    import numpy as np
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(previous > 0, (current - previous) / previous * 100, np.nan)
+    return [None if np.isnan(value) else round(float(value), 1) for value in change]
+
+
+@cache.memoize(timeout=3600)
+def _trend_series(user_id, data_version, start_date, end_date, interval):
+    import numpy as np
+    
+    # Reach back a year so the first buckets have year-over-year values too
+    query_start = align_to_bucket(one_year_earlier(start_date), interval)
+    starts = bucket_starts(query_start, end_date, interval)
+    start_ordinals = np.array([d.toordinal() for d in starts])
+    first_shown = int(np.searchsorted(start_ordinals, align_to_bucket(start_date, interval).toordinal()))
+    
+    # Single grouped query at day granularity; bucketing happens below
+    base = base_currency(user_id)
+    rows = join_rates(db.session.query(
+        Transaction.date,
+        Transaction.type,
+        Transaction.category,
+        func.sum(base_amount(base))
+    ).select_from(Transaction), base).filter(
+        Transaction.user_id == user_id,
+        Transaction.date >= query_start,
+        Transaction.date <= end_date
+    ).group_by(Transaction.date, Transaction.type, Transaction.category).all()
+    if reaches_archive(user_id, query_start):
+        rows += daily_totals(user_id, query_start, end_date)
+    
+    keys = {}
+    day_ordinals = np.empty(len(rows), dtype=np.int64)
+    key_index = np.empty(len(rows), dtype=np.int64)
+    totals = np.empty(len(rows), dtype=np.float64)
+    for i, (tx_date, tx_type, category, total) in enumerate(rows):
+        day_ordinals[i] = tx_date.toordinal()
+        key_index[i] = keys.setdefault((TransactionType(tx_type).value, category), len(keys))
+        totals[i] = float(total or 0)
+    
+    # Dense (series, bucket) matrix: empty buckets are zeros, not gaps
+    bucket_index = np.searchsorted(start_ordinals, day_ordinals, side='right') - 1
+    matrix = np.zeros((len(keys), len(starts)))
+    np.add.at(matrix, (key_index, bucket_index), totals)
+    
+    # Bucket holding the same date one year earlier, for every shown bucket
+    shown = starts[first_shown:]
+    year_ago = np.searchsorted(
+        start_ordinals,
+        [align_to_bucket(one_year_earlier(d), interval).toordinal() for d in shown],
+        side='right'
+    ) - 1
+    shown_index = np.arange(first_shown, len(starts))
+    
+    series = {}
+    comparisons = {}
+    for tx_type in TransactionType:
+        rows_for_type = [index for (key_type, _), index in keys.items() if key_type == tx_type.value]
+        type_total = matrix[rows_for_type].sum(axis=0) if rows_for_type else np.zeros(len(starts))
+        current = type_total[shown_index]
+        previous = type_total[shown_index - 1]
+        previous_year = type_total[year_ago]
+        
+        series[tx_type.value] = {
+            'total': np.round(current, 2).tolist(),
+            'categories': {
+                category: np.round(matrix[index, shown_index], 2).tolist()
+                for (key_type, category), index in sorted(keys.items())
+                if key_type == tx_type.value and matrix[index, shown_index].any()
+            }
+        }
+        comparisons[tx_type.value] = {
+            'previous_period': np.round(previous, 2).tolist(),
+            'previous_year': np.round(previous_year, 2).tolist(),
+            'period_change_pct': _change_pct(current, previous),
+            'year_change_pct': _change_pct(current, previous_year),
+        }
+    
+    return {
+        'interval': interval,
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'buckets': [d.isoformat() for d in shown],
+        'series': series,
+        'comparisons': comparisons,
+    }
+
+
+def get_trend_series(user_id, data_version, start_date, end_date, interval='month'):
+    """
+    Income and expense over time, bucketed by day, week or month
+    
+    Args:
+        user_id: Current user's ID
+        data_version: User's data_version; part of the cache key so any
+                      transaction write invalidates cached series
+        start_date: First day of the range
+        end_date: Last day of the range
+        interval: 'day', 'week' or 'month'
+    
+    Returns:
+        Dictionary with bucket start dates, per type totals and per category
+        series (zero filled), plus previous period and previous year values
+        for month-over-month / year-over-year style comparisons
+    """
+    return _trend_series(user_id, data_version, start_date, end_date, interval)
+
+
+@cache.memoize(timeout=3600)
+def _balance_series(user_id, data_version, start_date, end_date, interval):
+    starts = bucket_starts(start_date, end_date, interval)
+    # Each bucket is represented by the balance at its last day
+    points = [min(next_bucket(d, interval) - timedelta(days=1), end_date) for d in starts]
+    return {
+        'interval': interval,
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'buckets': [d.isoformat() for d in starts],
+        'dates': [d.isoformat() for d in points],
+        'balance': get_balances_at(user_id, points),
+    }
+
+
+def get_balance_series(user_id, data_version, start_date, end_date, interval='month'):
+    """
+    Running balance over time, for the balance chart
+    
+    Args:
+        user_id: Current user's ID
+        data_version: User's data_version (cache key, as in get_trend_series)
+        start_date: First day of the range
+        end_date: Last day of the range
+        interval: 'day', 'week' or 'month'
+    
+    Returns:
+        Dictionary with bucket start dates, the date each balance is taken
+        at (bucket end, or end_date for the last bucket) and the balances
+    """
+    return _balance_series(user_id, data_version, start_date, end_date, interval)
+
+
 def get_category_icon(category):
     """
     Return Font Awesome icon for category
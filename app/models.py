@@ -1,16 +1,12 @@
 import enum
 from datetime import datetime
-from app import db,login_manager
+from app import db
 from flask_login import UserMixin
 from flask import current_app
 from itsdangerous import URLSafeTimedSerializer as Serializer
 import logging
 logger = logging.getLogger(__name__)
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
 class TransactionType(str,enum.Enum):
     EXPENSE='expense'
     INCOME='income'
@@ -38,6 +34,12 @@ class ExpenseCategory(str,enum.Enum):
     MISCELLANEOUS='miscellaneous'
     OTHERS='other_expense'
 
+class RecurrenceInterval(str, enum.Enum):
+    DAILY='daily'
+    WEEKLY='weekly'
+    MONTHLY='monthly'
+    YEARLY='yearly'
+
 class User(db.Model,UserMixin):
     id=db.Column(db.Integer, primary_key=True)
     username=db.Column(db.String(20),unique=True,nullable=False)
@@ -45,11 +47,31 @@ class User(db.Model,UserMixin):
     password=db.Column(db.String(60),nullable=False)
     image_file=db.Column(db.String(20),default="default.jpg",nullable=False)
     created_at=db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every transaction write, see app/events.py
+    data_version=db.Column(db.Integer, default=0, nullable=False)
+    # Tombstones up to this data_version have been pruned; sync cursors
+    # below it have to start over, see app/api/utilities.py
+    sync_horizon=db.Column(db.Integer, default=0, nullable=False)
+    # Bumped when per-user settings (budgets, category rules) change; part
+    # of page ETags and the category rule cache key
+    settings_version=db.Column(db.Integer, default=0, nullable=False)
+    # Currency totals, balances and statistics are shown in, see app/fx.py
+    base_currency=db.Column(db.String(3),nullable=False,default='INR')
+    # First day still in the transaction table; earlier rows are archived,
+    # see app/archive.py
+    archived_before=db.Column(db.Date)
+    # While in the future, writes queue dashboard updates for the user's open
+    # tabs, see app/live.py
+    live_until=db.Column(db.DateTime)
     transactions=db.relationship("Transaction",backref="user",lazy=True,cascade="all, delete-orphan")
     
     def __repr__(self):
         return f"User({self.username},{self.email})"
     
+    def touch_settings(self):
+        """Invalidate cached pages and rule sets after a settings change"""
+        self.settings_version = (self.settings_version or 0) + 1
+    
     def get_reset_token(self):
         s=Serializer(current_app.config['SECRET_KEY'])
         return s.dumps({'user_id':self.id},salt='password-reset-salt')
@@ -61,7 +83,9 @@ class User(db.Model,UserMixin):
         except (ValueError, TypeError) as e:
             logger.error(f"Token verification failed: {e}")
             return None
-        return User.query.get(user_id)
+        # Routes the session to the user's shard
+        from app.sharding import load_user
+        return load_user(user_id)
     
 
 class Transaction(db.Model):
@@ -69,12 +93,421 @@ class Transaction(db.Model):
     user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
     type=db.Column(db.Enum(TransactionType), nullable=False)
     amount = db.Column(db.Numeric(10, 2),nullable=False)
+    # ISO 4217 code of amount; the owner's base currency when not given
+    currency=db.Column(db.String(3),nullable=False,default='INR')
     category=db.Column(db.String(50),nullable=False)
     description=db.Column(db.Text)
     date = db.Column(db.Date)
     created_at=db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at=db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # User.data_version at this row's last write, used as the sync cursor
+    change_seq=db.Column(db.Integer)
+    # Set on occurrences created from a RecurringRule
+    recurring_rule_id=db.Column(db.Integer,db.ForeignKey("recurring_rule.id"))
+    # Unusually large for its category when written, see app/anomalies.py
+    is_anomaly=db.Column(db.Boolean,nullable=False,default=False)
+    tag_links=db.relationship("TransactionTag",backref="transaction",lazy=True,cascade="all, delete-orphan")
+    # Read side of tag_links; set tags with app.transactions.utilities.set_tags
+    tags=db.relationship("Tag",secondary="transaction_tag",viewonly=True,lazy=True,order_by="Tag.name")
+    
+    __table_args__ = (
+        db.Index('ix_transaction_user_change_seq', 'user_id', 'change_seq'),
+        db.Index('ix_transaction_user_date', 'user_id', 'date'),
+        db.Index('ix_transaction_user_anomaly', 'user_id', 'is_anomaly', 'date'),
+        # At most one occurrence per rule and date, so reruns cannot duplicate
+        db.UniqueConstraint('recurring_rule_id', 'date', name='uq_transaction_recurring_occurrence'),
+    )
+    
+    # Listed rows read back from the archive are app.read_models.TransactionRow
+    archived = False
     
     def __repr__(self):
         return f"Transaction({self.type},{self.amount},{self.category})"
+
+
+class Tag(db.Model):
+    """A user's label for transactions; a transaction can carry several"""
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    name=db.Column(db.String(30),nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_tag_user_name'),
+    )
+    
+    def __repr__(self):
+        return f"Tag({self.name})"
+
+
+class TransactionTag(db.Model):
+    """
+    A tag on a transaction
+
+    The primary key serves transaction -> tags, the tag index tag ->
+    transactions (the tag filters). user_id is the owner's, so per-user
+    jobs such as shard moves find the rows.
+    """
+    transaction_id=db.Column(db.Integer,db.ForeignKey("transaction.id"),primary_key=True)
+    tag_id=db.Column(db.Integer,db.ForeignKey("tag.id"),primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    tag=db.relationship("Tag")
+    
+    __table_args__ = (
+        db.Index('ix_transaction_tag_tag', 'tag_id', 'transaction_id'),
+    )
+    
+    def __repr__(self):
+        return f"TransactionTag({self.transaction_id},{self.tag_id})"
+
+
+class TransactionTombstone(db.Model):
+    """Marker left behind by a deleted transaction so sync clients can drop it"""
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    transaction_id=db.Column(db.Integer,nullable=False)
+    change_seq=db.Column(db.Integer,nullable=False)
+    deleted_at=db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_transaction_tombstone_user_change_seq', 'user_id', 'change_seq'),
+    )
+    
+    def __repr__(self):
+        return f"TransactionTombstone({self.transaction_id},{self.change_seq})"
+
+
+class LiveEvent(db.Model):
+    """
+    Dashboard changes from one flush, for the user's open tabs (app/live.py)
+
+    Short-lived: rows are pruned after LIVE_EVENT_RETENTION_SECONDS and
+    are not carried over by shard moves.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,nullable=False)
+    since=db.Column(db.Integer,nullable=False)  # the user's data_version before the flush
+    version=db.Column(db.Integer,nullable=False)  # and after it
+    payload=db.Column(db.Text,nullable=False)  # JSON, sent to the browser as it is
+    created_at=db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.Index('ix_live_event_user_version', 'user_id', 'version'),
+        # Ids never go back after pruning; readers follow them upwards
+        {'sqlite_autoincrement': True, 'info': {'transient': True}},
+    )
+    
+    def __repr__(self):
+        return f"LiveEvent({self.user_id},{self.since}->{self.version})"
+
+
+class BalanceCheckpoint(db.Model):
+    """
+    Per-user monthly running balance, maintained on every transaction write
+
+    net is the month's income minus expenses; closing_balance is the balance
+    after the last day of the month. Months without transactions have no row.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    month=db.Column(db.Date,nullable=False)  # first day of the month
+    net=db.Column(db.Numeric(14, 2),nullable=False,default=0)
+    closing_balance=db.Column(db.Numeric(14, 2),nullable=False,default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', name='uq_balance_checkpoint_user_month'),
+    )
+    
+    def __repr__(self):
+        return f"BalanceCheckpoint({self.month},{self.closing_balance})"
+
+
+class MonthlyCategoryTotal(db.Model):
+    """Per-user running total and count for each month, type and category"""
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    month=db.Column(db.Date,nullable=False)  # first day of the month
+    type=db.Column(db.Enum(TransactionType), nullable=False)
+    category=db.Column(db.String(50),nullable=False)
+    total=db.Column(db.Numeric(14, 2),nullable=False,default=0)
+    count=db.Column(db.Integer,nullable=False,default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', 'type', 'category', name='uq_monthly_category_total'),
+    )
+    
+    def __repr__(self):
+        return f"MonthlyCategoryTotal({self.month},{self.category},{self.total})"
+
+
+class CategoryStats(db.Model):
+    """
+    Streaming statistics of a user's expense amounts in one category
+
+    count, mean and m2 (sum of squared deviations from the mean) are
+    Welford's running variance; the amount distribution is kept in
+    CategoryStatsBucket rows. Both are updated on every transaction write.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    type=db.Column(db.Enum(TransactionType), nullable=False)
+    category=db.Column(db.String(50),nullable=False)
+    count=db.Column(db.Integer,nullable=False,default=0)
+    mean=db.Column(db.Float,nullable=False,default=0)
+    m2=db.Column(db.Float,nullable=False,default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'type', 'category', name='uq_category_stats'),
+    )
+    
+    def __repr__(self):
+        return f"CategoryStats({self.category},{self.count},{self.mean})"
+
+
+class CategoryStatsBucket(db.Model):
+    """Number of a user's amounts in one category falling in one log-scale bucket"""
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    type=db.Column(db.Enum(TransactionType), nullable=False)
+    category=db.Column(db.String(50),nullable=False)
+    bucket=db.Column(db.Integer,nullable=False)
+    count=db.Column(db.Integer,nullable=False,default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'type', 'category', 'bucket', name='uq_category_stats_bucket'),
+    )
+    
+    def __repr__(self):
+        return f"CategoryStatsBucket({self.category},{self.bucket},{self.count})"
+
+
+class BalanceForecast(db.Model):
+    """Projected income, expenses and closing balance for one future month"""
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    month=db.Column(db.Date,nullable=False)  # first day of the month
+    income=db.Column(db.Numeric(14, 2),nullable=False,default=0)
+    expense=db.Column(db.Numeric(14, 2),nullable=False,default=0)
+    closing_balance=db.Column(db.Numeric(14, 2),nullable=False,default=0)
+    generated_at=db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', name='uq_balance_forecast_user_month'),
+    )
+    
+    def __repr__(self):
+        return f"BalanceForecast({self.month},{self.closing_balance})"
+
+
+class CategoryForecast(db.Model):
+    """Projected spending in one expense category for one future month"""
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    month=db.Column(db.Date,nullable=False)  # first day of the month
+    category=db.Column(db.String(50),nullable=False)
+    amount=db.Column(db.Numeric(14, 2),nullable=False,default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', 'category', name='uq_category_forecast'),
+    )
+    
+    def __repr__(self):
+        return f"CategoryForecast({self.month},{self.category},{self.amount})"
+
+
+class Budget(db.Model):
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    category=db.Column(db.String(50),nullable=False)  # an ExpenseCategory value
+    monthly_limit=db.Column(db.Numeric(10, 2),nullable=False)
+    created_at=db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'category', name='uq_budget_user_category'),
+    )
+    
+    def __repr__(self):
+        return f"Budget({self.category},{self.monthly_limit})"
+
+
+class SavedView(db.Model):
+    """
+    A named set of transaction list filters and a sort
+
+    cache_version is bumped by writes to rows the filters could match
+    (app/saved_views.py); the cached first page and summary are keyed by it.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    name=db.Column(db.String(50),nullable=False)
+    filters=db.Column(db.JSON,nullable=False)  # the non-empty list filters
+    sort_by=db.Column(db.String(20),nullable=False,default='date_desc')
+    cache_version=db.Column(db.Integer,nullable=False,default=0)
+    created_at=db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_saved_view_user_name'),
+    )
+
+    def __repr__(self):
+        return f"SavedView({self.name},{self.filters})"
+
+
+class RecurringRule(db.Model):
+    """
+    Template for a transaction that repeats on a fixed interval
+
+    next_due is the date of the next occurrence that has not been created
+    yet; the scheduler advances it in the same commit as the occurrences.
+    Monthly and yearly rules stay anchored to start_date's day, falling back
+    to the month's last day when it is shorter.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    type=db.Column(db.Enum(TransactionType), nullable=False)
+    amount = db.Column(db.Numeric(10, 2),nullable=False)
+    currency=db.Column(db.String(3))  # the owner's base currency when NULL
+    category=db.Column(db.String(50),nullable=False)
+    description=db.Column(db.Text)
+    interval=db.Column(db.Enum(RecurrenceInterval), nullable=False)
+    start_date=db.Column(db.Date,nullable=False)
+    end_date=db.Column(db.Date)
+    next_due=db.Column(db.Date,nullable=False)
+    active=db.Column(db.Boolean,nullable=False,default=True)
+    created_at=db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_recurring_rule_active_due', 'active', 'next_due'),
+    )
+    
+    def __repr__(self):
+        return f"RecurringRule({self.interval},{self.category},{self.amount})"
+
+
+class CategoryRule(db.Model):
+    """
+    Description keyword that implies a category, see app/categorize.py
+
+    Rules with user_id NULL are global and apply to everyone; a user's own
+    rules take precedence over them. Regex rules are only loaded as global
+    rules from the command line.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"))
+    pattern=db.Column(db.String(100),nullable=False)
+    is_regex=db.Column(db.Boolean,nullable=False,default=False)
+    type=db.Column(db.Enum(TransactionType), nullable=False)
+    category=db.Column(db.String(50),nullable=False)
+    created_at=db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_category_rule_user', 'user_id'),
+    )
+    
+    def __repr__(self):
+        return f"CategoryRule({self.pattern},{self.category})"
+
+
+class FxRate(db.Model):
+    """
+    Value of one unit of a currency in app.fx.QUOTE_CURRENCY on one day
+
+    Loaded from a file by ``flask fx load``, with a row for every day
+    (forward-filled between quotes) so conversions join on the exact date.
+    Ids are never reused: the in-process rate cache is keyed by count and
+    highest id.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    currency=db.Column(db.String(3),nullable=False)
+    date=db.Column(db.Date,nullable=False)
+    rate=db.Column(db.Numeric(18, 8),nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('currency', 'date', name='uq_fx_rate_currency_date'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    def __repr__(self):
+        return f"FxRate({self.currency},{self.date},{self.rate})"
+
+
+class ArchiveSegment(db.Model):
+    """
+    One Parquet file holding a user's archived transactions of one year
+
+    Written by ``flask archive run`` under the instance folder, see
+    app/archive.py; path is relative to the archive directory.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False)
+    year=db.Column(db.Integer,nullable=False)
+    path=db.Column(db.String(255),nullable=False)
+    row_count=db.Column(db.Integer,nullable=False,default=0)
+    first_date=db.Column(db.Date)
+    last_date=db.Column(db.Date)
+    # Highest change_seq in the file (None for files written before it was
+    # recorded), so delta syncs past it skip the file
+    max_change_seq=db.Column(db.Integer)
+    archived_at=db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'year', name='uq_archive_segment_user_year'),
+    )
+    
+    def __repr__(self):
+        return f"ArchiveSegment({self.user_id},{self.year},{self.row_count})"
+
+
+class UserShard(db.Model):
+    """
+    Directory entry: which shard database holds a user, see app/sharding.py
+
+    Always stored on the default database. Ids are handed out here, so a
+    user's id is the same on every shard, and usernames and emails stay
+    unique across shards. moving is set while ``flask shards move`` copies
+    the user; their writes are refused until it is done.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    username=db.Column(db.String(20),unique=True,nullable=False)
+    email=db.Column(db.String(120),unique=True,nullable=False)
+    shard=db.Column(db.Integer,nullable=False,default=0,index=True)
+    moving=db.Column(db.Boolean,nullable=False,default=False)
+    
+    __table_args__ = {'sqlite_autoincrement': True, 'info': {'directory': True}}
+    
+    def __repr__(self):
+        return f"UserShard({self.id},{self.shard})"
+
+
+class Household(db.Model):
+    """
+    A ledger shared by several users, see app/households
+
+    Stored on the default database next to UserShard, since members can
+    live on different shards. Every member keeps base_currency as their
+    base currency, so their rollups add up without conversion.
+    """
+    id=db.Column(db.Integer, primary_key=True)
+    name=db.Column(db.String(50),nullable=False)
+    base_currency=db.Column(db.String(3),nullable=False)
+    # Shared with people who should join
+    invite_code=db.Column(db.String(16),unique=True,nullable=False)
+    created_by=db.Column(db.Integer,db.ForeignKey("user_shard.id"))
+    created_at=db.Column(db.DateTime, default=datetime.utcnow)
+    members=db.relationship("HouseholdMember",backref="household",lazy=True,cascade="all, delete-orphan")
+    
+    __table_args__ = {'sqlite_autoincrement': True, 'info': {'directory': True}}
+    
+    def __repr__(self):
+        return f"Household({self.id},{self.name})"
+
+
+class HouseholdMember(db.Model):
+    """A user's membership of a household; a user belongs to at most one"""
+    user_id=db.Column(db.Integer,db.ForeignKey("user_shard.id"),primary_key=True)
+    household_id=db.Column(db.Integer,db.ForeignKey("household.id"),nullable=False,index=True)
+    joined_at=db.Column(db.DateTime, default=datetime.utcnow)
     
-    
\ No newline at end of file
+    __table_args__ = {'info': {'directory': True}}
+    
+    def __repr__(self):
+        return f"HouseholdMember({self.household_id},{self.user_id})"
@@ -0,0 +1,170 @@
+"""
+Password hashing off the request threads.
+
+bcrypt runs on a fixed pool of PASSWORD_HASH_WORKERS threads per process
+(bcrypt releases the GIL while hashing, so they hash in parallel up to the
+core count). At most PASSWORD_HASH_QUEUE_SIZE more requests wait for a
+thread; past that a request gets HashingBusy, answered with a 503 and
+Retry-After, so a login burst turns into quick refusals instead of every
+worker thread hashing at once. stats() counts queued and running jobs,
+waits, hash times and refusals; refusals are logged as one warning once
+the pool has room again.
+
+The cost: with PASSWORD_HASH_TARGET_MS set, a calibration job submitted at
+startup times a cheap hash and picks the highest cost between
+PASSWORD_HASH_MIN_ROUNDS and PASSWORD_HASH_MAX_ROUNDS whose hash is
+estimated to take at most the target (each round doubles the time). Until
+it finishes, and without a target, BCRYPT_LOG_ROUNDS is used. A successful
+login whose stored hash has another cost is rehashed with the current one.
+Hosts of different speed calibrate to different costs, so where they share
+users, pin the cost with BCRYPT_LOG_ROUNDS and no target.
+
+The pool's threads are started by create_app, so with gunicorn the app
+must be created in each worker (the default), not preloaded in the master.
+"""
+import math
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, render_template
+from app import bcrypt
+
+# Cost of the calibration probe; low enough to time in a few milliseconds
+PROBE_ROUNDS = 6
+
+
+class HashingBusy(Exception):
+    """Every hashing thread is busy and the queue is full"""
+
+
+def hash_cost(hashed):
+    """The cost (log rounds) a bcrypt hash was made with, or None if it is not one"""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Bounded bcrypt thread pool with a calibrated cost"""
+
+    def __init__(self, workers, queue_size, rounds, logger):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rounds = rounds
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.refused = 0
+        self.refused_unlogged = 0
+        self.wait_ms = 0.0
+        self.hash_ms = 0.0
+
+    def _run(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.refused += 1
+                self.refused_unlogged += 1
+            raise HashingBusy()
+        with self.lock:
+            refused, self.refused_unlogged = self.refused_unlogged, 0
+            self.submitted += 1
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        if refused:
+            self.logger.warning('%d password hashing requests refused, pool and queue full: %s', refused, self.stats())
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_ms += (started - submitted) * 1000
+            try:
+                return func(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.hash_ms += (time.perf_counter() - started) * 1000
+                self.slots.release()
+
+        return self.executor.submit(job).result()
+
+    def hash(self, password):
+        """bcrypt hash of a password at the current cost, as text"""
+        return self._run(bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def check(self, hashed, password):
+        return self._run(bcrypt.check_password_hash, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Whether a stored hash was made with another cost than the current one"""
+        return hash_cost(hashed) != self.rounds
+
+    def calibrate(self, target_ms, min_rounds, max_rounds, samples=3):
+        """
+        Set the cost to the highest whose hash takes at most target_ms
+
+        Times a few hashes at PROBE_ROUNDS and doubles the median per extra
+        round, which is how bcrypt's cost scales.
+
+        Returns:
+            Tuple (rounds, estimated ms per hash at that cost)
+        """
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            bcrypt.generate_password_hash('calibration', PROBE_ROUNDS)
+            timings.append((time.perf_counter() - started) * 1000)
+        probe_ms = statistics.median(timings)
+        rounds = PROBE_ROUNDS + math.floor(math.log2(target_ms / probe_ms))
+        self.rounds = min(max(rounds, min_rounds), max_rounds)
+        estimate = probe_ms * 2 ** (self.rounds - PROBE_ROUNDS)
+        self.logger.info('Password hash cost calibrated to %d rounds (about %.0f ms per hash, target %d ms)',
+                         self.rounds, estimate, target_ms)
+        return self.rounds, estimate
+
+    def stats(self):
+        with self.lock:
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queued': self.queued,
+                'running': self.running,
+                'max_queued': self.max_queued,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'refused': self.refused,
+                'avg_wait_ms': round(self.wait_ms / self.completed, 1) if self.completed else 0.0,
+                'avg_hash_ms': round(self.hash_ms / self.completed, 1) if self.completed else 0.0,
+            }
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def _busy(error):
+    return render_template('503.html'), 503, {'Retry-After': '5'}
+
+
+def init_app(app):
+    config = app.config
+    hasher = PasswordHasher(config['PASSWORD_HASH_WORKERS'], config['PASSWORD_HASH_QUEUE_SIZE'],
+                            config['BCRYPT_LOG_ROUNDS'], app.logger)
+    app.extensions['password_hasher'] = hasher
+    app.register_error_handler(HashingBusy, _busy)
+    if config['PASSWORD_HASH_TARGET_MS']:
+        # On a pool thread, so startup does not wait for it
+        hasher.executor.submit(hasher.calibrate, config['PASSWORD_HASH_TARGET_MS'],
+                               config['PASSWORD_HASH_MIN_ROUNDS'], config['PASSWORD_HASH_MAX_ROUNDS'])
@@ -0,0 +1,104 @@
+"""
+Read-only transaction rows for pages that only display transactions.
+
+Loading Transaction entities for a list builds a full ORM object per row,
+with its instance state and a place in the session's identity map, to be
+read once by a template. The list, the dashboard's recent transactions
+and the Excel export instead select only the columns they show into
+named tuples with the attributes the templates read. A page's tags come
+from one more query, and archived rows are built column-wise from the
+archive table. The tuples are immutable and small (no per-row __dict__),
+and they pickle, so cached pages (app/saved_views.py) hold them as they
+are.
+"""
+from collections import defaultdict, namedtuple
+from itertools import repeat
+from app import db
+from app.models import Tag, Transaction, TransactionTag, TransactionType
+
+TagRow = namedtuple('TagRow', ['name'])
+
+# What the transaction list and the dashboard show of a transaction
+TransactionRow = namedtuple('TransactionRow', [
+    'id', 'date', 'type', 'category', 'description', 'amount', 'currency', 'is_anomaly', 'archived', 'tags',
+])
+
+# What the dashboard's recent transactions show; rows are matched to live
+# updates (app/live.py) by change_seq and ordered by date and created_at
+RecentRow = namedtuple('RecentRow', [
+    'change_seq', 'date', 'created_at', 'type', 'category', 'description', 'amount', 'currency',
+])
+
+# What the Excel export writes: amount_base is the amount in the base currency
+ExportRow = namedtuple('ExportRow', ['date', 'type', 'category', 'description', 'currency', 'amount', 'amount_base'])
+
+# TransactionRow fields read from the transaction table
+ROW_COLUMNS = (Transaction.id, Transaction.date, Transaction.type, Transaction.category, Transaction.description,
+               Transaction.amount, Transaction.currency, Transaction.is_anomaly)
+
+RECENT_COLUMNS = (Transaction.change_seq, Transaction.date, Transaction.created_at, Transaction.type,
+                  Transaction.category, Transaction.description, Transaction.amount, Transaction.currency)
+
+# ExportRow fields read from the transaction table, before the converted amount
+EXPORT_COLUMNS = (Transaction.date, Transaction.type, Transaction.category, Transaction.description,
+                  Transaction.currency, Transaction.amount)
+
+
+def _tag_names(transaction_ids):
+    """Tag names of each of transaction_ids, by name, in one query"""
+    names = defaultdict(list)
+    if transaction_ids:
+        rows = db.session.query(TransactionTag.transaction_id, Tag.name)\
+            .join(Tag, Tag.id == TransactionTag.tag_id)\
+            .filter(TransactionTag.transaction_id.in_(transaction_ids))\
+            .order_by(Tag.name)
+        for transaction_id, name in rows:
+            names[transaction_id].append(TagRow(name))
+    return names
+
+
+def transaction_rows(query, tags=True):
+    """
+    TransactionRows for a Transaction query
+
+    Args:
+        query: Query of Transaction, with any filters, joins, ordering and
+               limits; only its selected columns are replaced
+        tags: Whether to load the rows' tags (otherwise empty, see
+              with_tags)
+
+    Returns:
+        List of TransactionRow
+    """
+    rows = [TransactionRow(*row, False, ()) for row in query.with_entities(*ROW_COLUMNS)]
+    return with_tags(rows) if tags else rows
+
+
+def recent_rows(query):
+    """RecentRows for a Transaction query"""
+    return [RecentRow(*row) for row in query.with_entities(*RECENT_COLUMNS)]
+
+
+def with_tags(rows):
+    """TransactionRows with the tags of the hot ones filled in, from one query"""
+    names = _tag_names([row.id for row in rows if not row.archived])
+    return [row._replace(tags=tuple(names[row.id])) if row.id in names and not row.archived else row
+            for row in rows]
+
+
+def archived_rows(table, row_type=TransactionRow):
+    """
+    row_type tuples for the rows of an archive table, archived and untagged
+
+    Each field is converted a column at a time rather than through a dict
+    per row.
+    """
+    def column(name):
+        if name == 'archived':
+            return repeat(True, table.num_rows)
+        if name == 'tags':
+            return repeat((), table.num_rows)
+        values = table.column(name).to_pylist()
+        return [TransactionType(value) for value in values] if name == 'type' else values
+
+    return list(map(row_type, *map(column, row_type._fields)))
@@ -0,0 +1,143 @@
+"""
+Saved transaction list views.
+
+A saved view is a named set of list filters and a sort. Its summary and
+first page are cached under the view's cache_version, so opening a view
+runs no transaction queries until a write could have changed what it
+shows. Rather than every write dropping every view, the flush hook tests
+each changed row, before and after the change, against a view's type,
+category, date and amount filters and bumps cache_version only for the
+views the row could be listed in. Search and tag filters are not tested:
+for views using them, any write to a row passing the other filters
+counts.
+
+Jobs that rewrite rows outside the write hooks (derived state rebuilds,
+anomaly rescoring, archiving) call invalidate_saved_views for the user.
+"""
+from datetime import datetime
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from app import cache, db
+from app.events import on_flush
+from app.models import SavedView
+from app.sharding import current_shard
+
+
+def view_filters(filters):
+    """The filters a view stores: the non-empty ones"""
+    return {key: value for key, value in filters.items() if value}
+
+
+def get_saved_views(user_id):
+    return SavedView.query.filter_by(user_id=user_id).order_by(SavedView.name).all()
+
+
+def matching_view(views, view_id, filters, sort_by):
+    """The view with view_id if the list is showing exactly its filters and sort, else None"""
+    for view in views:
+        if view.id == view_id:
+            return view if view.filters == view_filters(filters) and view.sort_by == sort_by else None
+    return None
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_amount(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def could_match(filters, state):
+    """
+    Whether a transaction in a given state could be listed under filters
+
+    Filters the list ignores when malformed (dates, amounts) are ignored
+    here too.
+
+    Args:
+        filters: A view's filters
+        state: app.events.TransactionState, amount in the base currency, or None
+
+    Returns:
+        False when the type, category, date or amount filters exclude the row
+    """
+    if state is None:
+        return False
+    if filters.get('type') and state.type.value != filters['type']:
+        return False
+    if filters.get('category') and state.category != filters['category']:
+        return False
+    date_from, date_to = _parse_date(filters.get('date_from')), _parse_date(filters.get('date_to'))
+    if (date_from or date_to) and state.date is None:
+        return False
+    if (date_from and state.date < date_from) or (date_to and state.date > date_to):
+        return False
+    min_amount, max_amount = _parse_amount(filters.get('min_amount')), _parse_amount(filters.get('max_amount'))
+    if min_amount is not None and float(state.amount) < min_amount:
+        return False
+    if max_amount is not None and float(state.amount) > max_amount:
+        return False
+    return True
+
+
+@on_flush
+def invalidate_matching_views(session, changes):
+    by_user = {}
+    for change in changes:
+        by_user.setdefault(change.user_id, []).append(change)
+    views = session.query(SavedView).filter(SavedView.user_id.in_(by_user))
+    for view in views:
+        if any(could_match(view.filters, change.old) or could_match(view.filters, change.new)
+               for change in by_user[view.user_id]):
+            view.cache_version = (view.cache_version or 0) + 1
+
+
+def invalidate_saved_views(user_id):
+    """Drop the cached results of all of a user's views"""
+    db.session.execute(
+        db.update(SavedView).where(SavedView.user_id == user_id)
+        .values(cache_version=SavedView.cache_version + 1)
+    )
+
+
+class CachedPagination(Pagination):
+    """A page of cached rows with its stored total"""
+
+    def _query_items(self):
+        return self._query_args['items']
+
+    def _query_count(self):
+        return self._query_args['total']
+
+
+def cached_view_results(view, compute):
+    """
+    A view's summary and first page, from the cache when it is current
+
+    The key holds the shard as well, because a shard move renumbers the
+    user's rows, and the row format, so entries pickled by an older
+    release are not read back.
+
+    Args:
+        view: The SavedView the list is showing
+        compute: Function returning (summary, first page) on a miss
+
+    Returns:
+        Tuple (summary, pagination)
+    """
+    key = f'saved_view_rows:{view.user_id}:{current_shard()}:{view.id}:{view.cache_version}'
+    cached = cache.get(key)
+    if cached is not None:
+        summary, items, total, per_page = cached
+        return summary, CachedPagination(page=1, per_page=per_page, error_out=False, items=items, total=total)
+    summary, page = compute()
+    # Items are app.read_models.TransactionRow, which pickle as they are
+    cache.set(key, (summary, page.items, page.total, page.per_page), timeout=current_app.config['SAVED_VIEW_CACHE_SECONDS'])
+    return summary, page
@@ -0,0 +1,422 @@
+"""
+Per-user database shards.
+
+Every shard is a complete database holding a set of users: their User row
+and every row that belongs to them, plus a copy of the shared tables
+(exchange rates and global category rules). Shard 0 is
+SQLALCHEMY_DATABASE_URI; shards 1..N-1 come from SHARD_DATABASE_URIS and are
+registered as the binds ``shard1``, ``shard2``, ... so each has its own
+engine and, with SQLite, its own writer lock.
+
+A directory on shard 0 (UserShard) maps each user id to a shard. It hands
+out user ids, so ids never collide between shards, and keeps usernames and
+emails unique. db.session (app.ShardedSession) sends every statement except
+directory lookups to the shard selected for the session:
+
+    use_shard(n)             pick a shard explicitly
+    use_user_shard(user_id)  pick the shard holding a user
+    each_shard()             run a batch job once per shard
+    shard_session(n)         read from a shard without rerouting db.session
+
+Signed-in requests pick the user's shard in the login manager's user
+loader, so the queries in the blueprints, which are always scoped to the
+current user, need no changes. A session must stay on one shard once it
+has loaded per-user rows: ids of rows other than users are only unique
+within a shard.
+
+New users go to the shard with the fewest users. ``flask shards move`` and
+``flask shards rebalance`` move users between shards; see move_user.
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import event, exists, func, literal, select
+from sqlalchemy.orm import Session
+from app import db, login_manager
+from app.models import CategoryRule, FxRate, Transaction, TransactionTombstone, User, UserShard
+
+SHARD_KEY = 'shard'
+_READ_ONLY_KEY = 'shard_read_only'
+
+
+class UserMoving(Exception):
+    """A write for a user whose rows are being moved to another shard"""
+
+
+def bind_key(shard):
+    """Flask-SQLAlchemy bind of a shard (None for shard 0, the default database)"""
+    return f'shard{shard}' if shard else None
+
+
+def shard_count():
+    return 1 + len(current_app.config['SHARD_DATABASE_URIS'])
+
+
+def shard_engine(shard):
+    return db.engines[bind_key(shard)]
+
+
+def use_shard(shard):
+    """Route db.session's per-user tables to shard"""
+    db.session.info[SHARD_KEY] = shard
+
+
+def current_shard():
+    return db.session.info.get(SHARD_KEY) or 0
+
+
+def use_user_shard(user_id):
+    """
+    Route db.session to the shard holding a user
+
+    Users without a directory entry were created before sharding and live
+    on shard 0.
+
+    Returns:
+        The user's UserShard entry, or None
+    """
+    entry = db.session.get(UserShard, user_id)
+    use_shard(entry.shard if entry is not None else 0)
+    return entry
+
+
+def each_shard():
+    """Yield every shard number with a fresh db.session routed to it"""
+    for shard in range(shard_count()):
+        db.session.remove()
+        use_shard(shard)
+        yield shard
+    db.session.remove()
+
+
+@contextmanager
+def shard_session(shard):
+    """
+    A session on a shard, for reads that span users on several shards
+
+    db.session when it is already routed there, otherwise a short-lived
+    session of its own, so rows of another shard never enter db.session's
+    identity map.
+    """
+    if shard == current_shard():
+        yield db.session
+        return
+    session = Session(shard_engine(shard))
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def group_by_shard(user_ids):
+    """
+    Returns:
+        Dict shard -> list of the given user ids it holds
+    """
+    placement = dict(db.session.query(UserShard.id, UserShard.shard).filter(UserShard.id.in_(user_ids)))
+    shards = defaultdict(list)
+    for user_id in user_ids:
+        shards[placement.get(user_id, 0)].append(user_id)
+    return dict(shards)
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    entry = use_user_shard(user_id)
+    if entry is not None and entry.moving:
+        db.session.info[_READ_ONLY_KEY] = True
+    return db.session.get(User, user_id)
+
+
+def find_user(**criteria):
+    """
+    Find a user by username= or email= on whichever shard holds them
+
+    Returns:
+        The User, with db.session routed to their shard, or None
+    """
+    entry = UserShard.query.filter_by(**criteria).first()
+    if entry is None:
+        return None
+    return load_user(entry.id)
+
+
+def identity_taken(**criteria):
+    """True when a username= or email= is already registered on any shard"""
+    return db.session.query(UserShard.id).filter_by(**criteria).first() is not None
+
+
+def _least_loaded_shard(session):
+    count = shard_count()
+    if count == 1:
+        return 0
+    users = dict(session.execute(select(UserShard.shard, func.count()).group_by(UserShard.shard)).all())
+    return min(range(count), key=lambda shard: (users.get(shard, 0), shard))
+
+
+def _before_flush(session, flush_context, instances):
+    if session.info.get(_READ_ONLY_KEY) and (session.new or session.dirty or session.deleted):
+        raise UserMoving()
+
+    new_users = [obj for obj in session.new if isinstance(obj, User)]
+    if new_users:
+        # The directory assigns the id, then the row goes to the chosen shard
+        if SHARD_KEY not in session.info:
+            session.info[SHARD_KEY] = _least_loaded_shard(session)
+        for user in new_users:
+            values = {'username': user.username, 'email': user.email, 'shard': session.info[SHARD_KEY]}
+            if user.id is not None:
+                values['id'] = user.id
+            user.id = session.execute(db.insert(UserShard).values(**values)).inserted_primary_key[0]
+
+    for obj in session.dirty:
+        if isinstance(obj, User) and any(db.inspect(obj).attrs[name].history.has_changes()
+                                         for name in ('username', 'email')):
+            session.execute(db.update(UserShard).where(UserShard.id == obj.id)
+                            .values(username=obj.username, email=obj.email))
+
+
+def _shard_tables():
+    """Tables every shard holds (all but the directory)"""
+    return [table for table in db.metadata.sorted_tables if not table.info.get('directory')]
+
+
+def _user_tables():
+    """Tables of rows owned by one user, parents before children (short-lived ones left out)"""
+    return [table for table in _shard_tables() if 'user_id' in table.c and not table.info.get('transient')]
+
+
+def create_all():
+    """
+    Create the tables on every shard, and directory entries for users that
+    were created before the directory existed (all on shard 0)
+
+    For tests and benchmarks on empty databases; deployed databases are
+    created and upgraded by the migrations (``flask db upgrade``).
+    """
+    db.create_all()
+    for shard in range(1, shard_count()):
+        db.metadata.create_all(shard_engine(shard), tables=_shard_tables())
+
+    use_shard(0)
+    db.session.execute(
+        db.insert(UserShard).from_select(
+            ['id', 'username', 'email', 'shard'],
+            select(User.id, User.username, User.email, literal(0))
+            .where(~exists().where(UserShard.id == User.id))
+        )
+    )
+    db.session.commit()
+
+
+def copy_shared_tables(shard):
+    """
+    Replace a shard's exchange rates and global category rules with shard 0's
+
+    Rates keep their ids, so the per-process rate cache (keyed by count and
+    highest id) sees the same table on every shard.
+
+    Returns:
+        Tuple (rates copied, global rules copied)
+    """
+    rates = FxRate.__table__
+    rules = CategoryRule.__table__
+    with shard_engine(0).connect() as source:
+        rate_rows = [dict(row) for row in source.execute(select(rates)).mappings()]
+        rule_rows = [dict(row) for row in source.execute(
+            select(rules).where(rules.c.user_id.is_(None)).order_by(rules.c.id)).mappings()]
+    for row in rule_rows:
+        del row['id']
+
+    with shard_engine(shard).begin() as target:
+        target.execute(rates.delete())
+        target.execute(rules.delete().where(rules.c.user_id.is_(None)))
+        if rate_rows:
+            target.execute(rates.insert(), rate_rows)
+        if rule_rows:
+            target.execute(rules.insert(), rule_rows)
+    return len(rate_rows), len(rule_rows)
+
+
+def shard_loads():
+    """
+    Users and transactions on each shard, per the directory
+
+    Returns:
+        Dict shard -> {user_id: transaction count}
+    """
+    placement = dict(db.session.query(UserShard.id, UserShard.shard))
+    loads = {}
+    for shard in each_shard():
+        counts = db.session.query(User.id, func.count(Transaction.id))\
+            .outerjoin(Transaction, Transaction.user_id == User.id)\
+            .group_by(User.id)
+        loads[shard] = {uid: count for uid, count in counts if placement.get(uid, 0) == shard}
+    return loads
+
+
+def _copy_user(source, target, user_id, batch_size):
+    """
+    Copy a user's rows between two shard connections
+
+    Surrogate ids are only unique within a shard, so every row except the
+    user's gets a new id on the target, with references between the copied
+    rows remapped. Each old transaction id is left a tombstone and every
+    copied transaction a new change_seq above the user's data_version, so
+    sync clients (app/api) see the move as deletions followed by inserts.
+
+    Returns:
+        Tuple (rows copied, the user's data_version on the source)
+    """
+    users, transactions = User.__table__, Transaction.__table__
+    user = dict(source.execute(select(users).where(users.c.id == user_id)).mappings().one())
+    version = user['data_version']
+    moved = source.execute(select(func.count()).select_from(transactions)
+                           .where(transactions.c.user_id == user_id)).scalar()
+    user['data_version'] = version + 2 * moved
+    target.execute(users.insert(), [user])
+
+    tables = _user_tables()
+    referenced = {fk.column.table.name for table in tables for fk in table.foreign_keys}
+    new_ids, copied, seq = {}, 1, version
+    for table in tables:
+        remap = [(fk.parent.name, new_ids[fk.column.table.name]) for fk in table.foreign_keys
+                 if fk.column.table.name in new_ids]
+        rows = source.execute(select(table).where(table.c.user_id == user_id).order_by(*table.primary_key)
+                              .execution_options(yield_per=batch_size))
+        for batch in rows.mappings().partitions():
+            batch = [dict(row) for row in batch]
+            # Link tables are keyed by their references alone
+            old_ids = [row.pop('id') for row in batch] if 'id' in table.c else None
+            for row in batch:
+                for column, mapping in remap:
+                    if row[column] is not None:
+                        row[column] = mapping[row[column]]
+            if table is transactions:
+                target.execute(TransactionTombstone.__table__.insert(), [
+                    {'user_id': user_id, 'transaction_id': old_id, 'change_seq': seq + i}
+                    for i, old_id in enumerate(old_ids, start=1)
+                ])
+                for i, row in enumerate(batch, start=1):
+                    row['change_seq'] = seq + moved + i
+                seq += len(batch)
+            if table.name in referenced:
+                inserted = target.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), batch)
+                new_ids.setdefault(table.name, {}).update(zip(old_ids, inserted.scalars()))
+            else:
+                target.execute(table.insert(), batch)
+            copied += len(batch)
+    return copied, version
+
+
+def move_user(user_id, target, grace=None, batch_size=10000):
+    """
+    Move a user and all their rows to another shard
+
+    The directory entry is marked as moving first, which makes requests
+    that would write for the user fail with a 503, then the rows are copied
+    in one transaction on the target, the directory is pointed at it and the
+    source rows are deleted. If the user's data_version on the source
+    changed during the copy (a write that was already running), the copy is
+    rolled back and the user stays where they were. Archive files are keyed
+    by user id and do not move.
+
+    Args:
+        user_id: User to move
+        target: Shard number to move them to
+        grace: Seconds to wait for requests already past the check
+               (default SHARD_MOVE_GRACE_SECONDS)
+        batch_size: Rows read and inserted at a time
+
+    Returns:
+        Rows copied (0 when the user is already on target)
+    """
+    if not 0 <= target < shard_count():
+        raise ValueError(f"no shard {target}")
+    entry = db.session.get(UserShard, user_id)
+    if entry is None:
+        raise ValueError(f"no user with id {user_id} in the shard directory")
+    source = entry.shard
+    if source == target:
+        return 0
+    entry.moving = True
+    db.session.commit()
+    time.sleep(current_app.config['SHARD_MOVE_GRACE_SECONDS'] if grace is None else grace)
+
+    try:
+        with shard_engine(source).connect() as reader, shard_engine(target).begin() as writer:
+            copied, version = _copy_user(reader, writer, user_id, batch_size)
+            users = User.__table__
+            now = reader.execute(select(users.c.data_version).where(users.c.id == user_id)).scalar()
+            if now != version:
+                raise RuntimeError(f"user {user_id} changed during the copy; not moved")
+    except Exception:
+        db.session.execute(db.update(UserShard).where(UserShard.id == user_id).values(moving=False))
+        db.session.commit()
+        raise
+
+    db.session.execute(db.update(UserShard).where(UserShard.id == user_id).values(shard=target, moving=False))
+    db.session.commit()
+    with shard_engine(source).begin() as writer:
+        for table in reversed(_user_tables()):
+            writer.execute(table.delete().where(table.c.user_id == user_id))
+        writer.execute(User.__table__.delete().where(User.__table__.c.id == user_id))
+    return copied
+
+
+def plan_rebalance(loads, tolerance=0.1, max_moves=None):
+    """
+    Moves that even out transaction counts across shards
+
+    Greedy: repeatedly move, from the busiest shard to the least busy one,
+    the user whose row count comes closest to half the gap between them,
+    until the gap is within tolerance of the mean load. Every user also
+    counts as one row, so empty accounts spread out too.
+
+    Args:
+        loads: shard_loads() result
+        tolerance: Acceptable gap as a fraction of the mean shard load
+        max_moves: Stop after this many moves
+
+    Returns:
+        List of (user_id, from shard, to shard)
+    """
+    weights = {shard: {uid: count + 1 for uid, count in users.items()} for shard, users in loads.items()}
+    totals = {shard: sum(users.values()) for shard, users in weights.items()}
+    if len(totals) < 2:
+        return []
+    slack = tolerance * sum(totals.values()) / len(totals)
+
+    moves = []
+    while max_moves is None or len(moves) < max_moves:
+        busiest = max(totals, key=lambda shard: (totals[shard], -shard))
+        idlest = min(totals, key=lambda shard: (totals[shard], shard))
+        gap = totals[busiest] - totals[idlest]
+        candidates = [(abs(gap / 2 - weight), uid) for uid, weight in weights[busiest].items() if weight < gap]
+        if gap <= slack or not candidates:
+            break
+        _, uid = min(candidates)
+        weight = weights[idlest][uid] = weights[busiest].pop(uid)
+        totals[busiest] -= weight
+        totals[idlest] += weight
+        moves.append((uid, busiest, idlest))
+    return moves
+
+
+def init_app(app):
+    """Register the shard binds; call before db.init_app"""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for shard, uri in enumerate(app.config['SHARD_DATABASE_URIS'], start=1):
+        binds[bind_key(shard)] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+
+    @app.errorhandler(UserMoving)
+    def user_moving(error):
+        db.session.rollback()
+        return 'Your account is being moved to another database. Please try again in a minute.', 503, \
+            {'Retry-After': '30'}
@@ -1,32 +1,54 @@
 from datetime import datetime
-from flask import Blueprint,render_template,flash,redirect,url_for,request,jsonify,abort
+from urllib.parse import parse_qsl
+from flask import Blueprint,render_template,flash,redirect,url_for,request,jsonify,abort,current_app
 from flask_login import current_user,login_required
-from sqlalchemy import func
-from app import db
-from app.forms import TransactionForm
-from app.models import Transaction,TransactionType,IncomeCategory,ExpenseCategory
-from app.transactions.utilities import export_transactions_excel,apply_transaction_filters,get_filter_summary
+from app import db,limiter
+from app.archive import archived_transactions
+from app.etags import etag_cached
+from app.events import insert_transactions
+from app.fx import base_amount, currency_choices, join_rates
+from app.categorize import get_categorizer
+from app.forms import TransactionForm,RecurringRuleForm,CategoryRuleForm,SavedViewForm
+from app.models import Transaction,TransactionType,IncomeCategory,ExpenseCategory,RecurringRule,CategoryRule,SavedView
+from app.read_models import EXPORT_COLUMNS,ExportRow,archived_rows
+from app.saved_views import cached_view_results,get_saved_views,matching_view,view_filters
+from app.transactions.utilities import (export_transactions_excel,export_transactions_columnar,EXPORT_FORMATS,
+                                       get_filter_summary,get_transaction_filters,get_filter_facets,
+                                       build_transaction_query,paginate_transactions,category_choices,
+                                       TRANSACTION_SORTS,
+                                       materialize_rule,parse_tags,set_tags)
 
 transactions=Blueprint('transactions',__name__)
 
+TRANSACTIONS_PER_PAGE = 5
+
+# Regions of transactions.html that can be re-rendered on their own
+TRANSACTION_FRAGMENTS = {
+    'filters': '_active_filters.html',
+    'summary': '_transaction_summary.html',
+    'table': '_transaction_table.html',
+    'pager': '_transaction_pager.html',
+    'facets': '_transaction_facets.html',
+}
+
 @transactions.route('/transaction/add',methods=['GET','POST'])
 @login_required
 def add_transaction():
     form=TransactionForm()
-    selected_type = form.type.data or TransactionType.EXPENSE.value
-
-    if selected_type == TransactionType.INCOME.value:
-        form.category.choices = [(c.value, c.name.replace('_',' ').title()) for c in IncomeCategory]
-    else:
-        form.category.choices = [(c.value, c.name.replace('_',' ').title()) for c in ExpenseCategory]
+    form.category.choices = category_choices(form.type.data)
+    form.currency.choices = currency_choices()
+    if not form.currency.data:
+        form.currency.data = current_user.base_currency
     if form.validate_on_submit():
         transaction=Transaction(type=TransactionType(form.type.data),
                                 category=form.category.data,
                                 amount=form.amount.data,
+                                currency=form.currency.data,
                                 user_id=current_user.id,
                                 date=form.date.data,
                                 description=form.description.data)
         db.session.add(transaction)
+        set_tags(transaction,parse_tags(form.tags.data))
         db.session.commit()
         flash('Transaction added successfully','success')
         return redirect(url_for('main.home'))
@@ -51,58 +73,133 @@ def get_categories():
     return jsonify(categories)
 
 
+@transactions.route('/transaction/suggest_category')
+@login_required
+@limiter.exempt
+def suggest_category():
+    """Category suggested by the auto-categorization rules for a description"""
+    tx_type = request.args.get('type') or None
+    if tx_type not in (None, *(t.value for t in TransactionType)):
+        tx_type = None
+    match = get_categorizer(current_user.id, current_user.settings_version)\
+        .suggest(request.args.get('description', ''), tx_type)
+    if match is None:
+        return jsonify({})
+    return jsonify({'type': match[0].value, 'category': match[1]})
+
+
+def _first_page(filters, sort_by):
+    """Summary and first page of the list, as cached for saved views"""
+    query = build_transaction_query(current_user.id, filters)
+    return (get_filter_summary(query, filters, current_user.id),
+            paginate_transactions(query, current_user.id, filters, sort_by, 1, TRANSACTIONS_PER_PAGE))
+
 @transactions.route('/view_transactions')
 @login_required
+@etag_cached
 def view_transactions():
     
-    filters = {
-        'search': request.args.get('search', '').strip(),
-        'type': request.args.get('type', ''),
-        'category': request.args.get('category', ''),
-        'date_from': request.args.get('date_from', ''),
-        'date_to': request.args.get('date_to', ''),
-        'min_amount': request.args.get('min_amount', ''),
-        'max_amount': request.args.get('max_amount', ''),
-    }
-    
+    filters = get_transaction_filters(request.args)
     sort_by = request.args.get('sort', 'date_desc')
-    page = request.args.get('page', 1, type=int)
-    
-    if page < 1:
-        page = 1
-    transactions=Transaction.query.filter(Transaction.user_id==current_user.id)
-    transactions=apply_transaction_filters(transactions,filters)
-    
-    if sort_by == 'date_desc':
-        transactions = transactions.order_by(Transaction.date.desc(), Transaction.created_at.desc())
-    elif sort_by == 'date_asc':
-        transactions = transactions.order_by(Transaction.date.asc(), Transaction.created_at.asc())
-    elif sort_by == 'amount_desc':
-        transactions = transactions.order_by(Transaction.amount.desc())
-    elif sort_by == 'amount_asc':
-        transactions = transactions.order_by(Transaction.amount.asc())
-    elif sort_by == 'category':
-        transactions = transactions.order_by(Transaction.category.asc())
-    
-    all_filtered = transactions.all()  # Get all for summary (without pagination)
-    transactions = transactions.paginate(page=page, per_page=5 , error_out=False)
-    
-    summary = get_filter_summary(all_filtered, filters)
-    
-    categories = db.session.query(Transaction.category)\
-                          .filter_by(user_id=current_user.id)\
-                          .distinct()\
-                          .order_by(Transaction.category)\
-                          .all()
-    categories = [c[0] for c in categories]
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    saved_views = get_saved_views(current_user.id)
+    active_view = matching_view(saved_views, request.args.get('view', type=int), filters, sort_by)
+    
+    if active_view is not None and page == 1:
+        summary, transactions = cached_view_results(active_view, lambda: _first_page(filters, sort_by))
+    else:
+        query = build_transaction_query(current_user.id, filters)
+        transactions = paginate_transactions(query, current_user.id, filters, sort_by, page, TRANSACTIONS_PER_PAGE)
+        summary = get_filter_summary(query, filters, current_user.id)
+    
+    facets = get_filter_facets(current_user.id, current_user.data_version, filters)
+    # The category select lists the categories the other filters leave
+    categories = sorted({facet['value'] for facet in facets['category']} | ({filters['category']} - {''}))
         
     return render_template('transactions.html',
                            transactions=transactions,
                            filters=filters,
+                           facets=facets,
                            categories=categories,
                            sort_by=sort_by,
-                           summary=summary)
+                           summary=summary,
+                           saved_views=saved_views,
+                           active_view=active_view,
+                           view_form=SavedViewForm(query=request.query_string.decode()))
+
+@transactions.route('/view_transactions/fragment/<part>')
+@login_required
+@limiter.exempt
+@etag_cached
+def transactions_fragment(part):
+    """Render one region of the transaction list; each part runs only the queries it needs"""
+    template = TRANSACTION_FRAGMENTS.get(part)
+    if template is None:
+        abort(404)
+    
+    filters = get_transaction_filters(request.args)
+    sort_by = request.args.get('sort', 'date_desc')
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    context = {'filters': filters, 'sort_by': sort_by}
+    if part == 'facets':
+        context['facets'] = get_filter_facets(current_user.id, current_user.data_version, filters)
+        return render_template(template, **context)
+    if part != 'filters' and page == 1:
+        view = matching_view(get_saved_views(current_user.id), request.args.get('view', type=int), filters, sort_by)
+        if view is not None:
+            context['summary'], context['transactions'] = cached_view_results(view, lambda: _first_page(filters, sort_by))
+            return render_template(template, **context)
+    
+    query = build_transaction_query(current_user.id, filters)
+    if part in ('table', 'pager'):
+        # The table never shows the total, so skip the COUNT query for it
+        context['transactions'] = paginate_transactions(query, current_user.id, filters, sort_by, page,
+                                                        TRANSACTIONS_PER_PAGE, count=(part == 'pager'))
+    if part in ('table', 'summary'):
+        context['summary'] = get_filter_summary(query, filters, current_user.id)
+    
+    return render_template(template, **context)
     
+@transactions.route('/saved_views',methods=['POST'])
+@login_required
+def save_view():
+    form=SavedViewForm()
+    args=dict(parse_qsl((form.query.data or '').lstrip('?')))
+    filters=view_filters(get_transaction_filters(args))
+    sort_by=args.get('sort') if args.get('sort') in TRANSACTION_SORTS else 'date_desc'
+    if not form.validate_on_submit():
+        for error in form.name.errors:
+            flash(error,'danger')
+        return redirect(url_for('transactions.view_transactions',sort=sort_by,**filters))
+    name=form.name.data.strip()
+    view=SavedView.query.filter_by(user_id=current_user.id,name=name).first()
+    if view is None:
+        view=SavedView(user_id=current_user.id,name=name,cache_version=0)
+        db.session.add(view)
+    else:
+        # New filters, so the cached results no longer apply
+        view.cache_version+=1
+    view.filters=filters
+    view.sort_by=sort_by
+    current_user.touch_settings()
+    db.session.commit()
+    flash(f'Saved view "{name}"','success')
+    return redirect(url_for('transactions.view_transactions',view=view.id,sort=sort_by,**filters))
+
+@transactions.route('/saved_views/<int:view_id>/delete',methods=['POST'])
+@login_required
+def delete_saved_view(view_id):
+    view=SavedView.query.get_or_404(view_id)
+    if view.user_id != current_user.id:
+        abort(403)
+    db.session.delete(view)
+    current_user.touch_settings()
+    db.session.commit()
+    flash(f'Deleted view "{view.name}"','danger')
+    return redirect(url_for('transactions.view_transactions'))
+
 @transactions.route('/update_transaction/<int:trans_id>',methods=['GET','POST'])
 @login_required
 def update_transaction(trans_id):
@@ -110,18 +207,18 @@ def update_transaction(trans_id):
     if transaction.user_id != current_user.id:
         abort(403)
     form=TransactionForm()
-    selected_type = form.type.data or TransactionType.EXPENSE.value
-
-    if selected_type == TransactionType.INCOME.value:
-        form.category.choices = [(c.value, c.name.replace('_',' ').title()) for c in IncomeCategory]
-    else:
-        form.category.choices = [(c.value, c.name.replace('_',' ').title()) for c in ExpenseCategory]
+    form.category.choices = category_choices(form.type.data)
+    form.currency.choices = currency_choices()
+    if not form.currency.data:
+        form.currency.data = transaction.currency
     if form.validate_on_submit():
         transaction.type=form.type.data
         transaction.category=form.category.data
         transaction.amount=form.amount.data
+        transaction.currency=form.currency.data
         transaction.description=form.description.data
         transaction.date=form.date.data
+        set_tags(transaction,parse_tags(form.tags.data))
         db.session.commit()
         flash('Transaction updated successfully','success')
         return redirect(url_for('transactions.view_transactions'))
@@ -129,11 +226,14 @@ def update_transaction(trans_id):
         form.type.data=transaction.type
         form.category.data=transaction.category
         form.amount.data=transaction.amount
+        form.currency.data=transaction.currency
         form.description.data=transaction.description
         form.date.data=transaction.date
+        form.tags.data=', '.join(tag.name for tag in transaction.tags)
     return render_template('add_update_transaction.html',form=form,purpose='Update')
 
 @transactions.route('/delete_transaction/<int:trans_id>',methods=['POST'])
+@login_required
 def delete_transaction(trans_id):
     transaction=Transaction.query.get_or_404(trans_id)
     if transaction.user_id != current_user.id:
@@ -151,15 +251,23 @@ def export_transactions():
     category = request.args.get('category', '')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
+    export_format = request.args.get('format', 'xlsx')
+    if export_format != 'xlsx' and export_format not in EXPORT_FORMATS:
+        flash('Unknown export format', 'danger')
+        return redirect(url_for('transactions.view_transactions'))
     
-    query = Transaction.query.filter_by(user_id=current_user.id)
+    # Only the exported columns, amounts converted to the base currency in the same query
+    base = current_user.base_currency
+    query = join_rates(db.session.query(*EXPORT_COLUMNS, base_amount(base).label('amount_base'))
+                       .select_from(Transaction), base)\
+        .filter(Transaction.user_id == current_user.id)
     
     # Apply filters
     if transaction_type:
-        query = query.filter_by(type=transaction_type)
+        query = query.filter(Transaction.type == transaction_type)
     
     if category:
-        query = query.filter_by(category=category)
+        query = query.filter(Transaction.category == category)
     
     if date_from:
         try:
@@ -176,8 +284,24 @@ def export_transactions():
             flash('Invalid date format', 'danger')
             return redirect(url_for('transactions.view_transactions'))
     
+    # Archived years follow, read only when the date range reaches them
+    archived = archived_transactions(current_user.id, {'type': transaction_type, 'category': category,
+                                                       'date_from': date_from, 'date_to': date_to})
+    if archived is not None and not archived.num_rows:
+        archived = None
+    
+    if export_format in EXPORT_FORMATS:
+        # Streamed in batches; never loads every row
+        if archived is None and query.first() is None:
+            flash('No transactions to export!', 'warning')
+            return redirect(url_for('transactions.view_transactions'))
+        return export_transactions_columnar(query, archived, current_user.username, base, export_format)
+    
     # Order by date descending
     transactions = query.order_by(Transaction.date.desc()).all()
+    if archived is not None:
+        archived = archived.sort_by([('date', 'descending'), ('id', 'descending')])
+        transactions += archived_rows(archived, ExportRow)
     
     # Check if any transactions exist
     if not transactions:
@@ -185,4 +309,78 @@ def export_transactions():
         return redirect(url_for('transactions.view_transactions'))
     
     # Export based on format
-    return export_transactions_excel(transactions, current_user.username)
\ No newline at end of file
+    return export_transactions_excel(transactions, current_user.username, base)
+
+@transactions.route('/recurring',methods=['GET','POST'])
+@login_required
+def recurring_rules():
+    form=RecurringRuleForm()
+    form.category.choices = category_choices(form.type.data)
+    form.currency.choices = currency_choices()
+    if not form.currency.data:
+        form.currency.data = current_user.base_currency
+    if form.validate_on_submit():
+        rule=RecurringRule(user_id=current_user.id,
+                           type=TransactionType(form.type.data),
+                           category=form.category.data,
+                           amount=form.amount.data,
+                           currency=form.currency.data,
+                           description=form.description.data,
+                           interval=form.interval.data,
+                           start_date=form.start_date.data,
+                           end_date=form.end_date.data,
+                           next_due=form.start_date.data)
+        db.session.add(rule)
+        db.session.flush()
+        # Record occurrences up to today now; the scheduler takes it from here
+        occurrences=materialize_rule(rule,datetime.now().date(),current_app.config['RECURRING_MAX_CATCHUP'])
+        insert_transactions(db.session,occurrences)
+        db.session.commit()
+        flash(f'Recurring transaction saved, {len(occurrences)} occurrence(s) added so far','success')
+        return redirect(url_for('transactions.recurring_rules'))
+    rules=RecurringRule.query.filter_by(user_id=current_user.id)\
+        .order_by(RecurringRule.active.desc(),RecurringRule.next_due)\
+        .all()
+    return render_template('recurring.html',form=form,rules=rules)
+
+@transactions.route('/recurring/<int:rule_id>/stop',methods=['POST'])
+@login_required
+def stop_recurring_rule(rule_id):
+    rule=RecurringRule.query.get_or_404(rule_id)
+    if rule.user_id != current_user.id:
+        abort(403)
+    # Occurrences already created stay; no new ones are added
+    rule.active=False
+    db.session.commit()
+    flash('Recurring transaction stopped','danger')
+    return redirect(url_for('transactions.recurring_rules'))
+
+@transactions.route('/category_rules',methods=['GET','POST'])
+@login_required
+def category_rules():
+    form=CategoryRuleForm()
+    form.category.choices = category_choices(form.type.data)
+    if form.validate_on_submit():
+        rule=CategoryRule(user_id=current_user.id,
+                          pattern=form.pattern.data.strip(),
+                          type=TransactionType(form.type.data),
+                          category=form.category.data)
+        db.session.add(rule)
+        current_user.touch_settings()
+        db.session.commit()
+        flash('Rule added successfully','success')
+        return redirect(url_for('transactions.category_rules'))
+    rules=CategoryRule.query.filter_by(user_id=current_user.id).order_by(CategoryRule.pattern).all()
+    return render_template('category_rules.html',form=form,rules=rules)
+
+@transactions.route('/category_rules/<int:rule_id>/delete',methods=['POST'])
+@login_required
+def delete_category_rule(rule_id):
+    rule=CategoryRule.query.get_or_404(rule_id)
+    if rule.user_id != current_user.id:
+        abort(403)
+    db.session.delete(rule)
+    current_user.touch_settings()
+    db.session.commit()
+    flash('Rule removed','danger')
+    return redirect(url_for('transactions.category_rules'))
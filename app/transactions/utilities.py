@@ -1,51 +1,76 @@
+import calendar
+import heapq
+import tempfile
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
 from io import BytesIO
-from flask import make_response
-from datetime import datetime
-import pandas as pd
-from app.models import Transaction
-from sqlalchemy import func
+from itertools import islice
+from operator import attrgetter
+from flask import current_app, make_response, send_file
+from flask_sqlalchemy.pagination import Pagination
+from datetime import date, datetime, timedelta
+from app import cache, db
+from app.archive import archived_facet_counts, archived_transactions, totals_by_type
+from app.categorize import get_categorizer, valid_category
+from app.events import insert_transactions
+from app.fx import base_amount, base_currency, get_rates, join_rates
+from app.models import (Transaction, TransactionType, IncomeCategory, ExpenseCategory,
+                        RecurrenceInterval, RecurringRule, Tag, TransactionTag, User)
+from app.read_models import archived_rows, transaction_rows, with_tags
+from sqlalchemy import String, func, literal, union_all
+from sqlalchemy.exc import IntegrityError
 
-def export_transactions_excel(transactions, username):
+def export_transactions_excel(rows, username, base):
     """
     Export transactions to Excel with multiple sheets including summary and category breakdown
     
     Args:
-        transactions: List of Transaction objects
+        rows: List of app.read_models.ExportRow (or rows with the same
+              columns), amount_base selected with app.fx.base_amount
         username: Current user's username
+        base: Currency the totals are in
     
     Returns:
         Flask response object with Excel file
     """
+    # pandas (and numpy) add a few hundred ms to every worker boot, so they
+    # are only imported once an export is actually requested.
+    import pandas as pd
+
     # Prepare data for DataFrame
     data = []
     total_income = 0
     total_expense = 0
     
-    for transaction in transactions:
+    for transaction in rows:
         date_str = transaction.date.strftime('%Y-%m-%d') if transaction.date else 'N/A'
+        converted = float(transaction.amount_base or 0)
         
         if transaction.type == 'income':
             amount = float(transaction.amount)
-            total_income += amount
+            total_income += converted
         else:
             amount = -float(transaction.amount)
-            total_expense += abs(amount)
+            converted = -converted
+            total_expense += abs(converted)
         
         data.append({
             'Date': date_str,
             'Description': transaction.description,
             'Category': transaction.category.title() if transaction.category else 'N/A',
             'Type': transaction.type.capitalize(),
-            'Amount': amount
+            'Currency': transaction.currency,
+            'Amount': amount,
+            f'Amount ({base})': converted
         })
     
     df = pd.DataFrame(data)
     
     # Calculate category breakdown
     category_breakdown = {}
-    for transaction in transactions:
+    for transaction in rows:
         cat = transaction.category.title() if transaction.category else 'N/A'
-        amount = float(transaction.amount)
+        amount = float(transaction.amount_base or 0)
         
         if cat not in category_breakdown:
             category_breakdown[cat] = {'income': 0, 'expense': 0}
@@ -74,15 +99,15 @@ def export_transactions_excel(transactions, username):
             'Total Transactions',
             'Income Transactions',
             'Expense Transactions',
-            'Total Income',
-            'Total Expenses',
-            'Net Balance',
+            f'Total Income ({base})',
+            f'Total Expenses ({base})',
+            f'Net Balance ({base})',
             'Export Date'
         ],
         'Value': [
-            len(transactions),
-            len([t for t in transactions if t.type == 'income']),
-            len([t for t in transactions if t.type == 'expense']),
+            len(rows),
+            len([t for t in rows if t.type == 'income']),
+            len([t for t in rows if t.type == 'expense']),
             total_income,
             total_expense,
             net_balance,
@@ -118,13 +143,338 @@ def export_transactions_excel(transactions, username):
     
     return response
 
-def apply_transaction_filters(query, filters):
+# Columnar export formats: file extension and media type
+EXPORT_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+
+# Exports up to this size stay in memory, larger ones spill to a temporary file
+_EXPORT_SPOOL_BYTES = 32 * 1024 * 1024
+
+_CENT = Decimal('0.01')
+
+def export_transactions_columnar(query, archived, username, base, fmt):
+    """
+    Export transactions as a Parquet or Arrow IPC file
+    
+    Rows are read from the query with yield_per and written EXPORT_BATCH_SIZE
+    at a time as record batches, so memory holds one batch however large the
+    ledger is. Type, category and currency are dictionary encoded and the
+    file is compressed with EXPORT_COMPRESSION.
+    
+    Args:
+        query: Filtered transaction query with the rates joined, as for
+               export_transactions_excel
+        archived: pyarrow Table of matching archived rows (see
+                  app.archive.archived_transactions), or None
+        username: Current user's username
+        base: Currency of the amount_base column
+        fmt: A key of EXPORT_FORMATS
+    
+    Returns:
+        Flask response with the file
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    
+    config = current_app.config
+    extension, mimetype = EXPORT_FORMATS[fmt]
+    query = query.order_by(None)
+    
+    # Dictionaries are fixed before the first batch: an Arrow IPC file
+    # cannot replace them between batches
+    def distinct(column):
+        values = {value for value, in query.with_entities(column).distinct()}
+        if archived is not None:
+            values.update(pc.unique(archived[column.key]).to_pylist())
+        return pa.array(sorted(values), pa.string())
+    
+    types = list(TransactionType)
+    dictionaries = {
+        'type': pa.array([t.value for t in types], pa.string()),
+        'category': distinct(Transaction.category),
+        'currency': distinct(Transaction.currency),
+    }
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.date32()),
+        ('type', pa.dictionary(pa.int8(), pa.string())),
+        ('category', pa.dictionary(pa.int16(), pa.string())),
+        ('description', pa.string()),
+        ('currency', pa.dictionary(pa.int16(), pa.string())),
+        ('amount', pa.decimal128(10, 2)),
+        ('amount_base', pa.decimal128(14, 2)),
+    ], metadata={'base_currency': base})
+    codes = {name: {value: code for code, value in enumerate(values.to_pylist())}
+             for name, values in dictionaries.items()}
+    type_codes = {t: code for code, t in enumerate(types)}
+    
+    def encoded(name, values, index_type):
+        return pa.DictionaryArray.from_arrays(pa.array(values, index_type), dictionaries[name])
+    
+    def to_batch(rows):
+        ids, dates, tx_types, categories, descriptions, currencies, amounts, converted = zip(*rows)
+        return pa.record_batch([
+            pa.array(ids, pa.int64()),
+            pa.array(dates, pa.date32()),
+            encoded('type', [type_codes[TransactionType(t)] for t in tx_types], pa.int8()),
+            encoded('category', [codes['category'][c] for c in categories], pa.int16()),
+            pa.array(descriptions, pa.string()),
+            encoded('currency', [codes['currency'][c] for c in currencies], pa.int16()),
+            pa.array(amounts, pa.decimal128(10, 2)),
+            pa.array([None if v is None else Decimal(str(v)).quantize(_CENT) for v in converted],
+                     pa.decimal128(14, 2)),
+        ], schema=schema)
+    
+    def archived_batches():
+        table = archived.sort_by([('date', 'descending'), ('id', 'descending')])
+        columns = []
+        for field in schema:
+            column = table[field.name]
+            if pa.types.is_dictionary(field.type):
+                indices = pc.index_in(column, value_set=dictionaries[field.name]).cast(field.type.index_type)
+                column = pa.chunked_array([
+                    pa.DictionaryArray.from_arrays(chunk, dictionaries[field.name]) for chunk in indices.chunks
+                ], field.type)
+            columns.append(column.cast(field.type))
+        return pa.Table.from_arrays(columns, schema=schema).to_batches(config['EXPORT_BATCH_SIZE'])
+    
+    output = tempfile.SpooledTemporaryFile(max_size=_EXPORT_SPOOL_BYTES)
+    compression = config['EXPORT_COMPRESSION']
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(output, schema, compression=compression)
+    else:
+        writer = pa.ipc.new_file(output, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+    
+    columns = query.with_entities(
+        Transaction.id, Transaction.date, Transaction.type, Transaction.category,
+        Transaction.description, Transaction.currency, Transaction.amount, base_amount(base)
+    ).order_by(Transaction.date.desc(), Transaction.id.desc()).statement
+    rows = db.session.execute(columns.execution_options(yield_per=config['EXPORT_BATCH_SIZE']))
+    with writer:
+        for partition in rows.partitions():
+            writer.write_batch(to_batch(partition))
+        if archived is not None:
+            for batch in archived_batches():
+                writer.write_batch(batch)
+    
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f"transactions_{username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    )
+
+TRANSACTION_SORTS = {
+    'date_desc': (Transaction.date.desc(), Transaction.created_at.desc()),
+    'date_asc': (Transaction.date.asc(), Transaction.created_at.asc()),
+    'amount_desc': (Transaction.amount.desc(),),
+    'amount_asc': (Transaction.amount.asc(),),
+    'category': (Transaction.category.asc(),),
+}
+
+# The same orderings for archived rows (pyarrow sort keys)
+ARCHIVE_SORTS = {
+    'date_desc': [('date', 'descending'), ('created_at', 'descending')],
+    'date_asc': [('date', 'ascending'), ('created_at', 'ascending')],
+    'amount_desc': [('amount', 'descending')],
+    'amount_asc': [('amount', 'ascending')],
+    'category': [('category', 'ascending')],
+}
+
+# Sorts that interleave hot and archived rows: (key, descending)
+_MERGED_SORTS = {
+    'amount_desc': (attrgetter('amount'), True),
+    'amount_asc': (attrgetter('amount'), False),
+    'category': (attrgetter('category'), False),
+}
+
+def get_transaction_filters(args):
+    """
+    Read the transaction list filters from request arguments
+    
+    Args:
+        args: request.args
+    
+    Returns:
+        Dictionary of filter parameters
+    """
+    return {
+        'search': args.get('search', '').strip(),
+        'type': args.get('type', ''),
+        'category': args.get('category', ''),
+        'date_from': args.get('date_from', ''),
+        'date_to': args.get('date_to', ''),
+        'min_amount': args.get('min_amount', ''),
+        'max_amount': args.get('max_amount', ''),
+        'tags': args.get('tags', '').strip(),
+        # 'all' to require every tag; any one of them otherwise
+        'tag_mode': 'all' if args.get('tag_mode') == 'all' else '',
+    }
+
+def build_transaction_query(user_id, filters):
+    """
+    Base query for a user's transactions with the list filters applied
+    
+    Args:
+        user_id: Current user's ID
+        filters: Dictionary of filter parameters
+    
+    Returns:
+        Filtered, unordered query object
+    """
+    base = base_currency(user_id)
+    query = join_rates(Transaction.query.filter(Transaction.user_id == user_id), base)
+    return apply_transaction_filters(query, filters, base, user_id)
+
+def sort_transaction_query(query, sort_by):
+    """Apply one of the TRANSACTION_SORTS orderings (unknown keys leave the query as is)"""
+    return query.order_by(*TRANSACTION_SORTS.get(sort_by, ()))
+
+class TransactionPagination(Pagination):
+    """
+    One page of a user's transactions, hot and archived, in one ordering
+    
+    Items are app.read_models.TransactionRow. Hot rows are all dated after
+    archived ones, so by date the list is one after the other and each page
+    reads only what it shows; other orderings merge the first
+    page * per_page rows of both.
+    """
+    
+    def _query_items(self):
+        query, archived, sort_by = self._query_args['query'], self._query_args['archived'], self._query_args['sort_by']
+        offset, limit = self._query_offset, self.per_page
+        
+        if archived is None:
+            return transaction_rows(query.offset(offset).limit(limit))
+        
+        if sort_by in _MERGED_SORTS:
+            key, descending = _MERGED_SORTS[sort_by]
+            # Tags only for the rows that make the page
+            hot = transaction_rows(query.limit(offset + limit), tags=False)
+            cold = archived_rows(archived.slice(0, offset + limit))
+            return with_tags(list(islice(heapq.merge(hot, cold, key=key, reverse=descending), offset, offset + limit)))
+        
+        def take_hot(start, count):
+            return transaction_rows(query.offset(start).limit(count))
+        
+        def take_archived(start, count):
+            return archived_rows(archived.slice(start, count))
+        
+        if sort_by == 'date_asc':
+            first, first_count, second = take_archived, lambda: archived.num_rows, take_hot
+        else:
+            first, first_count, second = take_hot, lambda: query.order_by(None).count(), take_archived
+        items = first(offset, limit)
+        if len(items) < limit:
+            first_total = offset + len(items) if items else first_count()
+            items += second(max(offset - first_total, 0), limit - len(items))
+        return items
+    
+    def _query_count(self):
+        archived = self._query_args['archived']
+        return self._query_args['query'].order_by(None).count() + (archived.num_rows if archived is not None else 0)
+
+def paginate_transactions(query, user_id, filters, sort_by, page, per_page, count=True):
+    """
+    Page through a user's filtered transactions, archived ones included
+    
+    Args:
+        query: Query from build_transaction_query
+        user_id: Current user's ID
+        filters: Dictionary of filter parameters the query was built with
+        sort_by: One of the TRANSACTION_SORTS keys
+        page: Page number
+        per_page: Transactions per page
+        count: Whether to count the total (needed for page links)
+    
+    Returns:
+        Pagination object of app.read_models.TransactionRow
+    """
+    ordered = sort_transaction_query(query, sort_by)
+    # None unless the filtered date range reaches the archive
+    archived = archived_transactions(user_id, filters)
+    if archived is not None and not archived.num_rows:
+        archived = None
+    if archived is not None:
+        archived = archived.sort_by(ARCHIVE_SORTS.get(sort_by, ARCHIVE_SORTS['date_desc']))
+    return TransactionPagination(page=page, per_page=per_page, error_out=False, count=count,
+                                 query=ordered, archived=archived, sort_by=sort_by)
+
+def parse_tags(value):
+    """
+    Tag names from a comma-separated string
+
+    Names are lowercased with surrounding whitespace and a leading '#'
+    removed; duplicates and empty names are dropped.
+
+    Returns:
+        List of names in the order given
+    """
+    names = []
+    for name in (value or '').split(','):
+        name = ' '.join(name.strip().lstrip('#').lower().split())
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def tagged_transactions(names, user_id=None):
+    """
+    Semi-join subquery: ids of the transactions carrying any of the named tags
+    
+    The tags are found through the (user_id, name) unique index and their
+    transactions through the (tag_id, transaction_id) index, so the cost
+    follows the number of tagged rows, not the size of the ledger.
+    
+    Args:
+        names: Tag names
+        user_id: Owner of the tags (default any; the outer query must then
+                 be scoped to one user)
+    """
+    query = db.select(TransactionTag.transaction_id)\
+        .join(Tag, Tag.id == TransactionTag.tag_id)\
+        .where(Tag.name.in_(names))
+    if user_id is not None:
+        query = query.where(Tag.user_id == user_id)
+    return query
+
+def set_tags(transaction, names):
+    """
+    Give a transaction exactly the named tags, creating missing ones
+    
+    Links to tags the transaction keeps stay as they are, so only the
+    differences are written.
+    
+    Args:
+        transaction: Transaction with user_id set
+        names: List of tag names (see parse_tags)
+    """
+    tags = {}
+    if names:
+        tags = {tag.name: tag for tag in Tag.query.filter(Tag.user_id == transaction.user_id, Tag.name.in_(names))}
+    for name in names:
+        if name not in tags:
+            tags[name] = Tag(user_id=transaction.user_id, name=name)
+            db.session.add(tags[name])
+    wanted = [tags[name] for name in names]
+    kept = [link for link in transaction.tag_links if link.tag in wanted]
+    kept_tags = [link.tag for link in kept]
+    transaction.tag_links = kept + [TransactionTag(tag=tag, user_id=transaction.user_id)
+                                    for tag in wanted if tag not in kept_tags]
+
+def apply_transaction_filters(query, filters, base=None, user_id=None):
     """
     Apply filters to transaction query
     
     Args:
         query: SQLAlchemy query object
         filters: Dictionary of filter parameters
+        base: Base currency the amount range is in; the query must have
+              app.fx.join_rates applied (default: compare stored amounts)
+        user_id: Owner of the transactions, narrows the tag lookup
     
     Returns:
         Filtered query object
@@ -134,6 +484,14 @@ def apply_transaction_filters(query, filters):
         search_term = f"%{filters['search']}%"
         query = query.filter(Transaction.description.ilike(search_term))
     
+    # Tag filter: any or all of the tags, each an IN (semi-join) subquery
+    tags = parse_tags(filters.get('tags'))
+    if tags and filters.get('tag_mode') == 'all':
+        for name in tags:
+            query = query.filter(Transaction.id.in_(tagged_transactions([name], user_id)))
+    elif tags:
+        query = query.filter(Transaction.id.in_(tagged_transactions(tags, user_id)))
+    
     # Transaction type filter
     if filters.get('type'):
         query = query.filter(Transaction.type == filters['type'])
@@ -159,40 +517,419 @@ def apply_transaction_filters(query, filters):
             pass  # Invalid date format, skip filter
     
     # Amount range filter (optional)
+    amount = base_amount(base) if base else Transaction.amount
     if filters.get('min_amount'):
         try:
             min_amount = float(filters['min_amount'])
-            query = query.filter(Transaction.amount >= min_amount)
+            query = query.filter(amount >= min_amount)
         except ValueError:
             pass
     
     if filters.get('max_amount'):
         try:
             max_amount = float(filters['max_amount'])
-            query = query.filter(Transaction.amount <= max_amount)
+            query = query.filter(amount <= max_amount)
         except ValueError:
             pass
     
     return query
 
-def get_filter_summary(transactions, filters):
+def get_filter_summary(query, filters, user_id=None):
     """
     Calculate summary statistics for filtered transactions
     
     Args:
-        transactions: List of Transaction objects
+        query: Filtered (unpaginated) transaction query
         filters: Dictionary of active filters
+        user_id: Owner of the transactions; totals are then in their base
+                 currency (the query must come from build_transaction_query)
+                 and include matching archived rows, and the analytics
+                 engine may answer from its in-memory columns when enabled
     
     Returns:
-        Dictionary with summary data
+        Dictionary with summary data; 'tags' holds the count, income and
+        expense of the matching rows under each tag, by name
     """
-    total_income = sum(float(t.amount) for t in transactions if t.type == 'income')
-    total_expense = sum(float(t.amount) for t in transactions if t.type == 'expense')
+    active_filters = {k: v for k, v in filters.items() if v}
+    
+    summary = None
+    ledger_cache = current_app.extensions.get('ledger_cache')
+    if ledger_cache is not None and user_id is not None:
+        summary = ledger_cache.filter_summary(user_id, filters)
+    
+    # Totals by type and by type and tag come from one statement over the
+    # same filtered rows; a transaction counts under each of its tags
+    amount = base_amount(base_currency(user_id)) if user_id is not None else Transaction.amount
+    filtered = query.with_entities(Transaction.id, Transaction.type, amount.label('amount'))\
+        .order_by(None)\
+        .cte('filtered')
+    statements = []
+    if summary is None:
+        statements.append(db.select(filtered.c.type, literal(None, String).label('tag'),
+                                    func.count(), func.sum(filtered.c.amount))
+                          .group_by(filtered.c.type))
+    if user_id is None or db.session.query(Tag.id).filter(Tag.user_id == user_id).first() is not None:
+        statements.append(db.select(filtered.c.type, Tag.name, func.count(), func.sum(filtered.c.amount))
+                          .select_from(filtered)
+                          .join(TransactionTag, TransactionTag.transaction_id == filtered.c.id)
+                          .join(Tag, Tag.id == TransactionTag.tag_id)
+                          .group_by(filtered.c.type, Tag.name))
+    
+    if summary is not None:
+        count, total_income, total_expense = summary['count'], summary['total_income'], summary['total_expense']
+    else:
+        count = 0
+        total_income = 0.0
+        total_expense = 0.0
+    tag_totals = {}
+    if statements:
+        rows = db.session.execute(union_all(*statements) if len(statements) > 1 else statements[0])
+        for tx_type, tag, type_count, type_total in rows:
+            type_total = float(type_total or 0)
+            if tag is not None:
+                totals = tag_totals.setdefault(tag, {'name': tag, 'count': 0, 'income': 0.0, 'expense': 0.0})
+                totals['count'] += type_count
+                totals['income' if tx_type == 'income' else 'expense'] += type_total
+            else:
+                count += type_count
+                if tx_type == 'income':
+                    total_income = type_total
+                else:
+                    total_expense = type_total
+    
+    # Archived rows only when the date range reaches back to them
+    archived = archived_transactions(user_id, filters) if user_id is not None else None
+    if archived is not None:
+        archived_count, archived_income, archived_expense = totals_by_type(archived)
+        count += archived_count
+        total_income += archived_income
+        total_expense += archived_expense
     
     return {
-        'count': len(transactions),
+        'count': count,
         'total_income': total_income,
         'total_expense': total_expense,
         'net_balance': total_income - total_expense,
-        'active_filters': {k: v for k, v in filters.items() if v}
-    }
\ No newline at end of file
+        'tags': [tag_totals[name] for name in sorted(tag_totals)],
+        'active_filters': active_filters
+    }
+
+
+# Facets of the transaction list, the column each counts and the filters it ignores
+FACETS = {
+    'type': ('type', ('type',)),
+    'category': ('category', ('category',)),
+    'month': ('date', ('date_from', 'date_to')),
+}
+
+@cache.memoize(timeout=3600)
+def _filter_facets(user_id, data_version, filters):
+    filters = dict(filters)
+    base = base_currency(user_id)
+    columns = {'type': Transaction.type, 'category': Transaction.category, 'date': Transaction.date}
+    
+    # One grouped select per facet, each without the facet's own filters,
+    # in one statement. Every select has all three value columns so the
+    # union keeps their types; months are folded from days below
+    statements = []
+    for facet, (column, ignored) in FACETS.items():
+        values = [columns[name] if name == column else literal(None, columns[name].type) for name in columns]
+        query = join_rates(db.session.query(literal(facet), *values, func.count())
+                           .select_from(Transaction)
+                           .filter(Transaction.user_id == user_id), base)
+        query = apply_transaction_filters(query, {k: v for k, v in filters.items() if k not in ignored}, base, user_id)
+        statements.append(query.group_by(columns[column]).statement)
+    counts = {facet: defaultdict(int) for facet in FACETS}
+    for facet, tx_type, category, day, count in db.session.execute(union_all(*statements)):
+        value = {'type': tx_type, 'category': category, 'month': day}[facet]
+        if value is not None:
+            counts[facet][value] += count
+    
+    # Archived rows: one read without the facet filters, which each facet then applies
+    shared = {k: v for k, v in filters.items() if k not in ('type', 'category', 'date_from', 'date_to')}
+    archived = archived_transactions(user_id, shared)
+    if archived is not None and archived.num_rows:
+        for facet, (column, ignored) in FACETS.items():
+            facet_filters = {k: v for k, v in filters.items() if k not in ignored}
+            for value, count in archived_facet_counts(archived, facet_filters, column):
+                if value is not None:
+                    counts[facet][TransactionType(value) if facet == 'type' else value] += count
+    
+    months = defaultdict(int)
+    for day, count in counts['month'].items():
+        months[day.replace(day=1)] += count
+    return {
+        'type': [{'value': tx_type.value, 'count': count}
+                 for tx_type, count in sorted(counts['type'].items(), key=lambda item: item[0].value)],
+        'category': [{'value': category, 'count': count}
+                     for category, count in sorted(counts['category'].items(), key=lambda item: (-item[1], item[0]))],
+        'month': [{
+            'value': month.strftime('%Y-%m'),
+            'label': month.strftime('%b %Y'),
+            'date_from': month.isoformat(),
+            'date_to': date(month.year, month.month, calendar.monthrange(month.year, month.month)[1]).isoformat(),
+            'count': count,
+        } for month, count in sorted(months.items(), reverse=True)],
+    }
+
+def get_filter_facets(user_id, data_version, filters):
+    """
+    Drill-down counts for the transaction list, by type, category and month
+    
+    Each facet counts the transactions matching every filter except its
+    own (the month facet ignores the date range), so its values are the
+    choices that still lead somewhere. The three counts come from one
+    grouped statement, plus one archive read when the user has archived
+    rows, and are cached until the user's next write.
+    
+    Args:
+        user_id: Owner of the transactions
+        data_version: The owner's data_version (the cache key)
+        filters: Dictionary of filter parameters
+    
+    Returns:
+        Dictionary of facet name to a list of {'value', 'count'}
+        dictionaries; categories by count, months newest first with their
+        'label', 'date_from' and 'date_to'
+    """
+    return _filter_facets(user_id, data_version, tuple(sorted(filters.items())))
+
+
+def category_choices(tx_type):
+    """Category select choices for a transaction type (expense by default)"""
+    categories = IncomeCategory if tx_type == TransactionType.INCOME.value else ExpenseCategory
+    return [(c.value, c.name.replace('_',' ').title()) for c in categories]
+
+
+def add_months(day, months, anchor_day):
+    """Same day-of-month months later, clamped to the month's last day"""
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return date(year, month, min(anchor_day, calendar.monthrange(year, month)[1]))
+
+
+def next_occurrence(rule, day):
+    """Occurrence of rule following the one on day"""
+    interval = RecurrenceInterval(rule.interval)
+    if interval == RecurrenceInterval.DAILY:
+        return day + timedelta(days=1)
+    if interval == RecurrenceInterval.WEEKLY:
+        return day + timedelta(days=7)
+    months = 1 if interval == RecurrenceInterval.MONTHLY else 12
+    return add_months(day, months, rule.start_date.day)
+
+
+def materialize_rule(rule, today, limit, skip_dates=()):
+    """
+    Create the rule's occurrences that are due and advance next_due
+
+    Args:
+        rule: RecurringRule (attached to the session)
+        today: Occurrences dated up to and including today are due
+        limit: Most occurrences to create in one call; the rest are left
+               for the next run
+        skip_dates: Dates that already have an occurrence
+
+    Returns:
+        List of column values of the new transactions, for
+        app.events.insert_transactions
+    """
+    last = min(today, rule.end_date) if rule.end_date else today
+    created = []
+    day = rule.next_due
+    while day <= last and len(created) < limit:
+        if day not in skip_dates:
+            created.append({
+                'user_id': rule.user_id,
+                'type': rule.type,
+                'category': rule.category,
+                'amount': rule.amount,
+                'currency': rule.currency,
+                'description': rule.description,
+                'date': day,
+                'recurring_rule_id': rule.id,
+            })
+        day = next_occurrence(rule, day)
+    rule.next_due = day
+    if rule.end_date and day > rule.end_date:
+        rule.active = False
+    return created
+
+
+def _materialize_one_by_one(rule_ids, today, limit):
+    """Fallback when a batch hit occurrences created by a concurrent run"""
+    created = 0
+    for rule_id in rule_ids:
+        rule = db.session.get(RecurringRule, rule_id)
+        if not rule.active or rule.next_due > today:
+            continue
+        existing = {
+            day for day, in db.session.query(Transaction.date)
+            .filter(Transaction.recurring_rule_id == rule_id, Transaction.date >= rule.next_due)
+        }
+        occurrences = materialize_rule(rule, today, limit, skip_dates=existing)
+        try:
+            insert_transactions(db.session, occurrences)
+            db.session.commit()
+            created += len(occurrences)
+        except IntegrityError:
+            db.session.rollback()
+    return created
+
+
+def run_recurring_rules(today=None, batch_size=None, limit=None):
+    """
+    Materialize every due occurrence of every active rule
+
+    Rules are read in id order, batch_size at a time, and each batch's
+    occurrences are inserted in one statement (app.events.insert_transactions)
+    and committed together with the rules' advanced next_due. An interrupted
+    run therefore leaves every rule either fully processed or untouched,
+    and running again simply continues. The unique (rule, date) constraint
+    keeps two overlapping runs from creating the same occurrence twice.
+
+    Args:
+        today: Materialize occurrences up to this date (default today)
+        batch_size: Rules per batch (default RECURRING_BATCH_SIZE)
+        limit: Occurrences per rule per run (default RECURRING_MAX_CATCHUP)
+
+    Returns:
+        Tuple (rules processed, transactions created)
+    """
+    today = today or datetime.now().date()
+    batch_size = batch_size or current_app.config['RECURRING_BATCH_SIZE']
+    limit = limit or current_app.config['RECURRING_MAX_CATCHUP']
+
+    processed = created = 0
+    last_id = 0
+    while True:
+        rules = RecurringRule.query.filter(
+            RecurringRule.active.is_(True),
+            RecurringRule.next_due <= today,
+            RecurringRule.id > last_id
+        ).order_by(RecurringRule.id).limit(batch_size).all()
+        if not rules:
+            break
+        last_id = rules[-1].id
+        rule_ids = [rule.id for rule in rules]
+
+        # The write hooks bump each owner's data_version; load them in one
+        # query and hold on to them so the identity map keeps them
+        owners = User.query.filter(User.id.in_({rule.user_id for rule in rules})).all()
+
+        occurrences = []
+        for rule in rules:
+            occurrences.extend(materialize_rule(rule, today, limit))
+        try:
+            insert_transactions(db.session, occurrences)
+            db.session.commit()
+            created += len(occurrences)
+        except IntegrityError:
+            db.session.rollback()
+            created += _materialize_one_by_one(rule_ids, today, limit)
+
+        processed += len(rules)
+        # Keep memory bounded by the batch, not the whole run
+        del owners
+        db.session.expunge_all()
+    return processed, created
+
+
+def _import_row(row, categorizer):
+    """Transaction fields for one CSV row; raises ValueError when invalid"""
+    try:
+        tx_date = datetime.strptime((row.get('date') or '').strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('date must be YYYY-MM-DD')
+    try:
+        amount = Decimal((row.get('amount') or '').strip().replace(',', ''))
+    except InvalidOperation:
+        raise ValueError('amount is not a number')
+    if not amount:
+        raise ValueError('amount is zero')
+    description = (row.get('description') or '').strip()[:500]
+
+    tx_type = (row.get('type') or '').strip().lower() or None
+    if amount < 0:
+        # Signed bank exports: negative amounts are money going out
+        tx_type, amount = tx_type or TransactionType.EXPENSE.value, -amount
+    if tx_type is not None and tx_type not in {t.value for t in TransactionType}:
+        raise ValueError(f'unknown type {tx_type!r}')
+
+    category = (row.get('category') or '').strip().lower() or None
+    suggested = False
+    if category is not None:
+        if tx_type is None:
+            tx_type = TransactionType.INCOME.value if valid_category('income', category) else TransactionType.EXPENSE.value
+        if not valid_category(tx_type, category):
+            raise ValueError(f'unknown {tx_type} category {category!r}')
+    else:
+        match = categorizer.suggest(description, tx_type)
+        if match:
+            tx_type, category = match[0].value, match[1]
+            suggested = True
+        else:
+            tx_type = tx_type or TransactionType.EXPENSE.value
+            category = (IncomeCategory.OTHERS if tx_type == TransactionType.INCOME.value else ExpenseCategory.OTHERS).value
+
+    return {
+        'type': TransactionType(tx_type),
+        'category': category,
+        'amount': amount,
+        'description': description,
+        'date': tx_date,
+    }, suggested
+
+
+def _import_currency(row, tx_date, base, rates):
+    currency = (row.get('currency') or '').strip().upper() or base
+    if not rates.can_convert(currency, tx_date, base):
+        raise ValueError(f'no {currency} exchange rate for {tx_date}')
+    return currency
+
+
+def import_transactions_csv(rows, user_id, batch_size=1000):
+    """
+    Add transactions from CSV rows, categorizing those without a category
+
+    Args:
+        rows: Iterable of dicts (e.g. csv.DictReader) with date (YYYY-MM-DD),
+              amount and description, and optionally type, category and
+              currency (default the user's base currency). Negative amounts
+              are imported as expenses.
+        user_id: Owner of the imported transactions
+        batch_size: Rows per commit
+
+    Returns:
+        Dictionary with the imported and auto-categorized counts and a list
+        of (line number, message) for rows that were skipped
+    """
+    owner = db.session.get(User, user_id)
+    categorizer = get_categorizer(user_id, owner.settings_version)
+    rates = get_rates()
+    result = {'imported': 0, 'categorized': 0, 'errors': []}
+
+    batch = []
+    # Line 1 is the header
+    for line, row in enumerate(rows, start=2):
+        try:
+            fields, suggested = _import_row(row, categorizer)
+            if owner.archived_before is not None and fields['date'] < owner.archived_before:
+                raise ValueError(f"dates before {owner.archived_before} are archived")
+            fields['currency'] = _import_currency(row, fields['date'], owner.base_currency, rates)
+        except ValueError as e:
+            result['errors'].append((line, str(e)))
+            continue
+        batch.append(Transaction(user_id=user_id, **fields))
+        result['categorized'] += suggested
+        if len(batch) == batch_size:
+            db.session.add_all(batch)
+            db.session.commit()
+            result['imported'] += len(batch)
+            batch = []
+    if batch:
+        db.session.add_all(batch)
+        db.session.commit()
+        result['imported'] += len(batch)
+    return result
@@ -1,7 +1,11 @@
 from flask import Blueprint,redirect,render_template,url_for,flash,request,session
-from app import db,bcrypt,limiter
+from app import db,limiter
+from app.fx import currency_choices
+from app.ledger import rebuild_derived_state
 from app.forms import RegisterForm,LoginForm,UpdateAccount,UpdatePassword,ResetPasswordForm,ResetRequestForm
 from app.models import User
+from app.passwords import HashingBusy,get_hasher
+from app.sharding import find_user
 from app.users.utilities import save_prof_pic,send_reset_email
 from flask_login import login_user,logout_user,current_user,login_required
 
@@ -13,7 +17,7 @@ def register():
     if current_user.is_authenticated:
         return redirect(url_for("main.home"))
     if form.validate_on_submit():
-        hashed_pw=bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_pw=get_hasher().hash(form.password.data)
         user=User(username=form.username.data,email=form.email.data,password=hashed_pw)
         db.session.add(user)
         db.session.commit()
@@ -21,6 +25,17 @@ def register():
         return redirect(url_for('users.login'))
     return render_template('register.html',form=form)
 
+def rehash_password(user,password):
+    """Rehash a just-verified password whose stored hash has another cost than the current one"""
+    hasher=get_hasher()
+    if not hasher.needs_rehash(user.password):
+        return
+    try:
+        user.password=hasher.hash(password)
+    except HashingBusy:
+        return  # the next login will
+    db.session.commit()
+
 @users.route('/login',methods=['GET','POST'])
 @limiter.limit("5 per minute")
 def login():
@@ -28,9 +43,10 @@ def login():
     if current_user.is_authenticated:
         return redirect(url_for("main.home"))
     if form.validate_on_submit():
-        user=User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password,form.password.data):
+        user=find_user(email=form.email.data)
+        if user and get_hasher().check(user.password,form.password.data):
             login_user(user,remember=form.remember.data)
+            rehash_password(user,form.password.data)
             response = redirect(url_for('main.home'))
             # Prevent cache of login response
             response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, private, max-age=0'
@@ -45,6 +61,9 @@ def login():
 @login_required
 def account():
     form1 =UpdateAccount()
+    form1.base_currency.choices=currency_choices()
+    if not form1.base_currency.data:
+        form1.base_currency.data=current_user.base_currency
     form2 =UpdatePassword()
     if request.method=='POST':
         if 'form1_submit' in request.form and form1.validate_on_submit():
@@ -53,12 +72,17 @@ def account():
                 current_user.image_file=pic_file
             current_user.username=form1.username.data
             current_user.email=form1.email.data
+            if current_user.base_currency!=form1.base_currency.data:
+                # Balances, totals and statistics are kept in the base currency
+                current_user.base_currency=form1.base_currency.data
+                db.session.flush()
+                rebuild_derived_state(current_user.id)
             db.session.commit()
             flash('Profile Updated Successfully','success')
             return redirect(url_for('users.account'))
         elif 'form2_submit' in request.form and form2.validate_on_submit():
-            if bcrypt.check_password_hash(current_user.password,form2.old_password.data):
-                hashed_pw=bcrypt.generate_password_hash(form2.new_password.data).decode('utf-8')
+            if get_hasher().check(current_user.password,form2.old_password.data):
+                hashed_pw=get_hasher().hash(form2.new_password.data)
                 current_user.password=hashed_pw
                 db.session.commit()
                 flash(f"Password changed successfully","success")
@@ -68,6 +92,7 @@ def account():
     elif request.method=='GET':
         form1.username.data=current_user.username
         form1.email.data=current_user.email
+        form1.base_currency.data=current_user.base_currency
     img_file=url_for('static',filename='profile_pics/'+current_user.image_file)
     return render_template('account.html',form1=form1,form2=form2,image_file=img_file)
 
@@ -94,7 +119,7 @@ def reset_password():
         return redirect(url_for("main.home"))
     form=ResetRequestForm()
     if form.validate_on_submit():
-        user=User.query.filter_by(email=form.email.data).first()
+        user=find_user(email=form.email.data)
         send_reset_email(user)
         flash('An email as been sent. Please check your mailbox.','info')
         return redirect(url_for('users.login'))
@@ -110,7 +135,7 @@ def reset_token(token):
         return redirect(url_for('users.reset_password'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hashed_pw=bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_pw=get_hasher().hash(form.password.data)
         user.password=hashed_pw
         db.session.commit()
         flash('Password updated successfully. Please login','success')
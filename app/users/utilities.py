@@ -4,11 +4,12 @@ from threading import Thread
 from flask import current_app,url_for
 from app import mail
 from flask_mail import Message
-from PIL import Image
 import logging
 logger = logging.getLogger(__name__)
 
 def save_prof_pic(form_pic):
+    from PIL import Image
+
     rand_hex=secrets.token_hex(8)
     try:
         _, ext = os.path.splitext(form_pic.filename)
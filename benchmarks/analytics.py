@@ -0,0 +1,113 @@
+"""
+SQL path vs. in-memory columnar engine for a heavy user.
+
+    python benchmarks/analytics.py --rows 200000
+    python benchmarks/analytics.py --rows 1000000 --repeat 3
+
+Builds a throwaway SQLite database with one user holding --rows
+transactions, then times the dashboard's month totals, the category
+breakdown for every dashboard period and a set of transaction-list filter
+summaries, once through SQL and once through app/analytics.py.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import seed_transactions, timed
+from config import TestingConfig
+
+PERIODS = ('this_month', 'last_month', 'last_3_months', 'this_year', 'all_time')
+FILTERS = [
+    {},
+    {'type': 'expense'},
+    {'category': 'food'},
+    {'type': 'expense', 'date_from': '{year}-01-01'},
+    {'date_from': '{year}-03-01', 'date_to': '{year}-06-30', 'min_amount': '100'},
+    {'category': 'salary', 'max_amount': '5000'},
+]
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        ANALYTICS_ENGINE = True
+        RATELIMIT_ENABLED = False
+
+    from app import create_app, db
+    from app.main.utilities import get_category_breakdown, get_month_totals
+    from app.models import User
+    from app.transactions.utilities import build_transaction_query, get_filter_summary, get_transaction_filters
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        start = time.perf_counter()
+        seed_transactions(db, user_id, args.rows, args.years, random.Random(42))
+        db.session.commit()
+        print(f"Seeded {args.rows:,} rows in {time.perf_counter() - start:.1f} s")
+
+        year = date.today().year
+        filters = [
+            get_transaction_filters({k: v.format(year=year) for k, v in f.items()})
+            for f in FILTERS
+        ]
+        month_start = date.today().replace(day=1)
+
+        def dashboard():
+            get_month_totals(user_id, month_start)
+
+        def breakdowns():
+            for period in PERIODS:
+                for tx_type in ('expense', 'income'):
+                    get_category_breakdown(user_id, tx_type, period)
+
+        def summaries():
+            for f in filters:
+                get_filter_summary(build_transaction_query(user_id, f), f, user_id)
+
+        ledger_cache = app.extensions['ledger_cache']
+
+        def engine_dashboard():
+            ledger_cache.month_totals(user_id, month_start)
+
+        start = time.perf_counter()
+        ledger = ledger_cache.get(user_id)
+        load_ms = (time.perf_counter() - start) * 1000
+        print(f"Engine cold load: {load_ms:.1f} ms, {ledger.nbytes / 1024 / 1024:.1f} MiB of arrays\n")
+
+        results = []
+        app.extensions['ledger_cache'] = None
+        sql = [timed(dashboard, args.repeat), timed(breakdowns, args.repeat), timed(summaries, args.repeat)]
+        app.extensions['ledger_cache'] = ledger_cache
+        engine = [timed(engine_dashboard, args.repeat), timed(breakdowns, args.repeat), timed(summaries, args.repeat)]
+        names = ['dashboard totals', f'breakdowns ({len(PERIODS) * 2} queries)', f'filter summaries ({len(filters)})']
+        for name, sql_ms, engine_ms in zip(names, sql, engine):
+            results.append((name, sql_ms, engine_ms))
+
+        print(f"{'workload':<28}{'SQL ms':>10}{'engine ms':>12}{'speedup':>10}")
+        for name, sql_ms, engine_ms in results:
+            print(f"{name:<28}{sql_ms:>10.1f}{engine_ms:>12.2f}{sql_ms / engine_ms:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
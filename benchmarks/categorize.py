@@ -0,0 +1,140 @@
+"""
+Throughput of rule-based auto-categorization.
+
+    python benchmarks/categorize.py --rules 10000 --descriptions 1000000
+
+Loads --rules global keyword rules (plus a few regex rules) into a
+throwaway SQLite database, compiles them, and suggests a category for
+--descriptions generated bank-statement descriptions, about half of which
+contain a rule keyword. For comparison a naive loop that tests every rule
+against every description, in order, is timed on a small sample.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TestingConfig
+
+WORDS = ['payment', 'upi', 'pos', 'ref', 'txn', 'online', 'store', 'india', 'pvt', 'ltd', 'mumbai', 'debit']
+REGEX_RULES = [
+    (r'neft.*salary', 'income', 'salary'),
+    (r'\bemi\s+\d+', 'expense', 'bills'),
+    (r'atm\s+wdl', 'expense', 'other_expense'),
+]
+
+
+def merchant(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 10)))
+
+
+def make_rules(rng, count):
+    from app.models import ExpenseCategory, IncomeCategory
+
+    expense = [c.value for c in ExpenseCategory]
+    income = [c.value for c in IncomeCategory]
+    keywords = set()
+    while len(keywords) < count:
+        keywords.add(merchant(rng) if rng.random() < 0.8 else f'{merchant(rng)} {merchant(rng)}')
+    rules = []
+    for keyword in sorted(keywords):
+        if rng.random() < 0.9:
+            rules.append({'pattern': keyword, 'is_regex': False, 'type': 'expense', 'category': rng.choice(expense)})
+        else:
+            rules.append({'pattern': keyword, 'is_regex': False, 'type': 'income', 'category': rng.choice(income)})
+    for pattern, tx_type, category in REGEX_RULES:
+        rules.append({'pattern': pattern, 'is_regex': True, 'type': tx_type, 'category': category})
+    return rules
+
+
+def make_descriptions(rng, rules, count):
+    keywords = [r['pattern'] for r in rules if not r['is_regex']]
+    descriptions = []
+    for _ in range(count):
+        words = rng.sample(WORDS, 3) + [str(rng.randrange(10 ** 6))]
+        if rng.random() < 0.5:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords).upper())
+        else:
+            words.insert(0, merchant(rng))
+        descriptions.append(' '.join(words))
+    return descriptions
+
+
+def naive_matcher(rules):
+    """One compiled regex per rule, tried in order"""
+    import re
+
+    compiled = []
+    for rule in rules:
+        if rule['is_regex']:
+            compiled.append((re.compile(rule['pattern'], re.IGNORECASE), rule['type'], rule['category']))
+        else:
+            compiled.append((re.compile(r'(?<!\w)' + re.escape(rule['pattern']) + r'(?!\w)'), rule['type'], rule['category']))
+    return compiled
+
+
+def naive_suggest(compiled, description):
+    from app.categorize import normalize
+
+    text = normalize(description)
+    for regex, tx_type, category in compiled:
+        if regex.search(text):
+            return tx_type, category
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, default=10000)
+    parser.add_argument('--descriptions', type=int, default=1000000)
+    parser.add_argument('--naive-sample', type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        RATELIMIT_ENABLED = False
+
+    from app import create_app, db
+    from app.categorize import get_categorizer
+    from app.models import CategoryRule, TransactionType, User
+
+    rng = random.Random(42)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        rules = make_rules(rng, args.rules)
+        db.session.execute(db.insert(CategoryRule), [dict(r, type=TransactionType(r['type'])) for r in rules])
+        db.session.add(User(username='bench', email='bench@example.com', password='x'))
+        db.session.commit()
+        user_id = db.session.query(User.id).scalar()
+
+        start = time.perf_counter()
+        categorizer = get_categorizer(user_id)
+        print(f"Compiled {len(rules):,} rules in {time.perf_counter() - start:.2f} s")
+
+        descriptions = make_descriptions(rng, rules, args.descriptions)
+
+        start = time.perf_counter()
+        matched = sum(categorizer.suggest(d) is not None for d in descriptions)
+        elapsed = time.perf_counter() - start
+        print(f"compiled  {len(descriptions):>9,} descriptions {elapsed:>7.1f} s "
+              f"{len(descriptions) / elapsed:>10,.0f}/s  {matched:,} matched")
+
+        sample = descriptions[:args.naive_sample]
+        compiled = naive_matcher(rules)
+        start = time.perf_counter()
+        for d in sample:
+            naive_suggest(compiled, d)
+        elapsed = time.perf_counter() - start
+        print(f"naive     {len(sample):>9,} descriptions {elapsed:>7.1f} s "
+              f"{len(sample) / elapsed:>10,.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Helpers shared by the benchmark scripts, which import them as
+``from common import ...`` (a script's own directory is on sys.path).
+
+Seeded transactions are bulk-inserted, so they skip the write hooks;
+benchmarks that read rollups rebuild them after seeding. Categories come
+from the model enums. App modules are imported inside the functions, as
+in the scripts, so nothing is loaded before a script sets up its config.
+"""
+import statistics
+import time
+from datetime import date, timedelta
+from functools import lru_cache
+
+# Rows per bulk insert
+BATCH_SIZE = 50000
+
+
+@lru_cache(maxsize=None)
+def category_values():
+    """Tuple (income categories, expense categories) as values of the model enums"""
+    from app.models import ExpenseCategory, IncomeCategory
+
+    return [category.value for category in IncomeCategory], [category.value for category in ExpenseCategory]
+
+
+def random_transaction(user_id, rng, years, income_share=0.15, max_amount=5000, description='transaction',
+                       today=None):
+    """
+    One random transaction as a dict for a bulk insert
+
+    Args:
+        user_id: Owner
+        rng: random.Random to draw from
+        years: Dated within this many years before today
+        income_share: Chance of an income rather than an expense
+        max_amount: Amounts are uniform between 1 and this
+        description: Description
+        today: Date the years count back from (default today)
+    """
+    from app.models import TransactionType
+
+    income = rng.random() < income_share
+    income_categories, expense_categories = category_values()
+    return {
+        'user_id': user_id,
+        'type': TransactionType.INCOME if income else TransactionType.EXPENSE,
+        'category': rng.choice(income_categories if income else expense_categories),
+        'amount': round(rng.uniform(1, max_amount), 2),
+        'description': description,
+        'date': (today or date.today()) - timedelta(days=rng.randrange(365 * years)),
+    }
+
+
+def seed_transactions(db, user_id, rows, years, rng, **kwargs):
+    """
+    Bulk-insert rows random transactions for a user, BATCH_SIZE at a time,
+    without committing
+
+    Keyword arguments go to random_transaction. description is formatted
+    with the row number as {i}, or is a function of (row number, rng).
+    """
+    from app.models import Transaction
+
+    description = kwargs.pop('description', 'transaction {i}')
+    today = kwargs.pop('today', None) or date.today()
+    batch = []
+    for i in range(rows):
+        text = description(i, rng) if callable(description) else description.format(i=i)
+        batch.append(random_transaction(user_id, rng, years, description=text, today=today, **kwargs))
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(db.insert(Transaction), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(Transaction), batch)
+
+
+def timed(func, repeat):
+    """Median wall time of repeat calls of func, in ms"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
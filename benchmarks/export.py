@@ -0,0 +1,130 @@
+"""
+Excel vs. Parquet vs. Arrow IPC export of one large ledger.
+
+    python benchmarks/export.py --rows 1000000
+    python benchmarks/export.py --rows 200000 --formats parquet arrow
+
+Builds a throwaway SQLite database with one user holding --rows
+transactions, then runs each export the way /transactions/export does (the
+query, the file and the response) in its own process, so every format
+starts from the same memory. For each format it prints the wall time, the
+file size, the process's peak RSS, and how far that peak rose above the
+RSS right before the export (Arrow buffers live outside the Python heap,
+so tracemalloc would not see them).
+
+The Excel export holds every row as Python objects and every cell in
+openpyxl, so at 1M rows it needs several GB of memory and minutes.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import seed_transactions
+from config import TestingConfig
+
+FORMATS = ('xlsx', 'parquet', 'arrow')
+def bench_config(db_path):
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{db_path}"
+        RATELIMIT_ENABLED = False
+    return BenchConfig
+
+
+def max_rss_bytes():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def run_export(db_path, fmt):
+    """Child process: one export, result printed as JSON"""
+    from app import create_app, db
+    from app.fx import base_amount, join_rates
+    from app.models import Transaction, User
+    from app.read_models import EXPORT_COLUMNS
+    from app.transactions.utilities import export_transactions_columnar, export_transactions_excel
+
+    app = create_app(bench_config(db_path))
+    with app.test_request_context():
+        user = User.query.first()
+        base = user.base_currency
+        if fmt == 'xlsx':
+            import pandas  # noqa: F401  imported up front so it is not counted as export memory
+        else:
+            import pyarrow.parquet  # noqa: F401
+        before = current_rss_bytes()
+
+        start = time.perf_counter()
+        query = join_rates(db.session.query(*EXPORT_COLUMNS, base_amount(base).label('amount_base'))
+                           .select_from(Transaction), base)\
+            .filter(Transaction.user_id == user.id)
+        if fmt == 'xlsx':
+            rows = query.order_by(Transaction.date.desc()).all()
+            response = export_transactions_excel(rows, user.username, base)
+        else:
+            response = export_transactions_columnar(query, None, user.username, base, fmt)
+        response.direct_passthrough = False
+        size = len(response.get_data())
+        seconds = time.perf_counter() - start
+
+    print(json.dumps({'seconds': seconds, 'size': size, 'peak': max_rss_bytes(), 'before': before}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--run', choices=FORMATS, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_export(args.db, args.run)
+        return
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+    from app import create_app, db
+    from app.models import User
+
+    app = create_app(bench_config(db_path))
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+
+        start = time.perf_counter()
+        seed_transactions(db, user.id, args.rows, args.years, random.Random(42),
+                          description=lambda i, rng: f'transaction {i} at store {rng.randrange(500)}')
+        db.session.commit()
+        print(f"Seeded {args.rows:,} rows in {time.perf_counter() - start:.1f} s\n")
+
+    mib = 1024 * 1024
+    print(f"{'format':<10}{'seconds':>10}{'size MiB':>11}{'peak RSS MiB':>14}{'export MiB':>12}")
+    for fmt in args.formats:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', fmt, '--db', db_path],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            print(f"{fmt:<10} failed (exit {child.returncode}): {child.stderr.strip().splitlines()[-1:]}")
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        print(f"{fmt:<10}{result['seconds']:>10.1f}{result['size'] / mib:>11.1f}"
+              f"{result['peak'] / mib:>14.0f}{(result['peak'] - result['before']) / mib:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Wall time of the nightly cash-flow forecast job against a time window.
+
+    python benchmarks/forecast.py --users 100000 --window-minutes 30
+    python benchmarks/forecast.py --users 20000 --workers 4 --chunk-size 2000
+
+Builds a throwaway SQLite database holding only what the job reads: for
+each of --users users, --months months of MonthlyCategoryTotal rollups
+(income plus a few expense categories with a yearly pattern) and a
+BalanceCheckpoint per month. Then runs ``run_forecasts`` and exits non-zero
+if it takes longer than --window-minutes.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import category_values
+from config import TestingConfig
+
+
+def seed(db, users, months, today):
+    from app.forecast import month_from_index, month_index
+    from app.models import BalanceCheckpoint, MonthlyCategoryTotal, TransactionType, User
+
+    db.session.execute(db.insert(User), [
+        {'username': f'u{i}', 'email': f'u{i}@example.com', 'password': 'x'}
+        for i in range(users)
+    ])
+    user_ids = [uid for uid, in db.session.query(User.id)]
+
+    rng = random.Random(42)
+    _, expense_categories = category_values()
+    current = month_index(today)
+    totals, checkpoints = [], []
+
+    def flush():
+        db.session.execute(db.insert(MonthlyCategoryTotal), totals)
+        db.session.execute(db.insert(BalanceCheckpoint), checkpoints)
+        totals.clear()
+        checkpoints.clear()
+
+    for user_id in user_ids:
+        salary = rng.uniform(20000, 200000)
+        categories = rng.sample(expense_categories, rng.randint(2, 6))
+        spend = {category: rng.uniform(500, salary / 8) for category in categories}
+        # Newer users have less history
+        history = rng.randint(3, months)
+        balance = 0.0
+        for index in range(current - history, current + 1):
+            month = month_from_index(index)
+            net = salary
+            totals.append({'user_id': user_id, 'month': month, 'type': TransactionType.INCOME,
+                           'category': 'salary', 'total': round(salary, 2), 'count': 1})
+            for category in categories:
+                amount = round(spend[category] * rng.uniform(0.7, 1.3) * (1.8 if month.month == 12 else 1), 2)
+                net -= amount
+                totals.append({'user_id': user_id, 'month': month, 'type': TransactionType.EXPENSE,
+                               'category': category, 'total': amount, 'count': rng.randint(1, 20)})
+            balance += net
+            checkpoints.append({'user_id': user_id, 'month': month, 'net': round(net, 2),
+                                'closing_balance': round(balance, 2)})
+        if len(totals) >= 50000:
+            flush()
+    if totals:
+        flush()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--window-minutes', type=float, default=30)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        RATELIMIT_ENABLED = False
+
+    from app import create_app, db
+    from app.forecast import run_forecasts
+    from app.models import BalanceForecast, CategoryForecast
+
+    today = date.today()
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        seed(db, args.users, args.months, today)
+        print(f"Seeded {args.users:,} users x {args.months} months in {time.perf_counter() - start:.1f} s")
+
+        start = time.perf_counter()
+        forecast, chunks = run_forecasts(today, args.workers, args.chunk_size)
+        elapsed = time.perf_counter() - start
+        rows = db.session.query(BalanceForecast).count() + db.session.query(CategoryForecast).count()
+        workers = args.workers or app.config['FORECAST_WORKERS'] or os.cpu_count()
+        print(f"Forecast {forecast:,} users in {chunks} chunks on {workers} workers: {elapsed:.1f} s "
+              f"({forecast / elapsed:,.0f} users/s, {rows:,} rows stored)")
+
+    window = args.window_minutes * 60
+    if elapsed > window:
+        print(f"FAIL: exceeds the {args.window_minutes:g} minute window")
+        sys.exit(1)
+    print(f"OK: within the {args.window_minutes:g} minute window")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Household dashboard: one aggregation over every member vs. the per-user
+dashboard once per member.
+
+    python benchmarks/household.py
+    python benchmarks/household.py --members 50 --rows 20000 --repeat 3
+
+Builds a throwaway SQLite database with --members users holding --rows
+transactions each, puts them all in one household and times, for every
+dashboard period, get_household_stats against calling get_dashboard_stats
+for each member. The cache is disabled, so both compute from scratch.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import seed_transactions, timed
+from config import TestingConfig
+
+PERIODS = ('this_month', 'last_month', 'last_3_months', 'this_year', 'all_time')
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=20000, help='Transactions per member')
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        CACHE_TYPE = 'NullCache'
+        RATELIMIT_ENABLED = False
+
+    from app import create_app, db
+    from app.households.utilities import get_household_stats, new_invite_code
+    from app.ledger import rebuild_balance_checkpoints, rebuild_category_totals
+    from app.main.utilities import get_dashboard_stats
+    from app.models import Household, HouseholdMember, User
+    from app.sharding import create_all
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        create_all()
+        rng = random.Random(42)
+        start = time.perf_counter()
+        household = Household(name='bench', base_currency='INR', invite_code=new_invite_code())
+        for i in range(args.members):
+            user = User(username=f'member{i}', email=f'member{i}@example.com', password='x')
+            db.session.add(user)
+            db.session.flush()
+            seed_transactions(db, user.id, args.rows, args.years, rng)
+            # Bulk inserts skip the write hooks; build the rollups they maintain
+            rebuild_balance_checkpoints(user.id)
+            rebuild_category_totals(user.id)
+            household.members.append(HouseholdMember(user_id=user.id))
+        db.session.add(household)
+        db.session.commit()
+        member_ids = [member.user_id for member in household.members]
+        print(f"Seeded {args.members} members x {args.rows:,} rows in {time.perf_counter() - start:.1f} s\n")
+
+        print(f"{'period':<16}{'per member ms':>15}{'household ms':>14}{'speedup':>10}")
+        for period in PERIODS:
+            def per_member():
+                for user_id in member_ids:
+                    get_dashboard_stats(user_id, period)
+
+            def combined():
+                get_household_stats(household, period)
+
+            member_ms = timed(per_member, args.repeat)
+            household_ms = timed(combined, args.repeat)
+            print(f"{period:<16}{member_ms:>15.1f}{household_ms:>14.1f}{member_ms / household_ms:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Live dashboard updates: what idle streams cost, and what a dispatcher poll
+costs with and without new events.
+
+    python benchmarks/live.py
+    python benchmarks/live.py --streams 200 --writes 100 --repeat 5
+    python benchmarks/live.py --streams 2000 --evented
+
+Opens --streams event streams, one per user, each drained by its own
+thread as a threaded worker would, or by its own greenlet as a gevent
+worker would with --evented (needs gevent), and prints the Python memory
+they hold (tracemalloc; thread stacks are not counted). Then times a dispatcher
+poll with no new events, writes --writes transactions for random users
+with open streams (one event each), and times the poll that delivers
+them, checking every event reached its stream.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import timed
+from config import TestingConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=200)
+    parser.add_argument('--writes', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--evented', action='store_true', help='patch the process with gevent, as gunicorn -k gevent does')
+    args = parser.parse_args()
+    if args.evented:
+        from gevent import monkey
+        monkey.patch_all()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        LIVE_UPDATES = True
+        # Polls are run by hand
+        LIVE_POLL_SECONDS = 3600
+        LIVE_HEARTBEAT_SECONDS = 3600
+        LIVE_STREAM_SECONDS = 3600
+
+    from app import create_app, db
+    from app.live import stream
+    from app.models import Transaction, TransactionType, User
+    from app.sharding import create_all
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        create_all()
+        db.session.add_all([User(username=f'bench{i}', email=f'bench{i}@example.com', password='x')
+                            for i in range(args.streams)])
+        db.session.commit()
+        user_ids = [user_id for user_id, in db.session.query(User.id)]
+        hub = app.extensions['live_hub']
+        received = []
+
+        def drain(subscriber):
+            for message in stream(hub, subscriber, [], date.today()):
+                if message.startswith('id:'):
+                    received.append(1)
+            hub.unsubscribe(subscriber)
+
+        tracemalloc.start()
+        subscribers = [hub.subscribe(user_id, args.streams) for user_id in user_ids]
+        threads = [threading.Thread(target=drain, args=(subscriber,)) for subscriber in subscribers]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{args.streams} idle {'evented' if args.evented else 'threaded'} streams: {held / 2 ** 20:.2f} MiB, "
+              f"{held / args.streams / 1024:.1f} KiB each (Python objects, not thread stacks)")
+
+        # The first poll marks the users live, so the writes below queue events
+        hub.dispatch()
+        print(f"poll with no new events: median {timed(hub.dispatch, args.repeat):.2f} ms")
+
+        rng = random.Random(42)
+        for _ in range(args.writes):
+            db.session.add(Transaction(user_id=rng.choice(user_ids), type=TransactionType.EXPENSE,
+                                       category='food', amount=round(rng.uniform(1, 100), 2),
+                                       description='lunch', date=date.today()))
+            db.session.commit()
+        start = time.perf_counter()
+        hub.dispatch()
+        elapsed = (time.perf_counter() - start) * 1000
+        deadline = time.monotonic() + 10
+        while len(received) < args.writes and time.monotonic() < deadline:
+            time.sleep(0.05)
+        print(f"poll delivering {args.writes} events: {elapsed:.2f} ms, {len(received)} received by streams")
+
+        # End the streams
+        for subscriber in subscribers:
+            subscriber.overflowed = True
+            subscriber.queue.put((0, '{}'))
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == '__main__':
+    main()
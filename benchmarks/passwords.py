@@ -0,0 +1,90 @@
+"""
+Password hashing under a login burst: bcrypt inline on every request
+thread vs. the bounded hashing pool.
+
+    python benchmarks/passwords.py
+    python benchmarks/passwords.py --burst 64 --rounds 11 --workers 4 --queue 16
+
+Starts --burst threads at once, each checking one password as the login
+route does, and prints the median and 95th percentile time a thread waited
+for its answer. Inline, every thread hashes at the same time and all of
+them finish late; through the pool, --workers hash while --queue wait and
+the rest are refused straight away (503), so the answered ones finish
+sooner. Also prints the pool's stats and the cost calibration would pick
+here. bcrypt hashes in parallel only up to the number of cores.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TestingConfig
+
+
+def burst(size, check):
+    """Run check from size threads started together; returns (latencies of answered ones in ms, refused)"""
+    from app.passwords import HashingBusy
+
+    start = threading.Barrier(size)
+    latencies, refused = [], []
+
+    def login():
+        start.wait()
+        began = time.perf_counter()
+        try:
+            check()
+        except HashingBusy:
+            refused.append(1)
+            return
+        latencies.append((time.perf_counter() - began) * 1000)
+
+    threads = [threading.Thread(target=login) for _ in range(size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(refused)
+
+
+def report(label, latencies, refused):
+    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+    print(f"{label:8} answered {len(latencies):3}  refused {refused:3}  "
+          f"p50 {statistics.median(latencies):8.1f} ms  p95 {p95:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--burst', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=8)
+    parser.add_argument('--target-ms', type=int, default=250)
+    args = parser.parse_args()
+
+    class BenchConfig(TestingConfig):
+        BCRYPT_LOG_ROUNDS = args.rounds
+        PASSWORD_HASH_WORKERS = args.workers
+        PASSWORD_HASH_QUEUE_SIZE = args.queue
+
+    from app import bcrypt, create_app
+
+    app = create_app(BenchConfig)
+    hasher = app.extensions['password_hasher']
+    hashed = hasher.hash('correct horse')
+    print(f"{os.cpu_count()} cores, cost {args.rounds}, burst of {args.burst}, "
+          f"{args.workers} workers + {args.queue} queued\n")
+
+    report('inline', *burst(args.burst, lambda: bcrypt.check_password_hash(hashed, 'correct horse')))
+    report('pool', *burst(args.burst, lambda: hasher.check(hashed, 'correct horse')))
+    print(f"\npool stats: {hasher.stats()}")
+
+    rounds, estimate = hasher.calibrate(args.target_ms, 4, 31)
+    print(f"calibration for {args.target_ms} ms: {rounds} rounds, about {estimate:.0f} ms per hash")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Read rows vs. ORM entities: time and memory to load transactions for
+display.
+
+    python benchmarks/read_models.py
+    python benchmarks/read_models.py --rows 10000 100000 --repeat 3
+
+Builds a throwaway SQLite database with one user holding the largest of
+--rows transactions, a tenth of them tagged, then loads the newest N rows
+two ways for each N:
+
+  list    Transaction entities with their tags (selectinload), as the list
+          used to, vs. app.read_models.transaction_rows
+  export  (Transaction, amount in base) tuples vs. the export's columns
+
+and prints the median wall time and, from tracemalloc, the peak memory
+allocated while loading and the memory still held by the loaded rows
+(with the session's identity map, for entities). Times are taken with
+tracemalloc off.
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import seed_transactions
+from config import TestingConfig
+
+def measure(load, repeat):
+    """Returns (median ms, peak MiB while loading, MiB held by the result)"""
+    from app import db
+
+    samples = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        gc.collect()
+        start = time.perf_counter()
+        load()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    db.session.expunge_all()
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    db.session.expunge_all()
+    return statistics.median(samples), peak / 2 ** 20, held / 2 ** 20
+
+
+def report(label, rows, entities, read):
+    (entity_ms, entity_peak, entity_held), (read_ms, read_peak, read_held) = entities, read
+    print(f"{label:7} {rows:>8,}  entities {entity_ms:8.1f} ms {entity_peak:7.1f} MiB peak {entity_held:7.1f} MiB held"
+          f"   rows {read_ms:8.1f} ms {read_peak:7.1f} MiB peak {read_held:7.1f} MiB held"
+          f"   ({entity_ms / read_ms:.1f}x time, {entity_peak / read_peak:.1f}x peak)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from sqlalchemy.orm import selectinload
+    from app import create_app, db
+    from app.fx import base_amount, join_rates
+    from app.models import Tag, Transaction, TransactionTag, User
+    from app.read_models import EXPORT_COLUMNS, transaction_rows
+    from app.sharding import create_all
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        create_all()
+        rng = random.Random(42)
+        user = User(username='bench', email='bench@example.com', password='x')
+        db.session.add(user)
+        tags = [Tag(user_id=1, name=name) for name in ('work', 'trip', 'shared')]
+        db.session.add_all(tags)
+        db.session.flush()
+        total = max(args.rows)
+        seed_transactions(db, user.id, total, 5, rng, income_share=0, max_amount=500, description='purchase {i}')
+        db.session.execute(db.insert(TransactionTag), [
+            {'transaction_id': transaction_id, 'tag_id': rng.choice(tags).id, 'user_id': user.id}
+            for transaction_id in range(1, total + 1, 10)
+        ])
+        db.session.commit()
+        base = user.base_currency
+        print(f"{total:,} rows, {args.repeat} runs each\n")
+
+        def newest(query, n):
+            return query.filter(Transaction.user_id == user.id)\
+                .order_by(Transaction.date.desc(), Transaction.created_at.desc()).limit(n)
+
+        for n in sorted(args.rows):
+            report('list', n,
+                   measure(lambda: newest(Transaction.query, n).options(selectinload(Transaction.tags)).all(),
+                           args.repeat),
+                   measure(lambda: transaction_rows(newest(Transaction.query, n)), args.repeat))
+            report('export', n,
+                   measure(lambda: newest(join_rates(db.session.query(Transaction, base_amount(base))
+                                                     .select_from(Transaction), base), n).all(), args.repeat),
+                   measure(lambda: newest(join_rates(db.session.query(*EXPORT_COLUMNS,
+                                                                      base_amount(base).label('amount_base'))
+                                                     .select_from(Transaction), base), n).all(), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Time and peak memory of one recurring-transaction scheduler run.
+
+    python benchmarks/recurring.py --rules 100000
+    python benchmarks/recurring.py --rules 100000 --users 20000 --batch-size 1000
+
+Builds a throwaway SQLite database with --rules rules spread over --users
+users, all due today, then runs ``run_recurring_rules`` once (one
+occurrence per rule) and a second time to show that a rerun is a no-op.
+With --memory, peak memory is measured with tracemalloc, so it covers
+Python objects only, and the run takes several times longer.
+
+Inserting each batch with one statement and its derived state with
+grouped statements (app.events.insert_transactions) took the first run of
+``--rules 100000`` from 87.8 s to 47.0 s (about 0.5 ms per occurrence),
+and of ``--rules 20000 --users 4000`` from 18.7 s to 6.7 s, without
+--memory. Most of what remains is the derived state: anomaly statistics,
+balance checkpoints and category totals.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TestingConfig
+
+INTERVALS = ['daily', 'weekly', 'monthly', 'yearly']
+
+
+def seed(db, users, rules):
+    from app.models import RecurrenceInterval, RecurringRule, TransactionType, User
+
+    db.session.execute(db.insert(User), [
+        {'username': f'u{i}', 'email': f'u{i}@example.com', 'password': 'x'}
+        for i in range(users)
+    ])
+    user_ids = [uid for uid, in db.session.query(User.id)]
+
+    rng = random.Random(42)
+    today = date.today()
+    batch = []
+    for i in range(rules):
+        interval = RecurrenceInterval(rng.choice(INTERVALS))
+        batch.append({
+            'user_id': rng.choice(user_ids),
+            'type': TransactionType.EXPENSE,
+            'category': 'bills',
+            'amount': round(rng.uniform(1, 5000), 2),
+            'description': f'rule {i}',
+            'interval': interval,
+            'start_date': today - timedelta(days=rng.randrange(1, 3000)),
+            'next_due': today,
+            'active': True,
+        })
+        if len(batch) == 50000:
+            db.session.execute(db.insert(RecurringRule), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(RecurringRule), batch)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--memory', action='store_true', help='measure peak memory (slows the run down)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        RATELIMIT_ENABLED = False
+
+    from app import create_app, db
+    from app.transactions.utilities import run_recurring_rules
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        seed(db, args.users, args.rules)
+        print(f"Seeded {args.rules:,} rules for {args.users:,} users in {time.perf_counter() - start:.1f} s")
+
+        batch_size = args.batch_size or app.config['RECURRING_BATCH_SIZE']
+        for label in ('first run', 'rerun'):
+            if args.memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            processed, created = run_recurring_rules(batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            memory = ''
+            if args.memory:
+                memory = f"  peak {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} MiB"
+                tracemalloc.stop()
+            print(f"{label:<10} {processed:>8,} rules {created:>8,} created "
+                  f"{elapsed:>7.1f} s{memory} (batch {batch_size})")
+
+
+if __name__ == '__main__':
+    main()
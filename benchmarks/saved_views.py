@@ -0,0 +1,95 @@
+"""
+Saved views: opening a view from its cached results vs. running the list
+queries, and how many writes invalidate it.
+
+    python benchmarks/saved_views.py
+    python benchmarks/saved_views.py --rows 200000 --writes 2000
+
+Builds a throwaway SQLite database with one user holding --rows
+transactions and a saved view ("groceries this year over 50"), then times
+the view's first page and summary computed by the list queries against
+cached_view_results hitting the cache. Finally adds --writes random
+transactions through the ORM, as the add-transaction route does, and
+counts how many of them bumped the view's cache_version.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import random_transaction, seed_transactions, timed
+from config import TestingConfig
+
+# Expenses of up to 500, as the saved view filters
+EXPENSES = {'income_share': 0, 'max_amount': 500, 'description': 'purchase'}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--writes', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        CACHE_TYPE = 'SimpleCache'
+        RATELIMIT_ENABLED = False
+
+    from app import create_app, db
+    from app.ledger import rebuild_balance_checkpoints, rebuild_category_totals
+    from app.models import SavedView, Transaction, User
+    from app.saved_views import cached_view_results, view_filters
+    from app.sharding import create_all
+    from app.transactions.utilities import (build_transaction_query, get_filter_summary,
+                                            get_transaction_filters, paginate_transactions)
+
+    app = create_app(BenchConfig)
+    with app.test_request_context():
+        create_all()
+        rng = random.Random(42)
+        today = date.today()
+        user = User(username='bench', email='bench@example.com', password='x')
+        db.session.add(user)
+        db.session.flush()
+        seed_transactions(db, user.id, args.rows, args.years, rng, **EXPENSES)
+        # Bulk inserts skip the write hooks; build the rollups they maintain
+        rebuild_balance_checkpoints(user.id)
+        rebuild_category_totals(user.id)
+
+        filters = get_transaction_filters({'type': 'expense', 'category': 'grocery',
+                                           'date_from': today.replace(month=1, day=1).isoformat(),
+                                           'min_amount': '50'})
+        view = SavedView(user_id=user.id, name='groceries', filters=view_filters(filters), sort_by='date_desc')
+        db.session.add(view)
+        db.session.commit()
+
+        def compute():
+            query = build_transaction_query(user.id, filters)
+            return (get_filter_summary(query, filters, user.id),
+                    paginate_transactions(query, user.id, filters, 'date_desc', 1, 5))
+
+        cached_view_results(view, compute)
+        query_ms = timed(compute, args.repeat)
+        cached_ms = timed(lambda: cached_view_results(view, compute), args.repeat)
+        print(f"{args.rows:,} rows")
+        print(f"list queries:  {query_ms:8.2f} ms")
+        print(f"cached view:   {cached_ms:8.2f} ms  ({query_ms / cached_ms:.0f}x)\n")
+
+        version = view.cache_version
+        for _ in range(args.writes):
+            db.session.add(Transaction(**random_transaction(user.id, rng, args.years, **EXPENSES)))
+            db.session.commit()
+        bumps = db.session.get(SavedView, view.id).cache_version - version
+        print(f"{args.writes} random writes invalidated the view {bumps} times ({bumps / args.writes:.1%}); "
+              f"invalidating on every write would be {args.writes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Transaction write throughput against the number of shard databases.
+
+    python benchmarks/shards.py
+    python benchmarks/shards.py --shards 1 2 4 8 --workers 8 --writes 500
+
+For each shard count, builds throwaway SQLite databases (shard 0 plus
+SHARD_DATABASE_URIS), registers --users users, which the directory spreads
+evenly over the shards, and starts --workers processes. Each worker adds
+--writes transactions for its own users the way the add-transaction route
+does: route the session to the user's shard, add the row through the ORM
+(so the write hooks update data versions, checkpoints, totals and
+statistics) and commit. With SQLite every database has a single writer
+lock, so with one shard the workers queue behind each other; with more
+shards commits to different users proceed in parallel.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import random_transaction
+from config import TestingConfig
+
+
+def bench_config(directory, shards):
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'shard0.db')}"
+        SHARD_DATABASE_URIS = [f"sqlite:///{os.path.join(directory, f'shard{n}.db')}" for n in range(1, shards)]
+        # Waiting for the writer lock is what is being measured
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}}
+        RATELIMIT_ENABLED = False
+    return BenchConfig
+
+
+def setup(directory, shards, users):
+    from app import create_app, db
+    from app.models import User, UserShard
+    from app.sharding import create_all
+
+    app = create_app(bench_config(directory, shards))
+    with app.app_context():
+        create_all()
+        for i in range(users):
+            # One session per user, as one registration request each
+            db.session.add(User(username=f'u{i}', email=f'u{i}@example.com', password='x'))
+            db.session.commit()
+            db.session.remove()
+        return [uid for uid, in db.session.query(UserShard.id).order_by(UserShard.id)]
+
+
+def worker(directory, shards, user_ids, writes, seed, start_event, results):
+    from app import create_app, db
+    from app.models import Transaction
+    from app.sharding import use_user_shard
+
+    app = create_app(bench_config(directory, shards))
+    rng = random.Random(seed)
+    today = date.today()
+    with app.app_context():
+        start_event.wait()
+        started = time.perf_counter()
+        for i in range(writes):
+            user_id = user_ids[i % len(user_ids)]
+            db.session.remove()
+            use_user_shard(user_id)
+            db.session.add(Transaction(**random_transaction(user_id, rng, 1, income_share=0, max_amount=500,
+                                                            description=f'purchase {i}', today=today)))
+            db.session.commit()
+        results.put((started, time.perf_counter()))
+
+
+def run(shards, workers, users, writes):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        user_ids = setup(directory, shards, users)
+        start_event = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(target=worker, args=(directory, shards, user_ids[n::workers], writes, n,
+                                                 start_event, results))
+            for n in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        # Let every worker import and build its app before the clock starts
+        time.sleep(2 + workers * 0.5)
+        start_event.set()
+        spans = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+    return workers * writes / elapsed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--users', type=int, default=64)
+    parser.add_argument('--writes', type=int, default=300, help='Transactions added per worker')
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers x {args.writes} writes, {args.users} users\n")
+    print(f"{'shards':<8}{'seconds':>9}{'writes/s':>10}{'speedup':>9}")
+    baseline = None
+    for shards in args.shards:
+        throughput, elapsed = run(shards, args.workers, args.users, args.writes)
+        baseline = baseline or throughput
+        print(f"{shards:<8}{elapsed:>9.1f}{throughput:>10.0f}{throughput / baseline:>8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
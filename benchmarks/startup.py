@@ -0,0 +1,107 @@
+"""
+Cold-start benchmark for the application factory.
+
+Runs every measurement in a fresh interpreter so nothing is served from an
+already-populated sys.modules:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --budget-ms 1000
+
+Reports the slowest imports from ``python -X importtime`` and the wall time
+of ``import app`` + ``create_app()``. Exits non-zero when the median start
+exceeds the budget or when a module that should be lazy (pandas, numpy,
+PIL) is imported during startup.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only export and profile-picture code paths need these
+LAZY_MODULES = ('pandas', 'numpy', 'PIL')
+
+STARTUP_SNIPPET = '''
+import sys, time, json
+start = time.perf_counter()
+from app import create_app
+from config import TestingConfig
+create_app(TestingConfig)
+elapsed = (time.perf_counter() - start) * 1000
+heavy = sorted(m for m in {lazy!r} if m in sys.modules)
+print(json.dumps({{"ms": elapsed, "heavy": heavy}}))
+'''
+
+
+def run_startup():
+    """Time one cold create_app() in a child interpreter"""
+    import json
+
+    code = STARTUP_SNIPPET.format(lazy=LAZY_MODULES)
+    out = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_profile(limit):
+    """Return the slowest first- and second-level imports as (cumulative_us, module)"""
+    code = 'from app import create_app; from config import TestingConfig; create_app(TestingConfig)'
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, columns = line.split(':', 1)
+        _, cumulative_us, name = columns.split('|')
+        # Nesting is shown as two spaces per level; deeper rows are noise here
+        name = name[1:]
+        if not name.startswith('    '):
+            rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', 1500)))
+    parser.add_argument('--top', type=int, default=15, help='number of imports to list')
+    args = parser.parse_args()
+
+    print(f"Slowest imports (python -X importtime, top {args.top}):")
+    for cumulative_us, name in import_profile(args.top):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    timings = []
+    heavy = set()
+    for _ in range(args.runs):
+        result = run_startup()
+        timings.append(result['ms'])
+        heavy.update(result['heavy'])
+
+    median = statistics.median(timings)
+    print(f"\ncreate_app() cold start over {args.runs} runs: "
+          f"median {median:.1f} ms, min {min(timings):.1f} ms, max {max(timings):.1f} ms "
+          f"(budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: imported during startup: {', '.join(sorted(heavy))}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: median start {median:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
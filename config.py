@@ -10,8 +10,26 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///finance_tracker.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Extra shard databases (app/sharding.py), comma-separated in the
+    # environment; SQLALCHEMY_DATABASE_URI is shard 0 and holds the user
+    # directory. Writes of a user being moved by `flask shards move` are
+    # refused; the move first waits SHARD_MOVE_GRACE_SECONDS for requests
+    # that were already writing
+    SHARD_DATABASE_URIS = [uri for uri in os.getenv('SHARD_DATABASE_URIS', '').split(',') if uri]
+    SHARD_MOVE_GRACE_SECONDS = 2
+    
     # Cache settings
     CACHE_TYPE = 'simple'
+    JINJA_BYTECODE_CACHE = True
+    
+    # Response compression (brotli is used when the package is installed)
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 500  # bytes
+    COMPRESS_LEVEL = 6
+    COMPRESS_BR_QUALITY = 5
+    
+    # Fingerprinted static files written by `flask assets build`
+    STATIC_IMMUTABLE_MAX_AGE = 31536000  # one year
     
     MAIL_SERVER = 'smtp.gmail.com'
     MAIL_PORT = 587
@@ -31,10 +49,111 @@ class Config:
     REMEMBER_COOKIE_HTTPONLY = True
     REMEMBER_COOKIE_DURATION = timedelta(days=7)
     
+    # Live dashboard updates (app/live.py), on with LIVE_UPDATES=1. Every
+    # open dashboard holds a stream to /home/live, so serve that path from
+    # gevent workers (gunicorn -k gevent), where a stream is a greenlet;
+    # each process holds at most LIVE_MAX_STREAMS, below its
+    # --worker-connections. A threaded worker would spend a thread per tab
+    # and holds LIVE_THREADED_STREAMS (none by default), a sync worker none;
+    # the tabs they refuse stop asking. Each process polls for new events
+    # every LIVE_POLL_SECONDS while it has streams. Streams end after
+    # LIVE_STREAM_SECONDS and the browser reconnects, replaying what it missed
+    LIVE_UPDATES = os.getenv('LIVE_UPDATES', '').lower() in ('1', 'true', 'yes')
+    LIVE_POLL_SECONDS = 1.0
+    LIVE_MAX_STREAMS = 1000
+    LIVE_THREADED_STREAMS = 0
+    LIVE_QUEUE_SIZE = 100  # events waiting per stream before the tab is told to reload
+    LIVE_HEARTBEAT_SECONDS = 20
+    LIVE_STREAM_SECONDS = 300
+    LIVE_RETRY_MS = 3000
+    LIVE_MARK_SECONDS = 60  # how often users with open streams are marked live
+    LIVE_EVENT_RETENTION_SECONDS = 600
+    
+    # Password hashing (app/passwords.py): bcrypt runs on a pool of
+    # PASSWORD_HASH_WORKERS threads with PASSWORD_HASH_QUEUE_SIZE more
+    # requests waiting, further ones get a 503. With a target, the cost is
+    # calibrated at startup to the highest between the min and max rounds
+    # hashing within PASSWORD_HASH_TARGET_MS; BCRYPT_LOG_ROUNDS is used
+    # until then, and always without a target
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_SIZE = 16
+    PASSWORD_HASH_TARGET_MS = 250
+    PASSWORD_HASH_MIN_ROUNDS = 10
+    PASSWORD_HASH_MAX_ROUNDS = 15
+    
     # WTForms
     WTF_CSRF_TIME_LIMIT = None
     WTF_CSRF_SSL_STRICT = False
     
+    # Columnar analytics cache (app/analytics.py)
+    ANALYTICS_ENGINE = os.getenv('ANALYTICS_ENGINE', '').lower() in ('1', 'true', 'yes')
+    ANALYTICS_CACHE_BYTES = 256 * 1024 * 1024
+    
+    # Trend series (/api/trends)
+    TREND_MAX_BUCKETS = 1000
+    
+    # Delta sync (/api/sync): tombstones of deleted transactions are kept
+    # SYNC_TOMBSTONE_RETENTION_DAYS by `flask sync prune`; clients that have
+    # not synced since then start over
+    SYNC_PAGE_SIZE = 500
+    SYNC_MAX_PAGE_SIZE = 2000
+    SYNC_TOMBSTONE_RETENTION_DAYS = 90
+    
+    # Budgets: spent / limit at or above this ratio is shown as near the limit
+    BUDGET_WARNING_RATIO = 0.8
+    
+    # Saved transaction list views (app/saved_views.py): most views per user,
+    # and how long an unchanged view's summary and first page stay cached
+    SAVED_VIEWS_PER_USER = 20
+    SAVED_VIEW_CACHE_SECONDS = 24 * 3600
+    
+    # Recurring transactions (flask recurring run): rules per committed
+    # batch, and most occurrences one rule may catch up on in a single run
+    RECURRING_BATCH_SIZE = 500
+    RECURRING_MAX_CATCHUP = 400
+    
+    # Anomaly detection: an expense is flagged when it is more than
+    # ANOMALY_Z_SCORE standard deviations above its category's mean and
+    # beyond the ANOMALY_QUANTILE of earlier amounts, once the category
+    # has ANOMALY_MIN_COUNT transactions
+    ANOMALY_MIN_COUNT = 10
+    ANOMALY_Z_SCORE = 3.0
+    ANOMALY_QUANTILE = 0.99
+    
+    # Cash-flow forecast (flask forecast run, e.g. nightly): months ahead,
+    # months of history, smoothing factor, users per task and worker
+    # processes (None for one per CPU)
+    FORECAST_MONTHS = 6
+    FORECAST_HISTORY_MONTHS = 24
+    FORECAST_ALPHA = 0.3
+    FORECAST_CHUNK_SIZE = 2000
+    FORECAST_WORKERS = None
+    
+    # Exchange rates (flask fx load): days past today the last loaded rate
+    # is carried forward, so new transactions convert until the next load
+    FX_FILL_AHEAD_DAYS = 366
+    
+    # Archival (flask archive run): transactions older than the last
+    # ARCHIVE_HORIZON_YEARS whole years move to Parquet files in
+    # ARCHIVE_DIR under the instance folder
+    ARCHIVE_HORIZON_YEARS = 3
+    ARCHIVE_DIR = 'archive'
+    ARCHIVE_COMPRESSION = 'zstd'
+    
+    # Parquet and Arrow exports: rows per record batch, and the codec
+    EXPORT_BATCH_SIZE = 50000
+    EXPORT_COMPRESSION = 'zstd'
+    
+    # Logging (app/logs.py, outside debug and testing): records go through a
+    # queue of LOG_QUEUE_SIZE to a writer thread; when it is full new
+    # records are dropped and counted ('drop') or the caller waits ('block')
+    LOG_FILE = 'logs/finance_tracker.log'
+    LOG_JSON = os.getenv('LOG_JSON', '').lower() in ('1', 'true', 'yes')
+    LOG_QUEUE_SIZE = 10000
+    LOG_QUEUE_FULL = 'drop'
+    LOG_REQUESTS = True  # one line per request with status and latency
+    
     # File upload settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload size
 
@@ -45,6 +164,8 @@ class DevelopmentConfig(Config):
     TESTING = False
     SESSION_COOKIE_SECURE = False
     SQLALCHEMY_ECHO = True
+    # The development server runs each request on a thread of its own
+    LIVE_THREADED_STREAMS = 8
 
 
 class ProductionConfig(Config):
@@ -62,6 +183,8 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    JINJA_BYTECODE_CACHE = False
+    PASSWORD_HASH_TARGET_MS = None
 
 
 # Configuration selector based on environment
@@ -1,9 +1,10 @@
-"""Initialize the database with tables"""
-from app import create_app, db
+"""Create the database tables, or upgrade them to the current schema"""
+from flask_migrate import upgrade
+from app import create_app
 
 app = create_app()
 
 with app.app_context():
-    # Create all tables based on the models
-    db.create_all()
+    # Apply the migrations in migrations/versions, on every shard
+    upgrade()
     print("Database tables created successfully!")
@@ -0,0 +1,94 @@
+import logging
+import sys
+from logging.config import fileConfig
+
+from flask import current_app
+
+from alembic import context
+
+# this is the Alembic Config object, which provides
+# access to the values within the .ini file in use.
+config = context.config
+
+# Interpret the config file for Python logging.
+# This line sets up loggers basically.
+fileConfig(config.config_file_name)
+logger = logging.getLogger('alembic.env')
+
+target_db = current_app.extensions['migrate'].db
+
+
+def get_metadata():
+    if hasattr(target_db, 'metadatas'):
+        return target_db.metadatas[None]
+    return target_db.metadata
+
+
+def get_shards():
+    """
+    Shards to run the migrations on
+
+    Every shard has its own alembic_version table. Autogenerate compares
+    the models with shard 0 alone, which holds every table.
+    """
+    from app.sharding import shard_count
+    if getattr(config.cmd_opts, 'autogenerate', False):
+        return [0]
+    return list(range(shard_count()))
+
+
+def run_migrations_offline():
+    """Run migrations in 'offline' mode.
+
+    Writes the SQL of every shard to the script output, each after a
+    comment naming the shard.
+
+    """
+    from app.sharding import shard_engine
+    for shard in get_shards():
+        url = shard_engine(shard).url.render_as_string(hide_password=False)
+        context.configure(
+            url=url, target_metadata=get_metadata(), literal_binds=True
+        )
+        sys.stdout.write(f'-- shard {shard}\n')
+
+        with context.begin_transaction():
+            context.run_migrations(shard=shard)
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    Upgrades one shard after another, each on a connection of its own.
+
+    """
+
+    # this callback is used to prevent an auto-migration from being generated
+    # when there are no changes to the schema
+    # reference: http://alembic.zzzcomputing.com/en/latest/cookbook.html
+    def process_revision_directives(context, revision, directives):
+        if getattr(config.cmd_opts, 'autogenerate', False):
+            script = directives[0]
+            if script.upgrade_ops.is_empty():
+                directives[:] = []
+                logger.info('No changes in schema detected.')
+
+    from app.sharding import shard_engine
+    for shard in get_shards():
+        logger.info(f'Migrating shard {shard}')
+        with shard_engine(shard).connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=get_metadata(),
+                process_revision_directives=process_revision_directives,
+                **current_app.extensions['migrate'].configure_args
+            )
+
+            with context.begin_transaction():
+                context.run_migrations(shard=shard)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,60 @@
+"""Add change cursors and tombstones
+
+Existing transactions are numbered with app.events.backfill_change_seq,
+so a full sync returns them. With --sql, run ``flask sync backfill`` after
+applying the script instead.
+
+Revision ID: 005312714a18
+Revises: 9dac0fc91dff
+Create Date: 2026-10-19 13:30:05.836737
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+from app.events import backfill_change_seq
+
+
+# revision identifiers, used by Alembic.
+revision = '005312714a18'
+down_revision = '9dac0fc91dff'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('transaction_tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('change_seq', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('transaction_tombstone', schema=None) as batch_op:
+        batch_op.create_index('ix_transaction_tombstone_user_change_seq', ['user_id', 'change_seq'], unique=False)
+
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('change_seq', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_transaction_user_change_seq', ['user_id', 'change_seq'], unique=False)
+
+    if not context.is_offline_mode():
+        session = Session(bind=op.get_bind())
+        users = sa.table('user', sa.column('id'))
+        for user_id, in session.execute(sa.select(users.c.id).order_by(users.c.id)).all():
+            backfill_change_seq(session, user_id)
+        session.close()
+
+
+def downgrade(shard):
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_user_change_seq')
+        batch_op.drop_column('change_seq')
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('transaction_tombstone', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_tombstone_user_change_seq')
+
+    op.drop_table('transaction_tombstone')
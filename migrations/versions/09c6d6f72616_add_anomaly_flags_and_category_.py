@@ -0,0 +1,57 @@
+"""Add anomaly flags and category statistics
+
+Statistics and flags of existing expenses are computed by ``flask
+anomalies backfill``, run once after upgrading.
+
+Revision ID: 09c6d6f72616
+Revises: ecbf508fca00
+Create Date: 2026-10-19 13:34:23.052849
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '09c6d6f72616'
+down_revision = 'ecbf508fca00'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('category_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.Enum('EXPENSE', 'INCOME', name='transactiontype'), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('mean', sa.Float(), nullable=False),
+        sa.Column('m2', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'type', 'category', name='uq_category_stats')
+    )
+    op.create_table('category_stats_bucket',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.Enum('EXPENSE', 'INCOME', name='transactiontype'), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('bucket', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'type', 'category', 'bucket', name='uq_category_stats_bucket')
+    )
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('is_anomaly', sa.Boolean(), server_default=sa.false(), nullable=False))
+        batch_op.create_index('ix_transaction_user_anomaly', ['user_id', 'is_anomaly', 'date'], unique=False)
+
+
+def downgrade(shard):
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_user_anomaly')
+        batch_op.drop_column('is_anomaly')
+
+    op.drop_table('category_stats_bucket')
+    op.drop_table('category_stats')
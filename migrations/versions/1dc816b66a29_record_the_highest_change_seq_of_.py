@@ -0,0 +1,45 @@
+"""Record the highest change_seq of archive segments
+
+Existing segments get theirs from their files. With --sql they keep NULL,
+and delta syncs read their files every time, until an archive run
+rewrites them.
+
+Revision ID: 1dc816b66a29
+Revises: ca4174c80a3a
+Create Date: 2026-10-19 14:04:19.235994
+
+"""
+import os
+from alembic import context, op
+import sqlalchemy as sa
+from app.archive import archive_dir
+
+
+# revision identifiers, used by Alembic.
+revision = '1dc816b66a29'
+down_revision = 'ca4174c80a3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    with op.batch_alter_table('archive_segment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('max_change_seq', sa.Integer(), nullable=True))
+
+    if not context.is_offline_mode():
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        segments = sa.table('archive_segment', sa.column('id'), sa.column('path'), sa.column('max_change_seq'))
+        connection = op.get_bind()
+        for segment_id, path in connection.execute(sa.select(segments.c.id, segments.c.path)).all():
+            path = os.path.join(archive_dir(), path)
+            if os.path.exists(path):
+                max_change_seq = pc.max(pq.read_table(path, columns=['change_seq'])['change_seq']).as_py()
+                connection.execute(segments.update().where(segments.c.id == segment_id)
+                                   .values(max_change_seq=max_change_seq))
+
+
+def downgrade(shard):
+    with op.batch_alter_table('archive_segment', schema=None) as batch_op:
+        batch_op.drop_column('max_change_seq')
@@ -0,0 +1,55 @@
+"""Add households
+
+Households are kept next to the shard directory, on shard 0 only.
+
+Revision ID: 3474b43883e2
+Revises: ee5ce780d60b
+Create Date: 2026-10-19 13:36:28.787082
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3474b43883e2'
+down_revision = 'ee5ce780d60b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    if shard:
+        return
+    op.create_table('household',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('base_currency', sa.String(length=3), nullable=False),
+        sa.Column('invite_code', sa.String(length=16), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['created_by'], ['user_shard.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('invite_code'),
+        sqlite_autoincrement=True
+    )
+    op.create_table('household_member',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('household_id', sa.Integer(), nullable=False),
+        sa.Column('joined_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['household_id'], ['household.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user_shard.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+    with op.batch_alter_table('household_member', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_household_member_household_id'), ['household_id'], unique=False)
+
+
+def downgrade(shard):
+    if shard:
+        return
+    with op.batch_alter_table('household_member', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_household_member_household_id'))
+
+    op.drop_table('household_member')
+    op.drop_table('household')
@@ -0,0 +1,41 @@
+"""Add balance checkpoints
+
+Checkpoints of existing transactions are computed by ``flask ledger
+rebuild``, run once after upgrading.
+
+Revision ID: 5acba2995135
+Revises: 7a5ad8d45b35
+Create Date: 2026-10-19 13:33:07.353073
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5acba2995135'
+down_revision = '7a5ad8d45b35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('balance_checkpoint',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('net', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('closing_balance', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'month', name='uq_balance_checkpoint_user_month')
+    )
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.create_index('ix_transaction_user_date', ['user_id', 'date'], unique=False)
+
+
+def downgrade(shard):
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_user_date')
+
+    op.drop_table('balance_checkpoint')
@@ -0,0 +1,52 @@
+"""Add currencies and exchange rates
+
+Existing users and transactions are in INR, the currency the app showed
+before.
+
+Revision ID: 61521e741cf1
+Revises: c7ce00fc791d
+Create Date: 2026-10-19 13:34:43.975170
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '61521e741cf1'
+down_revision = 'c7ce00fc791d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('fx_rate',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('currency', sa.String(length=3), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('rate', sa.Numeric(precision=18, scale=8), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('currency', 'date', name='uq_fx_rate_currency_date'),
+        sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('base_currency', sa.String(length=3), server_default='INR', nullable=False))
+
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('currency', sa.String(length=3), server_default='INR', nullable=False))
+
+    with op.batch_alter_table('recurring_rule', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('currency', sa.String(length=3), nullable=True))
+
+
+def downgrade(shard):
+    with op.batch_alter_table('recurring_rule', schema=None) as batch_op:
+        batch_op.drop_column('currency')
+
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_column('currency')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('base_currency')
+
+    op.drop_table('fx_rate')
@@ -0,0 +1,46 @@
+"""Add transaction tags
+
+Revision ID: 75d0858d69cb
+Revises: 3474b43883e2
+Create Date: 2026-10-19 13:36:37.900826
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '75d0858d69cb'
+down_revision = '3474b43883e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('tag',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=30), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'name', name='uq_tag_user_name')
+    )
+    op.create_table('transaction_tag',
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+        sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('transaction_id', 'tag_id')
+    )
+    with op.batch_alter_table('transaction_tag', schema=None) as batch_op:
+        batch_op.create_index('ix_transaction_tag_tag', ['tag_id', 'transaction_id'], unique=False)
+
+
+def downgrade(shard):
+    with op.batch_alter_table('transaction_tag', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_tag_tag')
+
+    op.drop_table('transaction_tag')
+    op.drop_table('tag')
@@ -0,0 +1,26 @@
+"""Add user sync_horizon
+
+Revision ID: 7a5ad8d45b35
+Revises: 005312714a18
+Create Date: 2026-10-19 13:31:07.066694
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a5ad8d45b35'
+down_revision = '005312714a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_horizon', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade(shard):
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('sync_horizon')
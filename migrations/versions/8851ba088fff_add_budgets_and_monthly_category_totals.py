@@ -0,0 +1,54 @@
+"""Add budgets and monthly category totals
+
+Totals of existing transactions are computed by ``flask ledger rebuild``,
+run once after upgrading.
+
+Revision ID: 8851ba088fff
+Revises: 5acba2995135
+Create Date: 2026-10-19 13:33:24.212398
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8851ba088fff'
+down_revision = '5acba2995135'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('budget',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('monthly_limit', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'category', name='uq_budget_user_category')
+    )
+    op.create_table('monthly_category_total',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('type', sa.Enum('EXPENSE', 'INCOME', name='transactiontype'), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('total', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'month', 'type', 'category', name='uq_monthly_category_total')
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('settings_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade(shard):
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('settings_version')
+
+    op.drop_table('monthly_category_total')
+    op.drop_table('budget')
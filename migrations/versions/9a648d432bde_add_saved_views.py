@@ -0,0 +1,35 @@
+"""Add saved views
+
+Revision ID: 9a648d432bde
+Revises: 75d0858d69cb
+Create Date: 2026-10-19 13:36:45.948214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a648d432bde'
+down_revision = '75d0858d69cb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('saved_view',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('filters', sa.JSON(), nullable=False),
+        sa.Column('sort_by', sa.String(length=20), nullable=False),
+        sa.Column('cache_version', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'name', name='uq_saved_view_user_name')
+    )
+
+
+def downgrade(shard):
+    op.drop_table('saved_view')
@@ -0,0 +1,26 @@
+"""Add user data_version
+
+Revision ID: 9dac0fc91dff
+Revises: d897a4f89bf1
+Create Date: 2026-10-19 13:27:37.667201
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9dac0fc91dff'
+down_revision = 'd897a4f89bf1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade(shard):
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('data_version')
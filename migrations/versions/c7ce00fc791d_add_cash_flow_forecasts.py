@@ -0,0 +1,46 @@
+"""Add cash-flow forecasts
+
+Revision ID: c7ce00fc791d
+Revises: 09c6d6f72616
+Create Date: 2026-10-19 13:34:34.149590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7ce00fc791d'
+down_revision = '09c6d6f72616'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('balance_forecast',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('income', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('expense', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('closing_balance', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('generated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'month', name='uq_balance_forecast_user_month')
+    )
+    op.create_table('category_forecast',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'month', 'category', name='uq_category_forecast')
+    )
+
+
+def downgrade(shard):
+    op.drop_table('category_forecast')
+    op.drop_table('balance_forecast')
@@ -0,0 +1,46 @@
+"""Add live dashboard events
+
+Revision ID: ca4174c80a3a
+Revises: 9a648d432bde
+Create Date: 2026-10-19 13:36:55.247121
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ca4174c80a3a'
+down_revision = '9a648d432bde'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('live_event',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('since', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('live_event', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_live_event_created_at'), ['created_at'], unique=False)
+        batch_op.create_index('ix_live_event_user_version', ['user_id', 'version'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('live_until', sa.DateTime(), nullable=True))
+
+
+def downgrade(shard):
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('live_until')
+
+    with op.batch_alter_table('live_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_live_event_user_version')
+        batch_op.drop_index(batch_op.f('ix_live_event_created_at'))
+
+    op.drop_table('live_event')
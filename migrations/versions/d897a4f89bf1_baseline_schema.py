@@ -0,0 +1,57 @@
+"""Baseline schema
+
+The user and transaction tables as they were before migrations. Databases
+created then, with db.create_all(), already have them and only get the
+version table.
+
+Revision ID: d897a4f89bf1
+Revises: 
+Create Date: 2026-10-19 13:27:27.829032
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd897a4f89bf1'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _missing(table):
+    return context.is_offline_mode() or not sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade(shard):
+    if _missing('user'):
+        op.create_table('user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=20), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('password', sa.String(length=60), nullable=False),
+            sa.Column('image_file', sa.String(length=20), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username')
+        )
+    if _missing('transaction'):
+        op.create_table('transaction',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('type', sa.Enum('EXPENSE', 'INCOME', name='transactiontype'), nullable=False),
+            sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=False),
+            sa.Column('category', sa.String(length=50), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('date', sa.Date(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade(shard):
+    op.drop_table('transaction')
+    op.drop_table('user')
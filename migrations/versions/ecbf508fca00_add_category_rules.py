@@ -0,0 +1,39 @@
+"""Add category rules
+
+Revision ID: ecbf508fca00
+Revises: f151864d9d0c
+Create Date: 2026-10-19 13:34:09.815794
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ecbf508fca00'
+down_revision = 'f151864d9d0c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('category_rule',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('pattern', sa.String(length=100), nullable=False),
+        sa.Column('is_regex', sa.Boolean(), nullable=False),
+        sa.Column('type', sa.Enum('EXPENSE', 'INCOME', name='transactiontype'), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('category_rule', schema=None) as batch_op:
+        batch_op.create_index('ix_category_rule_user', ['user_id'], unique=False)
+
+
+def downgrade(shard):
+    with op.batch_alter_table('category_rule', schema=None) as batch_op:
+        batch_op.drop_index('ix_category_rule_user')
+
+    op.drop_table('category_rule')
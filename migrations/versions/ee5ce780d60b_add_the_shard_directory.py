@@ -0,0 +1,52 @@
+"""Add the shard directory
+
+The directory only exists on shard 0. Users created before it are all on
+shard 0 and get their entries here.
+
+Revision ID: ee5ce780d60b
+Revises: f97b27ba8ce0
+Create Date: 2026-10-19 13:35:10.818214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ee5ce780d60b'
+down_revision = 'f97b27ba8ce0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    if shard:
+        return
+    user_shard = op.create_table('user_shard',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=20), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('moving', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username'),
+        sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('user_shard', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_shard_shard'), ['shard'], unique=False)
+
+    user = sa.table('user', sa.column('id'), sa.column('username'), sa.column('email'))
+    op.execute(user_shard.insert().from_select(
+        ['id', 'username', 'email', 'shard', 'moving'],
+        sa.select(user.c.id, user.c.username, user.c.email, sa.literal(0), sa.false())
+    ))
+
+
+def downgrade(shard):
+    if shard:
+        return
+    with op.batch_alter_table('user_shard', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_shard_shard'))
+
+    op.drop_table('user_shard')
@@ -0,0 +1,55 @@
+"""Add recurring rules
+
+Revision ID: f151864d9d0c
+Revises: 8851ba088fff
+Create Date: 2026-10-19 13:33:36.883371
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f151864d9d0c'
+down_revision = '8851ba088fff'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('recurring_rule',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.Enum('EXPENSE', 'INCOME', name='transactiontype'), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('interval', sa.Enum('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY', name='recurrenceinterval'), nullable=False),
+        sa.Column('start_date', sa.Date(), nullable=False),
+        sa.Column('end_date', sa.Date(), nullable=True),
+        sa.Column('next_due', sa.Date(), nullable=False),
+        sa.Column('active', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('recurring_rule', schema=None) as batch_op:
+        batch_op.create_index('ix_recurring_rule_active_due', ['active', 'next_due'], unique=False)
+
+    # SQLite cannot add a constraint in place, so the table is copied
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recurring_rule_id', sa.Integer(), nullable=True))
+        batch_op.create_unique_constraint('uq_transaction_recurring_occurrence', ['recurring_rule_id', 'date'])
+        batch_op.create_foreign_key('fk_transaction_recurring_rule_id', 'recurring_rule', ['recurring_rule_id'], ['id'])
+
+
+def downgrade(shard):
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_transaction_recurring_rule_id', type_='foreignkey')
+        batch_op.drop_constraint('uq_transaction_recurring_occurrence', type_='unique')
+        batch_op.drop_column('recurring_rule_id')
+
+    with op.batch_alter_table('recurring_rule', schema=None) as batch_op:
+        batch_op.drop_index('ix_recurring_rule_active_due')
+
+    op.drop_table('recurring_rule')
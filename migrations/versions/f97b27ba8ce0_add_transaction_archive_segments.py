@@ -0,0 +1,41 @@
+"""Add transaction archive segments
+
+Revision ID: f97b27ba8ce0
+Revises: 61521e741cf1
+Create Date: 2026-10-19 13:34:56.963854
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f97b27ba8ce0'
+down_revision = '61521e741cf1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(shard):
+    op.create_table('archive_segment',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(length=255), nullable=False),
+        sa.Column('row_count', sa.Integer(), nullable=False),
+        sa.Column('first_date', sa.Date(), nullable=True),
+        sa.Column('last_date', sa.Date(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'year', name='uq_archive_segment_user_year')
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('archived_before', sa.Date(), nullable=True))
+
+
+def downgrade(shard):
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('archived_before')
+
+    op.drop_table('archive_segment')
@@ -3,7 +3,10 @@ WSGI entry point for production deployment.
 Use with Gunicorn or other WSGI servers.
 
 Example usage:
-    gunicorn -w 4 -b 0.0.0.0:8000 wsgi:app
+    flask --app wsgi db upgrade    # create or upgrade the tables on every shard
+    gunicorn -w 4 -k gthread --threads 32 -b 0.0.0.0:8000 wsgi:app
+    # With LIVE_UPDATES=1, serve /home/live from an evented pool as well
+    gunicorn -w 2 -k gevent --worker-connections 2000 -b 127.0.0.1:8001 wsgi:app
 """
 
 import os
@@ -14,13 +17,10 @@ dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
-from app import create_app,db
+from app import create_app
 
 # Create application instance
 app = create_app()
 
-with app.app_context():
-    db.create_all()
-
 if __name__ == '__main__':
     app.run()